@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+'''Benchmark the receive path of the built-in download tools against a local server.
+
+usage:
+  python benchmarks/bench_asyn.py [--sizes=256m,1g] [--tool=asyn|engine] [--home=path/to/lixian]
+                                  [--work-dir=dir] [--output=results.json]
+  python benchmarks/bench_asyn.py --compare old.json new.json
+
+Each file is served by the fake Xunlei server (see fake_xunlei.py) in this
+process, and downloaded by lixian_download_asyn or lixian_download_engine
+(--tool, from --home if given) in a forked child, so that the recorded CPU
+time is the client's only. The result shows the throughput and the client CPU
+seconds spent per GB.
+'''
+
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+
+import bench_util
+import fake_xunlei
+
+def download(home, tool, url, path):
+	sys.path.insert(0, home)
+	module = __import__('lixian_download_' + tool)
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w') # the progress bar
+	try:
+		module.download(url, path)
+	finally:
+		sys.stdout = stdout
+
+def run(args):
+	home = os.path.abspath(args.home or bench_util.home)
+	work_dir = args.work_dir or tempfile.mkdtemp(prefix='lixian-asyn-')
+	results = []
+	try:
+		for size in bench_util.parse_sizes(args.sizes):
+			server = fake_xunlei.start_server(tasks=1, bt_tasks=0, file_size=size)
+			try:
+				account = server.account
+				tid = account.tasks[0]['id']
+				url = account.download_url(tid, 0, account.files[tid][0])
+				path = os.path.join(work_dir, 'download.bin')
+				if os.path.exists(path):
+					os.remove(path)
+				r = bench_util.measure(download, home, args.tool, url, path)
+				if 'error' not in r:
+					assert os.path.getsize(path) == size, 'incomplete download'
+					r['throughput'] = size / r['seconds']
+					r['cpu_per_gb'] = r['cpu_seconds'] * 1024**3 / size
+				os.remove(path)
+			finally:
+				server.shutdown()
+			r['name'] = '%s/%s' % (args.tool, args.sizes.split(',')[len(results)].strip())
+			results.append(r)
+	finally:
+		if not args.work_dir:
+			shutil.rmtree(work_dir)
+	return results
+
+def main(args):
+	bench_util.benchmark_main('asyn', run, args, keys=['sizes', 'tool', 'home', 'work-dir'],
+	                          default={'sizes': '256m,1g', 'tool': 'asyn'})
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
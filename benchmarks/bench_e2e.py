@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+'''End to end benchmark of lixian commands against the local fake Xunlei server.
+
+usage:
+  python benchmarks/bench_e2e.py [--tasks=1000] [--bt-tasks=2] [--bt-files=50] [--file-size=256k]
+                                 [--add=100] [--tool=asyn] [--latency=0] [--rate=0] [--fault-rate=0]
+                                 [--repeat=3] [--output=results.json]
+  python benchmarks/bench_e2e.py --compare old.json new.json
+
+Each command runs in a fresh process (as a user would run it), in a temporary
+working directory with its own config and cookies. Times are the best of
+--repeat runs. With --tool=aria2-rpc, the files are downloaded through the
+fake aria2 of fake_aria2.py.
+'''
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import bench_util
+import fake_xunlei
+import fake_aria2
+
+lixian_cli = os.path.join(bench_util.home, 'lixian_cli.py')
+
+def run_command(work_dir, args, stdin=None):
+	env = dict(os.environ)
+	env['LIXIAN_HOME'] = work_dir
+	with open(os.devnull, 'w') as devnull:
+		start = time.time()
+		p = subprocess.Popen([sys.executable, lixian_cli] + args, cwd=work_dir, env=env, stdout=devnull, stderr=subprocess.PIPE)
+		_, err = p.communicate()
+		seconds = time.time() - start
+	if p.returncode != 0:
+		raise Exception('lx %s failed:\n%s' % (' '.join(args), err))
+	return seconds
+
+def first_line(work_dir, args):
+	'''seconds until the first line of output, and until the command exits'''
+	env = dict(os.environ)
+	env['LIXIAN_HOME'] = work_dir
+	start = time.time()
+	p = subprocess.Popen([sys.executable, lixian_cli] + args, cwd=work_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	p.stdout.readline()
+	first = time.time() - start
+	p.stdout.read()
+	p.wait()
+	if p.returncode != 0:
+		raise Exception('lx %s failed:\n%s' % (' '.join(args), p.stderr.read()))
+	return first, time.time() - start
+
+def timed(name, work_dir, args, repeat, setup=None):
+	times = []
+	for _ in range(repeat):
+		if setup:
+			setup()
+		times.append(run_command(work_dir, args))
+	return {'name': name, 'seconds': min(times), 'runs': times}
+
+def run(args):
+	server = fake_xunlei.start_server(tasks=int(args.tasks), bt_tasks=int(args.bt_tasks), bt_files=int(args.bt_files),
+	                                  file_size=bench_util.parse_size(args.file_size), latency=float(args.latency),
+	                                  rate=bench_util.parse_size(args.rate), fault_rate=float(args.fault_rate))
+	aria2 = fake_aria2.start_server(secret='bench') if args.tool == 'aria2-rpc' else None
+	work_dir = tempfile.mkdtemp(prefix='lixian-e2e-')
+	repeat = int(args.repeat)
+	results = []
+	try:
+		with open(os.path.join(work_dir, '.xunlei.lixian.config'), 'w') as x:
+			x.write('--username=fakeuser\n')
+			x.write('--password=%s\n' % ('0' * 32))
+			x.write('--api-base-url=%s\n' % server.base_url)
+			x.write('--no-colors\n')
+			if aria2:
+				x.write('--aria2-rpc=%s\n' % aria2.url)
+				x.write('--aria2-rpc-secret=bench\n')
+		cookies = ['--cookies', os.path.join(work_dir, 'cookies')]
+		results.append(timed('login', work_dir, ['login'] + cookies, 1))
+
+		results.append(timed('list', work_dir, ['list'] + cookies, repeat))
+		firsts = [first_line(work_dir, ['list'] + cookies) for _ in range(repeat)]
+		results.append({'name': 'list-first-line', 'seconds': min(x[0] for x in firsts), 'runs': [x[0] for x in firsts]})
+		results.append(timed('list-bt', work_dir, ['list', '0/'] + cookies, repeat))
+
+		input_path = os.path.join(work_dir, 'urls.txt')
+		def new_urls():
+			with open(input_path, 'w') as x:
+				for i in range(int(args.add)):
+					x.write('http://example.com/new/%d-%f.bin\n' % (i, time.time()))
+		results.append(timed('add-input', work_dir, ['add', '-i', input_path] + cookies, repeat, setup=new_urls))
+
+		output_dir = os.path.join(work_dir, 'downloads')
+		def clean_output():
+			if os.path.exists(output_dir):
+				shutil.rmtree(output_dir)
+		results.append(timed('download-bt', work_dir, ['download', '--tool', args.tool, '--output-dir', output_dir, '0'] + cookies, repeat, setup=clean_output))
+		n = min(int(args.tasks), 20)
+		ids = '%d-%d' % (int(args.bt_tasks), int(args.bt_tasks) + n - 1)
+		results.append(timed('download-%d-files' % n, work_dir, ['download', '--tool', args.tool, '--output-dir', output_dir, ids] + cookies, repeat, setup=clean_output))
+
+		results.append(timed('export-aria2', work_dir, ['export-aria2', '--all'] + cookies, repeat))
+		firsts = [first_line(work_dir, ['export-aria2', '--all'] + cookies) for _ in range(repeat)]
+		results.append({'name': 'export-aria2-first-line', 'seconds': min(x[0] for x in firsts), 'runs': [x[0] for x in firsts]})
+	finally:
+		server.shutdown()
+		if aria2:
+			aria2.shutdown()
+		shutil.rmtree(work_dir)
+	return results
+
+def main(args):
+	bench_util.benchmark_main('e2e', run, args,
+	                          keys=['tasks', 'bt-tasks', 'bt-files', 'file-size', 'add', 'tool', 'latency', 'rate', 'fault-rate', 'repeat'],
+	                          default={'tasks': '1000', 'bt-tasks': '2', 'bt-files': '50', 'file-size': '256k', 'add': '100',
+	                                   'tool': 'asyn', 'latency': '0', 'rate': '0', 'fault-rate': '0', 'repeat': '3'})
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
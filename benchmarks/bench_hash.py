@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+'''Benchmark lixian_hash, lixian_hash_ed2k and lixian_hash_bt.
+
+usage:
+  python benchmarks/bench_hash.py [--sizes=64k,16m,256m] [--dense-limit=64m]
+                                  [--bt-files=16] [--torrent-files=100,10000]
+                                  [--work-dir=dir] [--output=results.json]
+  python benchmarks/bench_hash.py --compare old.json new.json
+
+Files up to --dense-limit are filled with deterministic pseudo random data.
+Bigger files are created as sparse (all-zero) files, so that tens of GB can be
+benchmarked without the disk space, and their torrent pieces are computed
+without reading them. Generated files are kept in --work-dir if given.
+'''
+
+import os
+import os.path
+import sys
+import hashlib
+import random
+import shutil
+import tempfile
+
+import bench_util
+
+import lixian_hash
+import lixian_hash_ed2k
+import lixian_hash_bt
+
+block_size = 1024*1024
+
+def random_block(seed):
+	r = random.Random(seed)
+	return ''.join(chr(r.randint(0, 255)) for _ in range(block_size))
+
+def create_dense_file(path, size, seed):
+	block = random_block(seed)
+	with open(path, 'wb') as output:
+		i = 0
+		while size > 0:
+			# prefix each block with its index so that no two blocks are identical
+			data = ('%016x' % i) + block[16:]
+			data = data[:size]
+			output.write(data)
+			size -= len(data)
+			i += 1
+
+def create_sparse_file(path, size):
+	with open(path, 'wb') as output:
+		output.truncate(size)
+
+def create_file(path, size, dense, seed=0):
+	if os.path.exists(path) and os.path.getsize(path) == size:
+		return
+	if dense:
+		create_dense_file(path, size, seed)
+	else:
+		create_sparse_file(path, size)
+
+def choose_piece_length(total):
+	piece_length = 256*1024
+	while total / piece_length > 2000 and piece_length < 4*1024*1024:
+		piece_length *= 2
+	return piece_length
+
+def hash_pieces(paths, piece_length):
+	pieces = []
+	sha1 = hashlib.sha1()
+	left = piece_length
+	for path in paths:
+		with open(path, 'rb') as stream:
+			while True:
+				bytes = stream.read(min(left, block_size))
+				if not bytes:
+					break
+				sha1.update(bytes)
+				left -= len(bytes)
+				if not left:
+					pieces.append(sha1.digest())
+					sha1 = hashlib.sha1()
+					left = piece_length
+	if left < piece_length:
+		pieces.append(sha1.digest())
+	return ''.join(pieces)
+
+def zero_pieces(total, piece_length):
+	n, tail = divmod(total, piece_length)
+	pieces = hashlib.sha1('\0' * piece_length).digest() * n
+	if tail:
+		pieces += hashlib.sha1('\0' * tail).digest()
+	return pieces
+
+def make_info(name, paths, sizes, dense, multiple):
+	total = sum(sizes)
+	piece_length = choose_piece_length(total)
+	if dense:
+		pieces = hash_pieces(paths, piece_length)
+	else:
+		pieces = zero_pieces(total, piece_length)
+	info = {'name': name, 'piece length': piece_length, 'pieces': pieces}
+	if multiple:
+		info['files'] = [{'path': [os.path.basename(p)], 'length': s} for p, s in zip(paths, sizes)]
+	else:
+		info['length'] = sizes[0]
+	return info
+
+def synthetic_torrent(n, seed=0):
+	r = random.Random(seed)
+	files = []
+	for i in range(n):
+		files.append({'path': ['dir%d' % (i / 100), 'file-%06d.bin' % i], 'length': r.randint(1, 1024**3)})
+	total = sum(f['length'] for f in files)
+	piece_length = choose_piece_length(total)
+	npieces = (total + piece_length - 1) / piece_length
+	pieces = ''.join(chr(r.randint(0, 255)) for _ in range(npieces * 20))
+	info = {'name': 'synthetic', 'piece length': piece_length, 'pieces': pieces, 'files': files}
+	return lixian_hash_bt.bencode({'announce': 'http://127.0.0.1/announce', 'info': info})
+
+def throughput_case(name, size, fn, *args):
+	def run():
+		fn(*args)
+	r = bench_util.measure(run)
+	r['name'] = name
+	r['size'] = size
+	if 'seconds' in r and r['seconds'] > 0:
+		r['throughput'] = size / r['seconds']
+	return r
+
+def rate_case(name, count, fn, *args):
+	def run():
+		for _ in range(count):
+			fn(*args)
+	r = bench_util.measure(run)
+	r['name'] = name
+	if 'seconds' in r and r['seconds'] > 0:
+		r['rate'] = count / r['seconds']
+	return r
+
+def size_label(size):
+	for u, n in (('g', 1024**3), ('m', 1024**2), ('k', 1024)):
+		if size >= n and size % n == 0:
+			return '%d%s' % (size / n, u)
+	return str(size)
+
+def run(args):
+	sizes = bench_util.parse_sizes(args.sizes)
+	dense_limit = bench_util.parse_size(args.dense_limit)
+	bt_files = int(args.bt_files)
+	torrent_files = bench_util.parse_counts(args.torrent_files)
+
+	work_dir = args.work_dir or tempfile.mkdtemp(prefix='lixian-bench-')
+	if not os.path.exists(work_dir):
+		os.makedirs(work_dir)
+	results = []
+	try:
+		for size in sizes:
+			label = size_label(size)
+			dense = size <= dense_limit
+			path = os.path.join(work_dir, 'file-%s.bin' % label)
+			create_file(path, size, dense)
+			for name, fn in [('sha1', lixian_hash.sha1_hash_file),
+			                 ('md5', lixian_hash.md5_hash_file),
+			                 ('md4', lixian_hash.md4_hash_file),
+			                 ('dcid', lixian_hash.dcid_hash_file),
+			                 ('gcid', lixian_hash.gcid_hash_file),
+			                 ('ed2k', lixian_hash_ed2k.hash_file)]:
+				results.append(throughput_case('%s/%s' % (name, label), size, fn, path))
+
+			info = make_info(os.path.basename(path), [path], [size], dense, False)
+			results.append(throughput_case('verify_bt-single/%s' % label, size, lixian_hash_bt.verify_bt, path, info))
+
+			folder = os.path.join(work_dir, 'multi-%s' % label)
+			if not os.path.exists(folder):
+				os.makedirs(folder)
+			n = min(bt_files, max(1, size / 1024))
+			file_sizes = [size / n + (1 if i < size % n else 0) for i in range(n)]
+			paths = [os.path.join(folder, 'part-%04d.bin' % i) for i in range(n)]
+			for i, (p, s) in enumerate(zip(paths, file_sizes)):
+				create_file(p, s, dense, seed=i+1)
+			info = make_info('multi-%s' % label, paths, file_sizes, dense, True)
+			results.append(throughput_case('verify_bt-multi/%s' % label, size, lixian_hash_bt.verify_bt, folder, info))
+
+		for n in torrent_files:
+			content = synthetic_torrent(n)
+			count = max(1, 20000 / n)
+			results.append(rate_case('bdecode/%d-files' % n, count, lixian_hash_bt.bdecode, content))
+			results.append(rate_case('info_hash_from_content/%d-files' % n, count, lixian_hash_bt.info_hash_from_content, content))
+	finally:
+		if not args.work_dir:
+			shutil.rmtree(work_dir)
+	return results
+
+def main(args):
+	bench_util.benchmark_main('hash', run, args,
+	                          keys=['sizes', 'dense-limit', 'bt-files', 'torrent-files', 'work-dir'],
+	                          default={'sizes': '64k,16m,256m', 'dense-limit': '64m', 'bt-files': '16', 'torrent-files': '100,10000'})
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
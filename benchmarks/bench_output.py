@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+'''Benchmark reading back files written like concurrent downloads, with and
+without preallocation (see lixian_output.py).
+
+usage:
+  python benchmarks/bench_output.py [--files=4] [--file-size=256m] [--chunk-size=1m]
+                                    [--work-dir=dir] [--output=results.json]
+  python benchmarks/bench_output.py --compare old.json new.json
+
+--files files are written at the same time, one --chunk-size chunk of each in
+turn, through lixian_output.OutputFile. They are then synced and dropped from
+the page cache (posix_fadvise, Linux only), and read back one after another.
+The result is the read-back speed, and the number of extents of the files
+(from filefrag, if installed). --work-dir should be on the disk to test.
+'''
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import bench_util
+
+import lixian_output
+
+POSIX_FADV_DONTNEED = 4
+
+def drop_cache(path):
+	'''returns False if the pages of path can't be dropped'''
+	try:
+		import ctypes
+		import ctypes.util
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		fadvise = getattr(libc, 'posix_fadvise64', None) or libc.posix_fadvise
+		fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+	except (OSError, AttributeError):
+		return False
+	fd = os.open(path, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+		return fadvise(fd, 0, 0, POSIX_FADV_DONTNEED) == 0
+	finally:
+		os.close(fd)
+
+def count_extents(path):
+	try:
+		p = subprocess.Popen(['filefrag', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	except OSError:
+		return None
+	out = p.communicate()[0]
+	import re
+	m = re.search(r'(\d+) extents? found', out)
+	return int(m.group(1)) if m else None
+
+def write_files(paths, size, chunk_size, preallocate):
+	chunk = os.urandom(chunk_size)
+	outputs = [lixian_output.OutputFile(path, 0, size, preallocate=preallocate) for path in paths]
+	try:
+		written = 0
+		while written < size:
+			n = min(chunk_size, size - written)
+			for output in outputs:
+				output.write(buffer(chunk, 0, n))
+			written += n
+	finally:
+		for output in outputs:
+			output.close()
+
+def read_back(paths):
+	total = 0
+	for path in paths:
+		with open(path, 'rb') as x:
+			while True:
+				data = x.read(1024*1024)
+				if not data:
+					break
+				total += len(data)
+	return total
+
+def run_case(work_dir, preallocate, files, size, chunk_size):
+	paths = [os.path.join(work_dir, 'file-%d.bin' % i) for i in range(files)]
+	for path in paths:
+		if os.path.exists(path):
+			os.remove(path)
+	start = time.time()
+	write_files(paths, size, chunk_size, preallocate)
+	write_seconds = time.time() - start
+	if not all([drop_cache(path) for path in paths]):
+		print 'warning: the page cache could not be dropped, the files are read from memory'
+	result = bench_util.measure(read_back, paths)
+	if 'error' not in result:
+		result['throughput'] = files * size / result['seconds']
+		result['write_seconds'] = write_seconds
+		extents = [count_extents(path) for path in paths]
+		if None not in extents:
+			result['extents'] = sum(extents)
+	for path in paths:
+		os.remove(path)
+	result['name'] = 'read-back/%s' % ('preallocated' if preallocate else 'appended')
+	return result
+
+def run(args):
+	work_dir = args.work_dir or tempfile.mkdtemp(prefix='lixian-output-')
+	files = int(args.files)
+	size = bench_util.parse_size(args.file_size)
+	chunk_size = bench_util.parse_size(args.chunk_size)
+	try:
+		return [run_case(work_dir, preallocate, files, size, chunk_size) for preallocate in (False, True)]
+	finally:
+		if not args.work_dir:
+			shutil.rmtree(work_dir)
+
+def main(args):
+	bench_util.benchmark_main('output', run, args, keys=['files', 'file-size', 'chunk-size', 'work-dir'],
+	                          default={'files': '4', 'file-size': '256m', 'chunk-size': '1m'})
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
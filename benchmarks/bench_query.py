@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+'''Benchmark the query engine (lixian_query, lixian_queries, lixian_filter_expr
+and the filter plugins) with big synthetic task lists.
+
+usage:
+  python benchmarks/bench_query.py [--tasks=10000,100000] [--bt-files=10000] [--terms=20]
+                                   [--input-lines=1000] [--output=results.json]
+  python benchmarks/bench_query.py --compare old.json new.json
+
+No network is involved: tasks are built with lixian.convert_task from
+synthetic records, and served by an in-memory client.
+'''
+
+import sys
+import random
+
+import bench_util
+
+import lixian
+import lixian_query
+import lixian_filter_expr
+import lixian_cli_parser
+import lixian_plugins.filters
+
+extensions = ['.mkv', '.avi', '.mp4', '.rar', '.zip', '.iso', '.txt']
+
+def synthetic_records(n, seed=0):
+	r = random.Random(seed)
+	records = []
+	for i in range(n):
+		ext = extensions[i % len(extensions)]
+		name = 'Show.%04d.S%02dE%02d.720p%s' % (i / 100, r.randint(1, 20), r.randint(1, 30), ext)
+		url = 'http://example.com/%d/%s' % (i, name)
+		records.append({'id': str(1000000 + i), 'flag': '0', 'url': url, 'taskname': name,
+		                'download_status': r.choice('01222225'), 'ysfilesize': str(r.randint(1, 4*1000**3)),
+		                'lixian_url': 'http://gdl.lixian.vip.xunlei.com/download?fid=x&g=%040X&s=1' % i,
+		                'cid': '%040X' % r.getrandbits(160), 'gcid': '%040X' % i,
+		                'dt_committed': '2012-%02d-%02d 10:00:00' % (1 + i % 12, 1 + i % 28),
+		                'progress': '100', 'speed': '0'})
+	return records
+
+def synthetic_files(task, n, seed=0):
+	r = random.Random(seed)
+	files = []
+	for i in range(n):
+		name = u'%s\\Episode.%05d%s' % (task['name'], i, extensions[i % len(extensions)])
+		files.append({'id': '%s%05d' % (task['id'], i), 'index': str(i), 'type': 'bt', 'name': name,
+		              'status': 2, 'status_text': 'completed' if r.random() < 0.8 else 'downloading',
+		              'size': r.randint(1, 4*1000**3), 'original_url': 'bt://%s/%d' % (task['bt_hash'], i),
+		              'xunlei_url': 'http://gdl.lixian.vip.xunlei.com/download?fid=x&g=%040X&s=1' % i,
+		              'dcid': '%040X' % r.getrandbits(160), 'gcid': '%040X' % i,
+		              'speed': '', 'progress': '100%', 'date': task['date']})
+	return files
+
+class FakeClient:
+	def __init__(self, n, bt_files):
+		records = synthetic_records(n)
+		# make the first task a big bt task
+		records[0]['url'] = 'bt://%040x' % 1
+		records[0]['taskname'] = 'Big.BT.Pack'
+		self.records = records
+		self.bt_files = bt_files
+		self.id = '1000'
+	def read_all_tasks(self, type_id=0):
+		tasks = [t for t in map(lixian.convert_task, self.records) if not t['expired']]
+		for i, t in enumerate(tasks):
+			t['client'] = self
+			t['#'] = i
+		return tasks
+	def list_bt(self, task):
+		return synthetic_files(task, self.bt_files)
+
+def parse_args(words):
+	return lixian_cli_parser.parse_command_line(words, ['input', 'category'], ['torrent', 'all', 'completed', 'deleted', 'expired'])
+
+def search_terms(n, seed=1):
+	r = random.Random(seed)
+	return ['show.%04d' % r.randint(0, 999) for _ in range(n)]
+
+def input_lines(records, n, seed=2):
+	# what lx download -i reads: urls of existing and new tasks, ids and bt hashes
+	r = random.Random(seed)
+	lines = []
+	for i in range(n):
+		record = r.choice(records)
+		kind = i % 4
+		if kind == 0:
+			lines.append(record['url'])
+		elif kind == 1:
+			lines.append('http://example.org/new/%d/file.zip' % i)
+		elif kind == 2:
+			lines.append(record['id'])
+		else:
+			lines.append(record['cid'].lower())
+	return lines
+
+def output_tasks(tasks, columns, colors):
+	# what lx list does with the results, to /dev/null
+	import os
+	from lixian_commands.util import output_tasks
+	args = lixian_cli_parser.parse_command_line([], bools=['colors', 'format-size'], default={'colors': colors, 'format-size': True})
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		output_tasks(tasks, columns, args)
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+
+def stage(name, setup, fn):
+	r = bench_util.measure(fn, setup=setup)
+	r['name'] = name
+	return r
+
+def run(args):
+	task_counts = bench_util.parse_counts(args.tasks)
+	bt_files = bench_util.parse_size(args.bt_files)
+	terms = int(args.terms)
+	lines = int(args.input_lines)
+	lixian_query.load_default_queries()
+	results = []
+	for n in task_counts:
+		label = '%dk' % (n / 1000) if n >= 1000 else str(n)
+		def client():
+			return FakeClient(n, bt_files)
+
+		results.append(stage('fetch-convert/%s' % label,
+		                     lambda: (client(),),
+		                     lambda c: c.read_all_tasks()))
+
+		words = ['0/[0-999]/.mkv/size:1g+', '10-200', '2012.03.04', 'size:3g+', 'total-size:100g'] + search_terms(terms)
+		def base_setup(words=words):
+			c = client()
+			base = lixian_query.TaskBase(c, c.read_all_tasks)
+			base.get_tasks()
+			return base, parse_args(words)
+		results.append(stage('parse-queries/%s' % label, base_setup,
+		                     lambda base, args: lixian_query.parse_queries(base, args)))
+
+		def registered(words=words):
+			base, args = base_setup(words)
+			base.register_queries(lixian_query.parse_queries(base, args))
+			return base,
+		results.append(stage('query-once/%s' % label, registered, lambda base: base.query_once()))
+		results.append(stage('query-search/%s' % label, registered, lambda base: base.query_search()))
+		results.append(stage('text-search/%s-x%d' % (label, terms), lambda: registered(search_terms(terms)),
+		                     lambda base: base.query_search()))
+
+		def input_registered():
+			c = client()
+			return registered(input_lines(c.records, lines))
+		results.append(stage('input-lines/%s-x%d' % (label, lines), input_registered, lambda base: base.query_search()))
+		results.append(stage('parse-input/%s-x%d' % (label, lines),
+		                     lambda: base_setup(input_lines(client().records, lines)),
+		                     lambda base, args: lixian_query.parse_queries(base, args)))
+
+		def searched():
+			base, = registered()
+			base.query_search()
+			return base,
+		results.append(stage('pull-completed/%s' % label, searched, lambda base: base.pull_completed()))
+
+		def results_to_merge():
+			tasks = client().read_all_tasks()
+			# overlapping results, as produced by several queries
+			return [t for t in tasks] + tasks[::2] + tasks[::3],
+		results.append(stage('merge-tasks/%s' % label, results_to_merge, lixian_query.merge_tasks))
+
+		for name, columns in [('default', ['id', 'name', 'status']),
+		                      ('all', ['n', 'id', 'name', 'status', 'size', 'progress', 'speed', 'date', 'dcid', 'gcid', 'original-url', 'download-url'])]:
+			results.append(stage('output-tasks/%s/%s' % (name, label), lambda: (client().read_all_tasks(), columns, False), output_tasks))
+
+		for keyword in ['size:1g+', '2012.03.04', 'sort:', 'total-size:100g']:
+			results.append(stage('filter-plugin/%s/%s' % (keyword, label), lambda: (client().read_all_tasks(), keyword),
+			                     lixian_plugins.filters.filter_tasks))
+
+	def files():
+		c = FakeClient(1, bt_files)
+		return c.list_bt(c.read_all_tasks()[0]),
+	flabel = '%dk-files' % (bt_files / 1000) if bt_files >= 1000 else '%d-files' % bt_files
+	for expr in ['[0-999]', '.mkv', '[0-999]/.mkv/size:1g+', '[1-500,.mkv]/size:1g+/sort:', '[0-,.mkv]', '00123', 'Episode']:
+		results.append(stage('filter-expr/%s/%s' % (expr, flabel), files, lambda links, expr=expr: lixian_filter_expr.filter_expr(links, expr)))
+
+	# the same expression over the files of many small tasks (e.g. lx download 0-999/[0-2,.mkv])
+	def small_lists():
+		fs, = files()
+		return [fs[i:i+10] for i in range(0, len(fs), 10)],
+	for expr in ['[0-2,.mkv]', '.mkv/size:1g+']:
+		results.append(stage('filter-expr-per-task/%s/%s' % (expr, flabel), small_lists,
+		                     lambda lists, expr=expr: [lixian_filter_expr.filter_expr(links, expr) for links in lists] and None))
+
+	def files_to_merge():
+		fs, = files()
+		return fs[:len(fs)/2+100], fs[len(fs)/2-100:]
+	results.append(stage('merge-files/%s' % flabel, files_to_merge, lixian_query.merge_files))
+	return results
+
+def main(args):
+	bench_util.benchmark_main('query', run, args,
+	                          keys=['tasks', 'bt-files', 'terms', 'input-lines'],
+	                          default={'tasks': '10000,100000', 'bt-files': '10000', 'terms': '20', 'input-lines': '1000'})
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+'''Benchmark the memory and CPU cost of task and file records, compared with
+the plain dicts lixian used to build.
+
+usage:
+  python benchmarks/bench_records.py [--tasks=50000] [--bt-files=10000] [--output=results.json]
+  python benchmarks/bench_records.py --compare old.json new.json
+
+Each representation is built in its own child process; rss growth is the
+memory cost of holding the whole list.
+'''
+
+import sys
+
+import bench_util
+import bench_query
+
+import lixian
+
+status_texts = {'0':'waiting', '1':'downloading', '2':'completed', '3':'failed', '5':'pending'}
+
+def convert_task_dict(data):
+	# what lixian.convert_task used to return
+	return {'id': data['id'],
+	        'type': lixian.re.match(r'[^:]+', data['url']).group().lower(),
+	        'name': lixian.unescape_html(data['taskname']),
+	        'status': int(data['download_status']),
+	        'status_text': status_texts[data['download_status']],
+	        'expired': {'0':False, '4': True}[data['flag']],
+	        'size': int(data['ysfilesize']),
+	        'original_url': lixian.unescape_html(data['url']),
+	        'xunlei_url': data['lixian_url'] or None,
+	        'bt_hash': data['cid'],
+	        'dcid': data['cid'],
+	        'gcid': data['gcid'],
+	        'date': data['dt_committed'][:10].replace('-', '.'),
+	        'progress': '%s%%' % data['progress'],
+	        'speed': '%s' % data['speed'],
+	        }
+
+def bt_records(n):
+	records = []
+	for i in range(n):
+		url = 'http://gdl.lixian.vip.xunlei.com/download?fid=x&g=%040X&s=1' % i
+		records.append({'taskid': '1000000%05d' % i, 'id': str(i), 'title': u'Pack\\Episode.%05d.mkv' % i,
+		                'download_status': '2', 'filesize': str(i * 1000), 'url': 'bt://%040x/%d' % (1, i),
+		                'downurl': url, 'cid': '%040X' % i, 'percent': '100'})
+	return records
+
+def parse_file_dict(record):
+	# what lixian.parse_bt_list used to build for each file
+	return {'id': record['taskid'],
+	        'index': record['id'],
+	        'type': 'bt',
+	        'name': record['title'],
+	        'status': int(record['download_status']),
+	        'status_text': status_texts[record['download_status']],
+	        'size': int(record['filesize']),
+	        'original_url': record['url'],
+	        'xunlei_url': record['downurl'],
+	        'dcid': record['cid'],
+	        'gcid': lixian.parse_gcid(record['downurl']),
+	        'speed': '',
+	        'progress': '%s%%' % record['percent'],
+	        'date': '',
+	        }
+
+def parse_bt_list_dicts(js):
+	result = lixian.json.loads(lixian.re.match(r'^fill_bt_list\((.+)\)\s*$', js).group(1))['Result']
+	return map(parse_file_dict, result['Record'])
+
+def build(convert, records):
+	client = object()
+	tasks = map(convert, records)
+	for i, t in enumerate(tasks):
+		t['client'] = client
+		t['#'] = i
+	return tasks
+
+def copy_dicts(tasks):
+	return map(dict, tasks)
+
+def copy_records(tasks):
+	return [t.copy() for t in tasks]
+
+def scan(tasks):
+	# what a filter or a list does: read a few fields of every task
+	n = 0
+	for t in tasks:
+		if t['status_text'] == 'completed' and t['size'] > 0 and t['name']:
+			n += 1
+	return n
+
+def run(args):
+	n = bench_util.parse_size(args.tasks)
+	bt_files = bench_util.parse_size(args.bt_files)
+	records = bench_query.synthetic_records(n)
+	bt_list = 'fill_bt_list(%s)' % lixian.json.dumps({'Result': {'Record': bt_records(bt_files)}})
+	results = []
+	def stage(name, fn, setup):
+		r = bench_util.measure(fn, setup=setup)
+		r['name'] = name
+		results.append(r)
+	for kind, convert, copy in [('dict', convert_task_dict, copy_dicts), ('record', lixian.convert_task, copy_records)]:
+		stage('tasks-build/%s/%d' % (kind, n), lambda convert=convert: build(convert, records) and None, lambda: ())
+		stage('tasks-copy/%s/%d' % (kind, n), lambda tasks, copy=copy: copy(tasks) and None,
+		      lambda convert=convert: (build(convert, records),))
+		stage('tasks-scan/%s/%d' % (kind, n), scan, lambda convert=convert: (build(convert, records),))
+	for kind, parse in [('dict', parse_bt_list_dicts), ('record', lixian.parse_bt_list)]:
+		stage('files-parse/%s/%d' % (kind, bt_files), lambda parse=parse: parse(bt_list) and None, lambda: ())
+	return results
+
+def main(args):
+	bench_util.benchmark_main('records', run, args,
+	                          keys=['tasks', 'bt-files'],
+	                          default={'tasks': '50000', 'bt-files': '10000'})
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
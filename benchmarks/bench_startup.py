@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''Benchmark CLI startup: the time to run commands which do no network work,
+and how many modules each one imports.
+
+usage:
+  python benchmarks/bench_startup.py [--repeat=10] [--home=path/to/lixian] [--output=results.json]
+  python benchmarks/bench_startup.py --compare old.json new.json
+
+--home runs the lixian_cli.py of another checkout (e.g. created with
+`git worktree add /tmp/old HEAD~1`), so that two revisions can be compared
+with the same benchmark script.
+'''
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import bench_util
+
+cases = [('help', ['help']),
+         ('version', ['--version']),
+         ('help-command', ['help', 'download']),
+         ('config-print', ['config', '--print']),
+         ('info', ['info']),
+         ('plugin-command', ['echo', 'x'])]
+
+count_modules = '''
+import os, sys, runpy
+sys.argv = %r
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+try:
+	runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+	pass
+sys.stderr.write('modules: %%d\\n' %% len(sys.modules))
+'''
+
+def run_command(home, work_dir, args, count=False):
+	env = dict(os.environ)
+	env['LIXIAN_HOME'] = work_dir
+	lixian_cli = os.path.join(home, 'lixian_cli.py')
+	if count:
+		command = [sys.executable, '-c', count_modules % ([lixian_cli] + args)]
+	else:
+		command = [sys.executable, lixian_cli] + args
+	with open(os.devnull, 'w') as devnull:
+		start = time.time()
+		p = subprocess.Popen(command, cwd=work_dir, env=env, stdout=devnull, stderr=subprocess.PIPE)
+		_, err = p.communicate()
+		seconds = time.time() - start
+	return seconds, err
+
+def run(args):
+	home = os.path.abspath(args.home or bench_util.home)
+	repeat = int(args.repeat)
+	work_dir = tempfile.mkdtemp(prefix='lixian-startup-')
+	results = []
+	try:
+		with open(os.path.join(work_dir, '.xunlei.lixian.config'), 'w') as x:
+			x.write('--username=fakeuser\n')
+		for name, command in cases:
+			run_command(home, work_dir, command) # warm up the page cache and plugin manifest
+			times = [run_command(home, work_dir, command)[0] for _ in range(repeat)]
+			_, err = run_command(home, work_dir, command, count=True)
+			modules = [int(line.split()[1]) for line in err.splitlines() if line.startswith('modules: ')]
+			results.append({'name': name, 'seconds': min(times), 'runs': times, 'modules': modules[0] if modules else None})
+	finally:
+		shutil.rmtree(work_dir)
+	return results
+
+def main(args):
+	bench_util.benchmark_main('startup', run, args,
+	                          keys=['repeat', 'home'],
+	                          default={'repeat': '10'})
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
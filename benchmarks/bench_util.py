@@ -0,0 +1,168 @@
+
+'''Helpers shared by the benchmark scripts in this directory.
+
+Every case is run in a forked child process (when fork is available) so that
+its peak memory doesn't leak into the next case. Results are printed or saved
+as JSON, and two result files can be compared with --compare.
+'''
+
+import os
+import os.path
+import sys
+import re
+import json
+import time
+import platform
+
+home = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if home not in sys.path:
+	sys.path.insert(0, home)
+
+def parse_size(s):
+	m = re.match(r'^(\d+(?:\.\d+)?)([kmgt])?b?$', s.strip(), flags=re.I)
+	assert m, 'invalid size: ' + s
+	n, u = m.groups()
+	return int(float(n) * {None: 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4}[u and u.lower()])
+
+def parse_sizes(s):
+	return [parse_size(x) for x in s.split(',') if x.strip()]
+
+def parse_counts(s):
+	return [parse_size(x) for x in s.split(',') if x.strip()]
+
+def max_rss_kb():
+	try:
+		import resource
+	except ImportError:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if platform.system() == 'Darwin':
+		rss /= 1024
+	return rss
+
+def cpu_seconds():
+	t = os.times()
+	return t[0] + t[1]
+
+def run_case(fn, *args, **kwargs):
+	setup = kwargs.get('setup')
+	if setup:
+		args = setup()
+	rss_before = max_rss_kb()
+	cpu_start = cpu_seconds()
+	start = time.time()
+	value = fn(*args)
+	seconds = time.time() - start
+	cpu = cpu_seconds() - cpu_start
+	rss_after = max_rss_kb()
+	result = {'seconds': seconds, 'cpu_seconds': cpu, 'peak_rss_kb': rss_after}
+	if rss_before is not None:
+		result['rss_growth_kb'] = rss_after - rss_before
+	if isinstance(value, dict):
+		result.update(value)
+	return result
+
+def measure(fn, *args, **kwargs):
+	'''run fn(*args) in a child process, returning timing and memory stats.
+	fn may return a dict of extra fields to record.
+	If setup is given, it's called (untimed) to create the arguments of fn.'''
+	if not hasattr(os, 'fork'):
+		return run_case(fn, *args, **kwargs)
+	r, w = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(r)
+		try:
+			try:
+				result = run_case(fn, *args, **kwargs)
+			except Exception, e:
+				import traceback
+				traceback.print_exc()
+				result = {'error': '%s: %s' % (type(e).__name__, e)}
+			os.write(w, json.dumps(result))
+		finally:
+			os._exit(0)
+	os.close(w)
+	chunks = []
+	while True:
+		chunk = os.read(r, 65536)
+		if not chunk:
+			break
+		chunks.append(chunk)
+	os.close(r)
+	os.waitpid(pid, 0)
+	return json.loads(''.join(chunks))
+
+def git_revision():
+	import subprocess
+	try:
+		p = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=home, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		return p.communicate()[0].strip() or None
+	except OSError:
+		return None
+
+def environment():
+	return {'revision': git_revision(),
+	        'python': platform.python_version(),
+	        'platform': platform.platform(),
+	        'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def format_result(r):
+	fields = []
+	if 'error' in r:
+		return 'ERROR ' + r['error']
+	fields.append('%.3fs' % r['seconds'])
+	if r.get('throughput'):
+		fields.append('%.1f MB/s' % (r['throughput'] / 1024.0 / 1024.0))
+	if r.get('cpu_per_gb'):
+		fields.append('%.2f cpu s/GB' % r['cpu_per_gb'])
+	if r.get('rate'):
+		fields.append('%.0f /s' % r['rate'])
+	if r.get('modules'):
+		fields.append('%d modules' % r['modules'])
+	if r.get('extents') is not None:
+		fields.append('%d extents' % r['extents'])
+	if r.get('requests'):
+		fields.extend('%d %s' % (r['requests'][k], k) for k in sorted(r['requests']))
+	if r.get('rss_growth_kb') is not None:
+		fields.append('+%d KB rss' % r['rss_growth_kb'])
+	if r.get('peak_rss_kb') is not None:
+		fields.append('%d KB peak' % r['peak_rss_kb'])
+	return ', '.join(fields)
+
+def report(name, results, output=None):
+	for r in results:
+		print '%-40s %s' % (r['name'], format_result(r))
+	if output:
+		with open(output, 'w') as x:
+			json.dump({'benchmark': name, 'environment': environment(), 'results': results}, x, indent=1, sort_keys=True)
+		print 'Results saved to', output
+
+def compare(old_path, new_path):
+	with open(old_path) as x:
+		old = json.load(x)
+	with open(new_path) as x:
+		new = json.load(x)
+	old_results = dict((r['name'], r) for r in old['results'])
+	print 'old:', old['environment'].get('revision'), old['environment'].get('time')
+	print 'new:', new['environment'].get('revision'), new['environment'].get('time')
+	for r in new['results']:
+		o = old_results.get(r['name'])
+		if not o or 'error' in o or 'error' in r:
+			print '%-40s %s' % (r['name'], format_result(r))
+			continue
+		ratio = r['seconds'] / o['seconds'] if o['seconds'] else float('inf')
+		memory = ''
+		if r.get('rss_growth_kb') is not None and o.get('rss_growth_kb') is not None:
+			memory = ', rss %+d KB' % (r['rss_growth_kb'] - o['rss_growth_kb'])
+		print '%-40s %.3fs -> %.3fs (x%.2f%s)' % (r['name'], o['seconds'], r['seconds'], ratio, memory)
+
+def benchmark_main(name, run, args, keys=[], bools=[], default={}):
+	'''common command line handling: --output, --compare, plus benchmark specific options'''
+	from lixian_cli_parser import parse_command_line
+	args = parse_command_line(args, keys=['output', 'compare'] + keys, bools=bools, default=default)
+	if args.compare:
+		compare(args.compare, args[0])
+		return
+	results = run(args)
+	report(name, results, args.output)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+'''Benchmark lx download --watch-present against a BT task which is still
+being downloaded offline by the fake Xunlei server.
+
+usage:
+  python benchmarks/bench_watch.py [--tasks=2000] [--bt-files=10] [--file-size=256k]
+                                   [--offline-time=20] [--watch-interval=4s] [--tool=asyn]
+                                   [--rate=0] [--latency=0]
+                                   [--home=path/to/lixian] [--output=results.json]
+  python benchmarks/bench_watch.py --compare old.json new.json
+
+The BT files complete one after another over --offline-time seconds. The
+result is the time from start until the last file is downloaded, and how many
+task list pages and BT file lists were requested meanwhile. --rate (bytes/s)
+throttles downloads and --latency (seconds) delays every response, as in
+fake_xunlei.py.
+'''
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import bench_util
+import fake_xunlei
+
+def run(args):
+	home = os.path.abspath(args.home or bench_util.home)
+	lixian_cli = os.path.join(home, 'lixian_cli.py')
+	n = int(args.bt_files)
+	server = fake_xunlei.start_server(tasks=int(args.tasks), bt_tasks=0, file_size=bench_util.parse_size(args.file_size),
+	                                   rate=bench_util.parse_size(args.rate), latency=float(args.latency))
+	work_dir = tempfile.mkdtemp(prefix='lixian-watch-')
+	try:
+		with open(os.path.join(work_dir, '.xunlei.lixian.config'), 'w') as x:
+			x.write('--username=fakeuser\n')
+			x.write('--password=%s\n' % ('0' * 32))
+			x.write('--api-base-url=%s\n' % server.base_url)
+			x.write('--no-colors\n')
+		env = dict(os.environ)
+		env['LIXIAN_HOME'] = work_dir
+		cookies = ['--cookies', os.path.join(work_dir, 'cookies')]
+		subprocess.check_call([sys.executable, lixian_cli, 'login'] + cookies, cwd=work_dir, env=env, stdout=open(os.devnull, 'w'))
+		server.account.add_bt_task('watched-pack', ['episode-%03d.mkv' % i for i in range(n)], offline_time=float(args.offline_time))
+		server.counts.clear()
+		command = [sys.executable, lixian_cli, 'download', '--watch-present', '--watch-interval', args.watch_interval,
+		           '--tool', args.tool, '--output-dir', os.path.join(work_dir, 'downloads'), '0/*'] + cookies
+		start = time.time()
+		with open(os.devnull, 'w') as devnull:
+			p = subprocess.Popen(command, cwd=work_dir, env=env, stdout=devnull, stderr=subprocess.PIPE)
+			_, err = p.communicate()
+		seconds = time.time() - start
+		if p.returncode != 0:
+			raise Exception('lx download failed:\n%s' % err)
+		counts = dict(server.counts)
+	finally:
+		server.shutdown()
+		shutil.rmtree(work_dir)
+	return [{'name': 'watch-present/%d-files' % n, 'seconds': seconds,
+	         'requests': {'task pages': counts.get('/interface/showtask_unfresh', 0),
+	                      'bt lists': counts.get('/interface/fill_bt_list', 0)}}]
+
+def main(args):
+	bench_util.benchmark_main('watch', run, args,
+	                          keys=['tasks', 'bt-files', 'file-size', 'offline-time', 'watch-interval', 'tool', 'rate', 'latency', 'home'],
+	                          default={'tasks': '2000', 'bt-files': '10', 'file-size': '256k', 'offline-time': '20',
+	                                   'watch-interval': '4s', 'tool': 'asyn', 'rate': '0', 'latency': '0'})
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+'''A local stand-in for an aria2c --enable-rpc, for offline benchmarks of the
+aria2-rpc download tool (see lixian_aria2_rpc.py).
+
+usage:
+  python benchmarks/fake_aria2.py [--port=6800] [--secret=token]
+
+Point lixian at it with:
+  python lixian_cli.py config aria2-rpc http://127.0.0.1:6800/jsonrpc
+
+Only what lixian uses is implemented: aria2.addUri (with the dir, out, header
+and continue options; every file is downloaded with urllib2 in its own
+thread), aria2.tellStatus, aria2.removeDownloadResult,
+aria2.changeGlobalOption, aria2.getVersion and system.multicall.
+server.counts counts the calls per method.
+'''
+
+import os
+import os.path
+import sys
+import json
+import time
+import threading
+import urllib2
+import BaseHTTPServer
+import SocketServer
+
+import bench_util
+
+class Download:
+	def __init__(self, gid, uri, options):
+		self.gid = gid
+		self.uri = uri
+		self.options = options
+		self.status = 'active'
+		self.total = 0
+		self.completed = 0
+		self.error = None
+		self.start = time.time()
+
+	def path(self):
+		return os.path.join(self.options.get('dir', '.'), self.options.get('out') or os.path.basename(self.uri))
+
+	def run(self):
+		try:
+			path = self.path()
+			if not os.path.exists(os.path.dirname(path) or '.'):
+				os.makedirs(os.path.dirname(path))
+			offset = os.path.getsize(path) if self.options.get('continue') == 'true' and os.path.exists(path) else 0
+			request = urllib2.Request(self.uri)
+			for header in self.options.get('header', []):
+				k, v = header.split(':', 1)
+				request.add_header(k.strip(), v.strip())
+			if offset:
+				request.add_header('Range', 'bytes=%d-' % offset)
+			response = urllib2.build_opener(urllib2.ProxyHandler({})).open(request, timeout=60)
+			if offset and response.getcode() != 206:
+				offset = 0
+			self.completed = offset
+			self.total = offset + int(response.info().getheader('Content-Length', 0))
+			with open(path, 'r+b' if offset else 'wb') as output:
+				output.seek(offset)
+				while True:
+					data = response.read(256*1024)
+					if not data:
+						break
+					output.write(data)
+					self.completed += len(data)
+			if self.completed < self.total:
+				raise IOError('incomplete download')
+			self.status = 'complete'
+		except Exception, e:
+			self.error = str(e)
+			self.status = 'error'
+
+	def tell(self, keys):
+		status = {'gid': self.gid, 'status': self.status, 'totalLength': str(self.total), 'completedLength': str(self.completed),
+		          'downloadSpeed': str(int(self.completed / max(time.time() - self.start, 0.001))) if self.status == 'active' else '0',
+		          'errorCode': '1' if self.error else '0', 'errorMessage': self.error or ''}
+		return dict((k, status[k]) for k in keys) if keys else status
+
+class RpcError(Exception):
+	def __init__(self, code, message):
+		Exception.__init__(self, message)
+		self.code = code
+
+class Aria2:
+	def __init__(self, secret=None):
+		self.secret = secret
+		self.downloads = {}
+		self.options = {'max-concurrent-downloads': '5'}
+		self.gids = iter(xrange(1, 1 << 62))
+		self.lock = threading.Lock()
+		self.counts = {}
+
+	def call(self, method, params):
+		with self.lock:
+			self.counts[method] = self.counts.get(method, 0) + 1
+		if method == 'system.multicall':
+			results = []
+			for call in params[0]:
+				try:
+					results.append([self.call(call['methodName'], call.get('params', []))])
+				except RpcError, e:
+					results.append({'code': e.code, 'message': str(e)})
+			return results
+		if self.secret:
+			if not params or params[0] != 'token:' + self.secret:
+				raise RpcError(1, 'Unauthorized')
+			params = params[1:]
+		elif params and isinstance(params[0], basestring) and params[0].startswith('token:'):
+			params = params[1:]
+		if method == 'aria2.getVersion':
+			return {'version': '0.0.0-fake', 'enabledFeatures': []}
+		elif method == 'aria2.addUri':
+			uris, options = params[0], (params[1] if len(params) > 1 else {})
+			with self.lock:
+				gid = '%016x' % self.gids.next()
+				download = self.downloads[gid] = Download(gid, uris[0], options)
+			thread = threading.Thread(target=download.run)
+			thread.daemon = True
+			thread.start()
+			return gid
+		elif method == 'aria2.tellStatus':
+			return self.get(params[0]).tell(params[1] if len(params) > 1 else None)
+		elif method == 'aria2.removeDownloadResult':
+			with self.lock:
+				if self.get(params[0]).status == 'active':
+					raise RpcError(1, 'download %s is active' % params[0])
+				del self.downloads[params[0]]
+			return 'OK'
+		elif method == 'aria2.changeGlobalOption':
+			self.options.update(params[0])
+			return 'OK'
+		else:
+			raise RpcError(1, 'No such method: %s' % method)
+
+	def get(self, gid):
+		download = self.downloads.get(gid)
+		if download is None:
+			raise RpcError(1, 'GID %s is not found' % gid)
+		return download
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.0'
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def do_POST(self):
+		request = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))
+		try:
+			response = {'jsonrpc': '2.0', 'id': request.get('id'), 'result': self.server.aria2.call(request['method'], request.get('params', []))}
+			status = 200
+		except RpcError, e:
+			response = {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': e.code, 'message': str(e)}}
+			status = 400
+		body = json.dumps(response)
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json-rpc')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+def start_server(port=0, secret=None, verbose=False):
+	'''start the server in a background thread, returns the server; server.url is the rpc url'''
+	server = Server(('127.0.0.1', port), Handler)
+	server.url = 'http://127.0.0.1:%d/jsonrpc' % server.server_address[1]
+	server.aria2 = Aria2(secret)
+	server.counts = server.aria2.counts
+	server.verbose = verbose
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+def main(args):
+	from lixian_cli_parser import parse_command_line
+	args = parse_command_line(args, ['port', 'secret'], ['verbose'], default={'port': '6800'})
+	server = start_server(port=int(args.port), secret=args.secret, verbose=True)
+	print 'Serving fake aria2 RPC at', server.url
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+
+'''A local stand-in for the Xunlei lixian web API, for offline benchmarks.
+
+usage:
+  python benchmarks/fake_xunlei.py [--port=8000] [--tasks=100] [--bt-tasks=1] [--bt-files=10]
+                                   [--file-size=1m] [--latency=0] [--rate=0] [--fault-rate=0]
+
+Point lixian at it with:
+  python lixian_cli.py config api-base-url http://127.0.0.1:8000
+
+XunleiClient then sends its requests in proxy style, so the server sees the
+original Xunlei urls. Task download urls point at the server itself, and serve
+deterministic synthetic content (with Range support). --latency (seconds) is
+added before every response, --rate (bytes/s) throttles downloads, and
+--fault-rate is the probability of a download connection being dropped halfway.
+
+Tasks added with an offline_time (see Account.add_bt_task) are listed as
+downloading until that many seconds passed, and their BT files complete one
+after another. BT file lists are cut to the pagenum cookie, as Xunlei does.
+server.counts counts the requests served per path.
+'''
+
+import os
+import os.path
+import sys
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+import bench_util
+
+import lixian_hash_bt
+
+block_size = 64*1024
+
+shared_block = ('%0*x' % (block_size * 2, random.Random(0).getrandbits(block_size * 8))).decode('hex')
+
+class SyntheticFile:
+	'''file content is a 64KB block (derived from key) repeated'''
+	def __init__(self, key, size):
+		self.key = key
+		self.size = size
+		# a key specific head on a shared random block: content (and hashes) differ per key,
+		# but creating thousands of files stays cheap
+		head = hashlib.sha1(key).digest() * 16
+		self.block = head + shared_block[len(head):]
+		self._dcid = None
+		self._gcid = None
+	def read(self, offset, n):
+		n = min(n, self.size - offset)
+		chunks = []
+		while n > 0:
+			i = offset % block_size
+			chunk = self.block[i:i+n]
+			chunks.append(chunk)
+			offset += len(chunk)
+			n -= len(chunk)
+		return ''.join(chunks)
+	def iter_chunks(self, offset=0, chunk_size=block_size):
+		while offset < self.size:
+			chunk = self.read(offset, chunk_size)
+			offset += len(chunk)
+			yield chunk
+	def dcid(self):
+		if not self._dcid:
+			h = hashlib.sha1()
+			size = self.size
+			if size < 0xF000:
+				h.update(self.read(0, size))
+			else:
+				h.update(self.read(0, 0x5000))
+				h.update(self.read(size/3, 0x5000))
+				h.update(self.read(size-0x5000, 0x5000))
+			self._dcid = h.hexdigest().upper()
+		return self._dcid
+	def gcid(self):
+		if not self._gcid:
+			psize = 0x40000
+			while self.size / psize > 0x200 and psize < 0x200000:
+				psize = psize << 1
+			# all full pieces are identical as psize is a multiple of block_size
+			full, tail = divmod(self.size, psize)
+			h = hashlib.sha1()
+			if full:
+				h.update(hashlib.sha1(self.read(0, psize)).digest() * full)
+			if tail:
+				h.update(hashlib.sha1(self.read(full * psize, tail)).digest())
+			self._gcid = h.hexdigest().upper()
+		return self._gcid
+
+def make_torrent(name, files):
+	piece_length = 256*1024
+	pieces = []
+	sha1 = hashlib.sha1()
+	left = piece_length
+	for f in files:
+		for chunk in f.iter_chunks():
+			while chunk:
+				part = chunk[:left]
+				chunk = chunk[left:]
+				sha1.update(part)
+				left -= len(part)
+				if not left:
+					pieces.append(sha1.digest())
+					sha1 = hashlib.sha1()
+					left = piece_length
+	if left < piece_length:
+		pieces.append(sha1.digest())
+	info = {'name': name, 'piece length': piece_length, 'pieces': ''.join(pieces)}
+	if len(files) == 1 and files[0].name == name:
+		info['length'] = files[0].size
+	else:
+		info['files'] = [{'path': [f.name], 'length': f.size} for f in files]
+	return lixian_hash_bt.bencode({'announce': 'http://127.0.0.1/announce', 'info': info})
+
+class Account:
+	def __init__(self, tasks=100, bt_tasks=1, bt_files=10, file_size=1024*1024, base='http://127.0.0.1:8000'):
+		self.base = base
+		self.file_size = file_size
+		self.lock = threading.Lock()
+		self.next_id = 100000
+		self.tasks = [] # newest first, like the real thing
+		self.files = {} # task id -> [SyntheticFile]
+		self.torrents = {} # info hash -> torrent content
+		self.urls = {} # url -> task
+		self.gdriveid = 'FAKEGDRIVEID0123456789ABCDEF0123'
+		for i in range(tasks):
+			self.add_url_task('http://example.com/files/file-%05d.bin' % i)
+		# bt tasks go last, so they are listed first (#0, #1...)
+		for i in range(bt_tasks):
+			self.add_bt_task('bt-pack-%d' % i, ['episode-%03d.mkv' % j for j in range(bt_files)])
+
+	def new_id(self):
+		self.next_id += 1
+		return str(self.next_id)
+
+	def download_url(self, tid, index, f):
+		return '%s/download/%s/%s?fid=x&g=%s&s=%d' % (self.base, tid, index, f.gcid(), f.size)
+
+	def add_url_task(self, url):
+		with self.lock:
+			if url in self.urls:
+				return self.urls[url]
+			tid = self.new_id()
+			name = urllib.unquote(url.rstrip('/').split('/')[-1]) or 'index.html'
+			f = SyntheticFile(url, self.file_size)
+			f.name = name
+			self.files[tid] = [f]
+			task = {'id': tid, 'flag': '0', 'url': url, 'taskname': name,
+			        'download_status': '2', 'ysfilesize': str(f.size),
+			        'lixian_url': self.download_url(tid, 0, f),
+			        'cid': f.dcid(), 'gcid': f.gcid(),
+			        'dt_committed': time.strftime('%Y-%m-%d %H:%M:%S'),
+			        'progress': '100', 'speed': '0'}
+			self.tasks.insert(0, task)
+			self.urls[url] = task
+			return task
+
+	def add_bt_task(self, name, file_names, offline_time=None):
+		files = []
+		for n in file_names:
+			f = SyntheticFile(name + '/' + n, self.file_size)
+			f.name = n
+			files.append(f)
+		torrent = make_torrent(name, files)
+		task = self.add_bt_task_by_content(torrent)
+		if offline_time:
+			task['started_at'] = time.time()
+			task['offline_time'] = offline_time
+		return task
+
+	def offline_progress(self, task, i=None):
+		'''progress (0 to 1) of a task being downloaded offline, or of its i-th file'''
+		if 'offline_time' not in task:
+			return 1
+		n = len(self.files[task['id']])
+		ready_at = task['offline_time'] * (n if i is None else i + 1) / n
+		return min(1, (time.time() - task['started_at']) / ready_at)
+
+	def task_view(self, task):
+		'''the task as listed now'''
+		if 'offline_time' not in task:
+			return task
+		progress = self.offline_progress(task)
+		task = dict(task)
+		task['download_status'] = '2' if progress >= 1 else '1'
+		task['progress'] = str(int(progress * 100))
+		return task
+
+	def add_bt_task_by_content(self, torrent):
+		info_hash = lixian_hash_bt.info_hash_from_content(torrent)
+		with self.lock:
+			for t in self.tasks:
+				if t['cid'].lower() == info_hash:
+					return t
+			info = lixian_hash_bt.bdecode(torrent)['info']
+			tid = self.new_id()
+			if 'files' in info:
+				files = [SyntheticFile(info['name'] + '/' + '/'.join(x['path']), x['length']) for x in info['files']]
+				for f, x in zip(files, info['files']):
+					f.name = '\\'.join(x['path'])
+			else:
+				files = [SyntheticFile(info['name'] + '/' + info['name'], info['length'])]
+				files[0].name = info['name']
+			self.files[tid] = files
+			self.torrents[info_hash] = torrent
+			task = {'id': tid, 'flag': '0', 'url': 'bt://' + info_hash, 'taskname': info['name'],
+			        'download_status': '2', 'ysfilesize': str(sum(f.size for f in files)),
+			        'lixian_url': '', 'cid': info_hash.upper(), 'gcid': '',
+			        'dt_committed': time.strftime('%Y-%m-%d %H:%M:%S'),
+			        'progress': '100', 'speed': '0'}
+			self.tasks.insert(0, task)
+			return task
+
+	def find_task(self, tid):
+		for t in self.tasks:
+			if t['id'] == tid:
+				return t
+
+	def delete_tasks(self, ids):
+		with self.lock:
+			self.tasks = [t for t in self.tasks if t['id'] not in ids]
+			self.urls = dict((u, t) for u, t in self.urls.items() if t['id'] not in ids)
+
+	def bt_records(self, tid):
+		task = self.find_task(tid)
+		records = []
+		for i, f in enumerate(self.files[tid]):
+			progress = self.offline_progress(task, i)
+			records.append({'taskid': '%s%04d' % (tid, i), 'id': str(i), 'title': f.name,
+			                'download_status': '2' if progress >= 1 else '1',
+			                'filesize': str(f.size), 'url': 'bt://%s/%d' % (tid, i),
+			                'downurl': self.download_url(tid, i, f), 'cid': f.dcid(), 'percent': str(int(progress * 100))})
+		return records
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.0'
+
+	def log_message(self, format, *args):
+		if self.server.verbose:
+			BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def send(self, body, content_type='text/plain; charset=utf-8', cookies=(), status=200):
+		if self.server.latency:
+			time.sleep(self.server.latency)
+		self.send_response(status)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		for k, v in cookies:
+			self.send_header('Set-Cookie', '%s=%s; Domain=.xunlei.com; Path=/' % (k, v))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		self.route({})
+
+	def do_POST(self):
+		n = int(self.headers.get('content-length', 0))
+		body = self.rfile.read(n)
+		if 'multipart/form-data' in self.headers.get('content-type', ''):
+			form = {'_multipart': body}
+		else:
+			form = urlparse.parse_qs(body)
+		self.route(form)
+
+	def route(self, form):
+		url = urlparse.urlparse(self.path)
+		path = url.path
+		query = dict((k, v[0]) for k, v in urlparse.parse_qs(url.query).items())
+		query.update((k, v[0]) for k, v in form.items() if k != '_multipart')
+		account = self.server.account
+		jsonp = query.get('callback', 'jsonp')
+		with account.lock:
+			self.server.counts[path] = self.server.counts.get(path, 0) + 1
+
+		m = re.match(r'^/download/(\d+)/(\d+)$', path)
+		if m:
+			return self.serve_file(account.files[m.group(1)][int(m.group(2))])
+
+		if path == '/check':
+			return self.send('', cookies=[('check_result', '0:ABCD')])
+		elif path == '/sec2login/':
+			return self.send('', cookies=[('userid', '1000'), ('usernewno', 'fakeuser'), ('sessionid', 'fake-session')])
+		elif path in ('/login', '/user_task'):
+			return self.send('<html>' + ' ' * 1024 + '</html>')
+		elif path == '/interface/showtask_unfresh':
+			page = int(query.get('page', 1))
+			page_size = int(query.get('tasknum', 100))
+			tasks = map(account.task_view, account.tasks[(page-1)*page_size:page*page_size])
+			data = {'info': {'tasks': tasks, 'total_num': str(len(account.tasks)), 'user': {'cookie': account.gdriveid}},
+			        'global_new': {'page': ''}}
+			return self.send('rebuild(%s)' % json.dumps(data))
+		elif path == '/interface/menu_get':
+			return self.send('rebuild(%s)' % json.dumps({'info': []}))
+		elif path == '/interface/fill_bt_list':
+			# like Xunlei, lists as many files as the pagenum cookie says
+			cookies = dict(re.findall(r'(\w+)=([^;]*)', self.headers.getheader('Cookie', '')))
+			data = {'Result': {'Record': account.bt_records(query['tid'])[:int(cookies.get('pagenum') or 100)]}}
+			return self.send('fill_bt_list(%s)' % json.dumps(data))
+		elif path == '/interface/task_check':
+			u = query['url']
+			return self.send('queryCid(%r, %r, %r, %r, 0, 0, 0, %r)' % ('', '', str(account.file_size), u.split('/')[-1], query.get('random', '')))
+		elif path == '/interface/task_commit':
+			account.add_url_task(query['url'])
+			return self.send('ret_task(Array)')
+		elif path == '/interface/batch_task_commit':
+			urls = [urllib.unquote(query[k]) for k in sorted(query) if k.startswith('url[')]
+			for u in urls:
+				account.add_url_task(u)
+			return self.send('%s(%d)' % (jsonp, len(urls)))
+		elif path == '/interface/get_torrent':
+			torrent = account.torrents.get(query['infoid'].lower())
+			if not torrent:
+				return self.send('', status=404)
+			return self.send(torrent, content_type='application/octet-stream')
+		elif path == '/interface/torrent_upload':
+			content = form['_multipart']
+			content = content[content.index('\r\n\r\n')+4:content.rindex('\r\n--')]
+			task = account.add_bt_task_by_content(content)
+			bt = {'infoid': task['cid'].lower(), 'ftitle': task['taskname'], 'btsize': task['ysfilesize'],
+			      'filelist': [{'id': str(i), 'subsize': str(f.size)} for i, f in enumerate(account.files[task['id']])]}
+			return self.send('<script>document.domain="xunlei.com";var btResult =%s;var btRtcode = 0</script>' % json.dumps(bt))
+		elif path == '/interface/bt_task_commit':
+			return self.send('%s({"id":"%s","progress":1,"rtcode":1})' % (jsonp, account.next_id))
+		elif path == '/interface/task_delete':
+			account.delete_tasks(query.get('taskids', '').split(','))
+			return self.send('%s({"result":1,"type":2})' % jsonp)
+		elif path == '/interface/task_pause':
+			return self.send('pause_task_resp()')
+		else:
+			return self.send('not implemented: ' + path, status=404)
+
+	def serve_file(self, f):
+		if self.server.latency:
+			time.sleep(self.server.latency)
+		start = 0
+		m = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('range', ''))
+		end = f.size - 1
+		if m:
+			start = int(m.group(1))
+			if m.group(2):
+				end = min(end, int(m.group(2)))
+		length = end - start + 1
+		self.send_response(206 if m else 200)
+		self.send_header('Content-Type', 'application/octet-stream')
+		self.send_header('Content-Length', str(length))
+		if m:
+			self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, f.size))
+		self.end_headers()
+		fault_at = None
+		if self.server.fault_rate and random.random() < self.server.fault_rate:
+			fault_at = start + length / 2
+		offset = start
+		rate = self.server.rate
+		t0 = time.time()
+		while offset <= end:
+			n = min(block_size, end + 1 - offset)
+			if fault_at is not None and offset + n > fault_at:
+				self.wfile.write(f.read(offset, fault_at - offset))
+				self.wfile.flush()
+				self.close_connection = 1
+				self.connection.shutdown(2)
+				return
+			self.wfile.write(f.read(offset, n))
+			offset += n
+			if rate:
+				ahead = (offset - start) / float(rate) - (time.time() - t0)
+				if ahead > 0:
+					time.sleep(ahead)
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+def start_server(port=0, tasks=100, bt_tasks=1, bt_files=10, file_size=1024*1024, latency=0, rate=0, fault_rate=0, verbose=False):
+	'''start the server in a background thread, returns the server; server.base_url is where it listens'''
+	server = Server(('127.0.0.1', port), Handler)
+	server.base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+	server.account = Account(tasks, bt_tasks, bt_files, file_size, base=server.base_url)
+	server.latency = latency
+	server.rate = rate
+	server.fault_rate = fault_rate
+	server.verbose = verbose
+	server.counts = {}
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+def main(args):
+	from lixian_cli_parser import parse_command_line
+	args = parse_command_line(args, ['port', 'tasks', 'bt-tasks', 'bt-files', 'file-size', 'latency', 'rate', 'fault-rate'], ['verbose'],
+	                          default={'port': '8000', 'tasks': '100', 'bt-tasks': '1', 'bt-files': '10', 'file-size': '1m',
+	                                   'latency': '0', 'rate': '0', 'fault-rate': '0'})
+	server = start_server(port=int(args.port), tasks=int(args.tasks), bt_tasks=int(args.bt_tasks), bt_files=int(args.bt_files),
+	                      file_size=bench_util.parse_size(args.file_size), latency=float(args.latency),
+	                      rate=bench_util.parse_size(args.rate), fault_rate=float(args.fault_rate), verbose=True)
+	print 'Serving fake Xunlei API at', server.base_url
+	try:
+		while True:
+			time.sleep(3600)
+	except KeyboardInterrupt:
+		pass
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -8,7 +8,10 @@ import re
 import time
 import os.path
 import json
+import itertools
+import threading
 from ast import literal_eval
+from lixian_records import TaskRecord, FileRecord, parse_gcid
 
 def retry(f):
 	#retry_sleeps = [1, 1, 1]
@@ -41,10 +44,12 @@ logger = Logger()
 class XunleiClient:
 	page_size = 100
 	bt_page_size = 9999
-	def __init__(self, username=None, password=None, cookie_path=None, login=True):
+	page_concurrency = 4
+	def __init__(self, username=None, password=None, cookie_path=None, login=True, base_url=None):
 		self.username = username
 		self.password = password
 		self.cookie_path = cookie_path
+		self.lock = threading.RLock() # threads reading pages log in again one at a time, see urlread
 		if cookie_path:
 			self.cookiejar = cookielib.LWPCookieJar()
 			if os.path.exists(cookie_path):
@@ -52,7 +57,13 @@ class XunleiClient:
 		else:
 			self.cookiejar = cookielib.CookieJar()
 		self.set_page_size(self.page_size)
-		self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookiejar))
+		import lixian_resolver
+		handlers = [urllib2.HTTPCookieProcessor(self.cookiejar), PageSizeProcessor(), lixian_resolver.CachedHTTPHandler()]
+		if base_url:
+			# send every request to base_url (e.g. a local stand-in server), in proxy style,
+			# so the original urls, and the cookies scoped to .xunlei.com, are kept
+			handlers.append(urllib2.ProxyHandler({'http': base_url}))
+		self.opener = urllib2.build_opener(*handlers)
 		if login:
 			if not self.has_logged_in():
 				self.login()
@@ -67,7 +78,10 @@ class XunleiClient:
 #			print line.strip()
 		if 'data' in args and type(args['data']) == dict:
 			args['data'] = urlencode(args['data'])
-		return self.opener.open(urllib2.Request(url, **args), timeout=60)
+		page_size = args.pop('page_size', None)
+		request = urllib2.Request(url, **args)
+		request.page_size = page_size # see PageSizeProcessor
+		return self.opener.open(request, timeout=60)
 
 	def urlread1(self, url, **args):
 		args.setdefault('headers', {})
@@ -88,9 +102,12 @@ class XunleiClient:
 	def urlread(self, url, **args):
 		data = self.urlread1(url, **args)
 		if self.is_session_timeout(data):
-			logger.debug('session timed out')
-			self.login()
-			data = self.urlread1(url, **args)
+			with self.lock:
+				data = self.urlread1(url, **args) # unless another thread logged in meanwhile
+				if self.is_session_timeout(data):
+					logger.debug('session timed out')
+					self.login()
+					data = self.urlread1(url, **args)
 		return data
 
 	def load_cookies(self):
@@ -98,7 +115,8 @@ class XunleiClient:
 
 	def save_cookies(self):
 		if self.cookie_path:
-			self.cookiejar.save(self.cookie_path, ignore_discard=True)
+			with self.lock:
+				self.cookiejar.save(self.cookie_path, ignore_discard=True)
 
 	def get_cookie(self, domain, k):
 		if self.has_cookie(domain, k):
@@ -156,12 +174,9 @@ class XunleiClient:
 		if not id:
 			return False
 		#print self.urlopen('http://dynamic.cloud.vip.xunlei.com/user_task?userid=%s&st=0' % id).read().decode('utf-8')
-		self.set_page_size(1)
 		url = 'http://dynamic.cloud.vip.xunlei.com/user_task?userid=%s&st=0' % id
 		#url = 'http://dynamic.lixian.vip.xunlei.com/login?cachetime=%d' % current_timestamp()
-		r = self.is_login_ok(self.urlread(url))
-		self.set_page_size(self.page_size)
-		return r
+		return self.is_login_ok(self.urlread(url, page_size=1))
 
 	def is_session_timeout(self, html):
 		is_timeout = html == '''<script>document.cookie ="sessionid=; path=/; domain=xunlei.com"; document.cookie ="lx_sessionid=; path=/; domain=vip.xunlei.com";top.location='http://cloud.vip.xunlei.com/task.html?error=1'</script>''' or html == '''<script>document.cookie ="sessionid=; path=/; domain=xunlei.com"; document.cookie ="lsessionid=; path=/; domain=xunlei.com"; document.cookie ="lx_sessionid=; path=/; domain=vip.xunlei.com";top.location='http://cloud.vip.xunlei.com/task.html?error=2'</script>'''
@@ -193,9 +208,7 @@ class XunleiClient:
 		password = md5(password+verifycode)
 		login_page = self.urlopen('http://login.xunlei.com/sec2login/', data={'u': username, 'p': password, 'verifycode': verifycode})
 		self.id = self.get_userid()
-		self.set_page_size(1)
-		login_page = self.urlopen('http://dynamic.lixian.vip.xunlei.com/login?cachetime=%d&from=0'%current_timestamp()).read()
-		self.set_page_size(self.page_size)
+		login_page = self.urlopen('http://dynamic.lixian.vip.xunlei.com/login?cachetime=%d&from=0'%current_timestamp(), page_size=1).read()
 		if not self.is_login_ok(login_page):
 			logger.trace(login_page)
 			raise RuntimeError('login failed')
@@ -218,6 +231,14 @@ class XunleiClient:
 		self.save_cookies()
 
 	def read_task_page_url(self, url):
+		tasks, current_page, total_pages = self.read_task_page_info(url)
+		if current_page < total_pages:
+			next = re.sub(r'page=(\d+)', 'page=%d' % (current_page + 1), url)
+		else:
+			next = None
+		return tasks, next
+
+	def read_task_page_info(self, url):
 		page = self.urlread(url).decode('utf-8', 'ignore')
 		data = parse_json_response(page)
 		if not self.has_gdriveid():
@@ -236,13 +257,9 @@ class XunleiClient:
 		if total_pages == 0:
 			total_pages = 1
 		assert total_pages >= data['global_new']['page'].count('<li><a')
-		if current_page < total_pages:
-			next = re.sub(r'page=(\d+)', 'page=%d' % (current_page + 1), url)
-		else:
-			next = None
-		return tasks, next
+		return tasks, current_page, total_pages
 
-	def read_task_page(self, type_id, page=1):
+	def task_page_url(self, type_id, page=1):
 		# type_id: 1 for downloading, 2 for completed, 4 for downloading+completed+expired, 11 for deleted, 13 for expired
 		if type_id == 0:
 			type_id = 4
@@ -251,7 +268,10 @@ class XunleiClient:
 		# jsonp = 'jsonp%s' % current_timestamp()
 		# url = 'http://dynamic.cloud.vip.xunlei.com/interface/showtask_unfresh?type_id=%s&page=%s&tasknum=%s&p=%s&interfrom=task&callback=%s' % (type_id, page, page_size, p, jsonp)
 		url = 'http://dynamic.cloud.vip.xunlei.com/interface/showtask_unfresh?type_id=%s&page=%s&tasknum=%s&p=%s&interfrom=task' % (type_id, page, page_size, p)
-		return self.read_task_page_url(url)
+		return url
+
+	def read_task_page(self, type_id, page=1):
+		return self.read_task_page_url(self.task_page_url(type_id, page))
 
 	def read_tasks(self, type_id=0):
 		'''read one page'''
@@ -263,15 +283,25 @@ class XunleiClient:
 	def read_all_tasks(self, type_id=0):
 		'''read all pages'''
 		all_tasks = []
-		tasks, next_link = self.read_task_page(type_id)
-		all_tasks.extend(tasks)
-		while next_link:
-			tasks, next_link = self.read_task_page_url(next_link)
+		for tasks in self.iter_task_pages(type_id):
 			all_tasks.extend(tasks)
-		for i, task in enumerate(all_tasks):
-			task['#'] = i
 		return all_tasks
 
+	def iter_task_pages(self, type_id=0, concurrency=None):
+		'''read all pages, yielding the tasks of each page as soon as it (and all pages before it) arrived.
+		pages after the first one are fetched concurrently, by up to concurrency (default: page_concurrency) threads.
+		tasks are numbered (#) across pages, the same way as read_all_tasks.'''
+		first_url = self.task_page_url(type_id)
+		tasks, current_page, total_pages = self.read_task_page_info(first_url)
+		urls = [re.sub(r'page=(\d+)', 'page=%d' % page, first_url) for page in range(current_page + 1, total_pages + 1)]
+		pages = imap_ordered(lambda url: self.read_task_page_info(url)[0], urls, concurrency or self.page_concurrency)
+		i = 0
+		for tasks in itertools.chain([tasks], pages):
+			for task in tasks:
+				task['#'] = i
+				i += 1
+			yield tasks
+
 	def read_completed(self):
 		'''read first page of completed tasks'''
 		return self.read_tasks(2)
@@ -360,15 +390,15 @@ class XunleiClient:
 	def read_all_expired(self):
 		return self.read_all_history(1)
 
-	def list_bt(self, task):
+	def list_bt(self, task, fields=None):
+		'''the files of a bt task. with fields (task keys), the files may have only these.'''
 		assert task['type'] == 'bt'
 		url = 'http://dynamic.cloud.vip.xunlei.com/interface/fill_bt_list?callback=fill_bt_list&tid=%s&infoid=%s&g_net=1&p=1&uid=%s&noCacheIE=%s' % (task['id'], task['bt_hash'], self.id, current_timestamp())
-		self.set_page_size(self.bt_page_size)
-		html = remove_bom(self.urlread(url)).decode('utf-8')
-		self.set_page_size(self.page_size)
-		sub_tasks = parse_bt_list(html)
-		for t in sub_tasks:
-			t['date'] = task['date']
+		html = remove_bom(self.urlread(url, page_size=self.bt_page_size)).decode('utf-8')
+		sub_tasks = parse_bt_list(html, fields)
+		if fields is None or 'date' in fields:
+			for t in sub_tasks:
+				t['date'] = task['date']
 		return sub_tasks
 
 	def get_torrent_file_by_info_hash(self, info_hash):
@@ -610,6 +640,70 @@ class XunleiClient:
 		raise Exception('No task found for id '+id)
 
 
+class PageSizeProcessor(urllib2.BaseHandler):
+	'''sends request.page_size (if set) as the pagenum cookie, in place of the one in the cookie jar.
+	the cookie jar is shared by the threads reading pages, so the page size of one request
+	mustn't be set there.'''
+	handler_order = 600 # after HTTPCookieProcessor
+
+	def http_request(self, request):
+		page_size = getattr(request, 'page_size', None)
+		if page_size is not None:
+			cookie = request.unredirected_hdrs.get('Cookie', '')
+			pagenum = 'pagenum=%d' % page_size
+			if re.search(r'(^|; )pagenum=', cookie):
+				cookie = re.sub(r'(^|; )pagenum=[^;]*', r'\g<1>' + pagenum, cookie)
+			else:
+				cookie = cookie + '; ' + pagenum if cookie else pagenum
+			request.add_unredirected_header('Cookie', cookie)
+		return request
+
+	https_request = http_request
+
+def imap_ordered(f, items, concurrency):
+	'''like itertools.imap, but calls f in up to concurrency threads. results are still yielded in order.'''
+	items = list(items)
+	if concurrency <= 1 or len(items) <= 1:
+		for x in items:
+			yield f(x)
+		return
+	import threading
+	import sys
+	results = {}
+	next_item = [0]
+	lock = threading.Condition()
+	def worker():
+		while True:
+			with lock:
+				i = next_item[0]
+				if i >= len(items):
+					return
+				next_item[0] += 1
+			try:
+				result = True, f(items[i])
+			except:
+				result = False, sys.exc_info()
+			with lock:
+				results[i] = result
+				lock.notify_all()
+	for _ in range(min(concurrency, len(items))):
+		thread = threading.Thread(target=worker)
+		thread.daemon = True
+		thread.start()
+	try:
+		for i in range(len(items)):
+			with lock:
+				while i not in results:
+					lock.wait(1) # with a timeout, so that Ctrl-C still works
+				ok, result = results.pop(i)
+			if not ok:
+				raise result[0], result[1], result[2]
+			yield result
+	finally:
+		# stop the workers from starting more work
+		with lock:
+			next_item[0] = len(items)
+
 def current_timestamp():
 	return int(time.time()*1000)
 
@@ -619,22 +713,21 @@ def current_random():
 
 def convert_task(data):
 	expired = {'0':False, '4': True}[data['flag']]
-	task = {'id': data['id'],
-			'type': re.match(r'[^:]+', data['url']).group().lower(),
-			'name': unescape_html(data['taskname']),
-			'status': int(data['download_status']),
-			'status_text': {'0':'waiting', '1':'downloading', '2':'completed', '3':'failed', '5':'pending'}[data['download_status']],
-			'expired': expired,
-			'size': int(data['ysfilesize']),
-			'original_url': unescape_html(data['url']),
-			'xunlei_url': data['lixian_url'] or None,
-			'bt_hash': data['cid'],
-			'dcid': data['cid'],
-			'gcid': data['gcid'],
-			'date': data['dt_committed'][:10].replace('-', '.'),
-			'progress': '%s%%' % data['progress'],
-			'speed': '%s' % data['speed'],
-			}
+	task = TaskRecord()
+	task.id = data['id']
+	task.type = re.match(r'[^:]+', data['url']).group().lower()
+	task.name = unescape_html(data['taskname'])
+	task.status = int(data['download_status'])
+	task.expired = expired
+	task.size = int(data['ysfilesize'])
+	task.original_url = unescape_html(data['url'])
+	task.xunlei_url = data['lixian_url'] or None
+	task.bt_hash = data['cid']
+	task.dcid = data['cid']
+	task.gcid = data['gcid']
+	task.date = data['dt_committed'][:10].replace('-', '.')
+	task.progress = '%s%%' % data['progress']
+	task.speed = '%s' % data['speed']
 	return task
 
 def parse_json_response(html):
@@ -663,18 +756,17 @@ def parse_task(html):
 	taskid = mini_map['taskname'][8:]
 	url = mini_info['f_url']
 	task_type = re.match(r'[^:]+', url).group().lower()
-	task = {'id': taskid,
-	        'type': task_type,
-	        'name': mini_info['taskname'],
-	        'status': int(mini_info['d_status']),
-	        'status_text': {'0':'waiting', '1':'downloading', '2':'completed', '3':'failed', '5':'pending'}[mini_info['d_status']],
-	        'size': int(mini_info.get('ysfilesize', 0)),
-	        'original_url': mini_info['f_url'],
-	        'xunlei_url': mini_info.get('dl_url', None),
-	        'bt_hash': mini_info['dcid'],
-	        'dcid': mini_info['dcid'],
-	        'gcid': parse_gcid(mini_info.get('dl_url', None)),
-	        }
+	task = TaskRecord()
+	task.id = taskid
+	task.type = task_type
+	task.name = mini_info['taskname']
+	task.status = int(mini_info['d_status'])
+	task.size = int(mini_info.get('ysfilesize', 0))
+	task.original_url = mini_info['f_url']
+	task.xunlei_url = mini_info.get('dl_url', None)
+	task.bt_hash = mini_info['dcid']
+	task.dcid = mini_info['dcid']
+	# gcid is parsed from xunlei_url when needed
 
 	m = re.search(r'<em class="loadnum"[^<>]*>([^<>]*)</em>', html)
 	task['progress'] = m and m.group(1) or ''
@@ -690,35 +782,47 @@ def parse_history(html):
 	rw_lists = re.findall(r'<div class="rw_list".*?<input id="d_tasktype\d+"[^<>]*/>', rwbox, re.S)
 	return map(parse_task, rw_lists)
 
-def parse_bt_list(js):
+def parse_bt_list(js, fields=None):
+	'''the files of a bt list. with fields, only these keys are parsed (and id, index, type and status)'''
 	result = json.loads(re.match(r'^fill_bt_list\((.+)\)\s*$', js).group(1))['Result']
+	if fields is None:
+		fields = bt_file_fields
+	name = 'name' in fields
+	size = 'size' in fields
+	original_url = 'original_url' in fields
+	xunlei_url = 'xunlei_url' in fields or 'gcid' in fields
+	dcid = 'dcid' in fields
+	speed = 'speed' in fields
+	progress = 'progress' in fields
+	date = 'date' in fields
 	files = []
 	for record in result['Record']:
-		files.append({
-			'id': record['taskid'],
-			'index': record['id'],
-			'type': 'bt',
-			'name': record['title'], # TODO: support folder
-			'status': int(record['download_status']),
-			'status_text': {'0':'waiting', '1':'downloading', '2':'completed', '3':'failed', '5':'pending'}[record['download_status']],
-			'size': int(record['filesize']),
-			'original_url': record['url'],
-			'xunlei_url': record['downurl'],
-			'dcid': record['cid'],
-			'gcid': parse_gcid(record['downurl']),
-			'speed': '',
-			'progress': '%s%%' % record['percent'],
-			'date': '',
-			})
+		f = FileRecord()
+		f.id = record['taskid']
+		f.index = record['id']
+		f.type = 'bt'
+		f.status = int(record['download_status'])
+		if name:
+			f.name = record['title'] # TODO: support folder
+		if size:
+			f.size = int(record['filesize'])
+		if original_url:
+			f.original_url = record['url']
+		if xunlei_url:
+			f.xunlei_url = record['downurl']
+		if dcid:
+			f.dcid = record['cid']
+		# gcid is parsed from xunlei_url when needed
+		if speed:
+			f.speed = ''
+		if progress:
+			f.progress = '%s%%' % record['percent']
+		if date:
+			f.date = ''
+		files.append(f)
 	return files
 
-def parse_gcid(url):
-	if not url:
-		return
-	m = re.search(r'&g=([A-F0-9]{40})&', url)
-	if not m:
-		return
-	return m.group(1)
+bt_file_fields = frozenset(['name', 'size', 'original_url', 'xunlei_url', 'dcid', 'speed', 'progress', 'date'])
 
 def urlencode(x):
 	def unif8(u):
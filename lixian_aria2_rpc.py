@@ -0,0 +1,181 @@
+
+'''Downloads through one aria2c process, over its JSON-RPC interface.
+
+The aria2 download tool runs a new aria2c for every file. The aria2-rpc tool
+(and lx download-aria2 --rpc) instead attaches to the aria2c listening at
+aria2-rpc in the config (http://127.0.0.1:6800/jsonrpc by default, with
+aria2-rpc-secret as the token, if any). If nothing listens there and it's a
+local address, an aria2c --enable-rpc is started (with aria2-opts), which
+stays up for the following files and exits with lx. The global options of an
+aria2c which was already running are left alone.
+
+Files are added with aria2.addUri, with their own options (dir, out, the
+gdriveid cookie, continue), and the status of all the files being waited for
+is read with one system.multicall per poll.
+'''
+
+__all__ = ['Aria2Error', 'Aria2Rpc', 'get_rpc', 'add_file', 'wait', 'download']
+
+import os
+import os.path
+import sys
+import json
+import itertools
+from time import time, sleep
+
+class Aria2Error(Exception):
+	pass
+
+class Aria2Rpc:
+	def __init__(self, url, secret=None, timeout=30):
+		self.url = url
+		self.secret = secret
+		self.timeout = timeout
+		self.ids = itertools.count(1)
+
+	def params(self, params):
+		if self.secret:
+			return ['token:' + self.secret] + list(params)
+		return list(params)
+
+	def request(self, method, params):
+		import urllib2
+		import lixian_resolver
+		body = json.dumps({'jsonrpc': '2.0', 'id': str(self.ids.next()), 'method': method, 'params': params})
+		request = urllib2.Request(self.url, body, {'Content-Type': 'application/json'})
+		try:
+			response = lixian_resolver.urlopen(request, timeout=self.timeout)
+		except urllib2.HTTPError, e:
+			response = e # aria2 answers errors with a status code, and the error in the body
+		try:
+			result = json.loads(response.read())
+		except ValueError:
+			raise Aria2Error('invalid response from %s' % self.url)
+		if 'error' in result:
+			raise Aria2Error('%s: %s' % (method, result['error'].get('message')))
+		return result['result']
+
+	def call(self, method, *params):
+		return self.request(method, self.params(params))
+
+	def multicall(self, calls):
+		'''calls [(method, params)...] in one request. returns the result of each call, or an Aria2Error.'''
+		if not calls:
+			return []
+		results = self.request('system.multicall', [[{'methodName': method, 'params': self.params(params)} for method, params in calls]])
+		return [r[0] if isinstance(r, list) else Aria2Error(r.get('message')) for r in results]
+
+	def available(self):
+		import urllib2
+		import socket
+		try:
+			self.call('aria2.getVersion')
+			return True
+		except (urllib2.URLError, socket.error):
+			return False
+
+rpc = None
+started = False # whether rpc is an aria2c started by lx
+paths = {} # gid -> path, of the files added
+
+def start_aria2c(url, secret):
+	import re
+	import subprocess
+	m = re.match(r'^https?://(127\.0\.0\.1|localhost)(?::(\d+))?/', url)
+	if not m:
+		return False
+	from lixian_config import get_config
+	opts = ['aria2c', '--enable-rpc', '--rpc-listen-port=%s' % (m.group(2) or '80'), '--stop-with-process=%d' % os.getpid(), '--quiet']
+	if secret:
+		opts.append('--rpc-secret=' + secret)
+	opts.extend(get_config('aria2-opts', '').split())
+	from lixian_download_tools import check_bin
+	check_bin(opts[0])
+	with open(os.devnull, 'w') as devnull:
+		subprocess.Popen(opts, stdin=devnull, stdout=devnull, stderr=devnull)
+	return True
+
+def get_rpc():
+	'''the aria2c to use, started if needed'''
+	global rpc, started
+	if rpc is None:
+		from lixian_config import get_config
+		url = get_config('aria2-rpc', 'http://127.0.0.1:6800/jsonrpc')
+		secret = get_config('aria2-rpc-secret')
+		client = Aria2Rpc(url, secret)
+		if not client.available():
+			if not start_aria2c(url, secret):
+				raise Aria2Error("can't connect to aria2 at %s" % url)
+			deadline = time() + 10
+			while not client.available():
+				if time() > deadline:
+					raise Aria2Error('aria2c started, but not listening at %s' % url)
+				sleep(0.1)
+			started = True
+		rpc = client
+	return rpc
+
+def add_file(url, path, headers=None, resuming=False):
+	'''adds a file to aria2, returns its gid'''
+	# dir is always given: aria2c runs in its own working directory
+	options = {'dir': os.path.abspath(os.path.dirname(path) or '.'), 'out': os.path.basename(path), 'file-allocation': 'none',
+	           'continue': 'true' if resuming else 'false', 'allow-overwrite': 'false' if resuming else 'true'}
+	if headers:
+		options['header'] = ['%s: %s' % (k, headers[k]) for k in headers]
+	gid = get_rpc().call('aria2.addUri', [url], options)
+	paths[gid] = path
+	return gid
+
+status_keys = ['gid', 'status', 'totalLength', 'completedLength', 'errorCode', 'errorMessage']
+
+def wait(gids, interval=0.5, progress=True):
+	'''waits for gids to complete, polling them all at once (every interval seconds, sooner at
+	first: small files are done before the first poll). raises Aria2Error if any failed.'''
+	import lixian_progress
+	client = get_rpc()
+	waiting = list(gids)
+	errors = []
+	transfers = dict((gid, lixian_progress.transfer(paths.get(gid, gid), tool='aria2-rpc')) for gid in gids) if progress else {}
+	delay = 0.02
+	try:
+		while waiting:
+			statuses = client.multicall([('aria2.tellStatus', [gid, status_keys]) for gid in waiting])
+			still_waiting = []
+			for gid, status in zip(waiting, statuses):
+				if isinstance(status, Aria2Error):
+					error = '%s: %s' % (gid, status)
+				elif status['status'] in ('error', 'removed'):
+					error = status.get('errorMessage') or 'aria2 error %s' % status.get('errorCode')
+				else:
+					error = None
+					if gid in transfers:
+						transfers[gid].update(int(status['completedLength']), int(status['totalLength']) or None)
+					if status['status'] == 'complete':
+						if gid in transfers:
+							transfers.pop(gid).done()
+					else:
+						still_waiting.append(gid)
+				if error:
+					errors.append(error)
+					if gid in transfers:
+						transfers.pop(gid).failed(error)
+			for gid in waiting:
+				if gid not in still_waiting:
+					try:
+						client.call('aria2.removeDownloadResult', gid)
+					except Aria2Error:
+						pass
+			waiting = still_waiting
+			if waiting:
+				sleep(delay)
+				delay = min(delay * 2, interval)
+	finally:
+		for gid in transfers:
+			transfers[gid].failed('interrupted')
+		for gid in gids:
+			paths.pop(gid, None)
+	if errors:
+		raise Aria2Error(errors[0] if len(errors) == 1 else '%d downloads failed: %s' % (len(errors), '; '.join(errors)))
+
+def download(url, path, headers=None, resuming=False):
+	wait([add_file(url, path, headers=headers, resuming=resuming)])
@@ -4,23 +4,27 @@ from lixian_commands.util import *
 import lixian_help
 import sys
 
-from lixian_commands.login import login
-from lixian_commands.logout import logout
-from lixian_commands.download import download_task
-from lixian_commands.list import list_task
-from lixian_commands.add import add_task
-from lixian_commands.delete import delete_task
-from lixian_commands.pause import pause_task
-from lixian_commands.restart import restart_task
-from lixian_commands.rename import rename_task
-from lixian_commands.readd import readd_task
-from lixian_commands.info import lixian_info
-from lixian_commands.config import lx_config
-from lixian_commands.help import lx_help
+# builtin commands are imported only when they run
+builtin_commands = {'login': ('lixian_commands.login', 'login'),
+                    'logout': ('lixian_commands.logout', 'logout'),
+                    'download': ('lixian_commands.download', 'download_task'),
+                    'list': ('lixian_commands.list', 'list_task'),
+                    'add': ('lixian_commands.add', 'add_task'),
+                    'delete': ('lixian_commands.delete', 'delete_task'),
+                    'pause': ('lixian_commands.pause', 'pause_task'),
+                    'restart': ('lixian_commands.restart', 'restart_task'),
+                    'rename': ('lixian_commands.rename', 'rename_task'),
+                    'readd': ('lixian_commands.readd', 'readd_task'),
+                    'info': ('lixian_commands.info', 'lixian_info'),
+                    'config': ('lixian_commands.config', 'lx_config'),
+                    'help': ('lixian_commands.help', 'lx_help')}
+
+def builtin_command(name):
+	module, attr = builtin_commands[name]
+	return getattr(__import__(module, fromlist=[attr]), attr)
 
 
 def execute_command(args=sys.argv[1:]):
-	import lixian_plugins # load plugins at import
 	if not args:
 		usage()
 		sys.exit(1)
@@ -34,30 +38,21 @@ def execute_command(args=sys.argv[1:]):
 			usage()
 			sys.exit(1)
 		sys.exit(0)
+	import lixian_plugins # register plugins at import
 	import lixian_alias
 	command = lixian_alias.to_alias(command)
-	commands = {'login': login,
-	            'logout': logout,
-	            'download': download_task,
-	            'list': list_task,
-	            'add': add_task,
-	            'delete': delete_task,
-	            'pause': pause_task,
-	            'restart': restart_task,
-	            'rename': rename_task,
-	            'readd': readd_task,
-	            'info': lixian_info,
-	            'config': lx_config,
-	            'help': lx_help}
 	import lixian_plugins.commands
-	commands.update(lixian_plugins.commands.commands)
-	if command not in commands:
+	if command in lixian_plugins.commands.commands:
+		run = lixian_plugins.commands.commands[command]
+	elif command in builtin_commands:
+		run = builtin_command(command)
+	else:
 		usage()
 		sys.exit(1)
 	if '-h' in args or '--help' in args:
-		lx_help([command])
+		builtin_command('help')([command])
 	else:
-		commands[command](args[1:])
+		run(args[1:])
 
 if __name__ == '__main__':
 	execute_command()
@@ -29,6 +29,17 @@ def get_softspace(output):
 		return get_softspace(output.output)
 	return 0
 
+def inline_codes(use_colors=True):
+	'''returns codes(*styles) -> (left, right), the escapes to put around text, so that colored
+	output can be buffered. returns None if the console can't do that (win32 console).'''
+	import lixian_colors_console
+	import lixian_colors_linux
+	console = get_console_type(use_colors)
+	if console is lixian_colors_console.Console:
+		return lambda *styles: ('', '')
+	elif console is lixian_colors_linux.AnsiConsole:
+		return lambda *styles: tuple(lixian_colors_linux.mix_styles(styles))
+
 class ScopedColors(console_type):
 	def __init__(self, *args):
 		console_type.__init__(self, *args)
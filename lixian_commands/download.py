@@ -10,6 +10,8 @@ import lixian_query
 import lixian_hash
 import lixian_hash_bt
 import lixian_hash_ed2k
+import lixian_library
+import lixian_progress
 import os
 import os.path
 import re
@@ -53,6 +55,7 @@ def download_file(client, path, task, options):
 	overwrite = options.get('overwrite')
 	mini_hash = options.get('mini_hash')
 	no_hash = options.get('no_hash')
+	library = options.get('library')
 
 	url = str(task['xunlei_url'])
 
@@ -71,29 +74,51 @@ def download_file(client, path, task, options):
 				download()
 
 	def download1_checked(client, url, path, size):
-		download = download_tool(client=client, url=url, path=path, size=size, resuming=resuming)
-		checked = 0
-		while checked < 10:
-			download1(download, path)
-			if download.finished():
-				break
-			else:
-				checked += 1
-		assert os.path.getsize(path) == size, 'incorrect downloaded file size (%s != %s)' % (os.path.getsize(path), size)
+		# the built-in tools report their progress to this transfer too
+		progress = lixian_progress.transfer(path, total=size, completed=os.path.getsize(path) if resuming and os.path.exists(path) else 0, tool=options['tool'])
+		try:
+			download = download_tool(client=client, url=url, path=path, size=size, resuming=resuming)
+			checked = 0
+			while checked < 10:
+				download1(download, path)
+				if download.finished():
+					break
+				else:
+					checked += 1
+			assert os.path.getsize(path) == size, 'incorrect downloaded file size (%s != %s)' % (os.path.getsize(path), size)
+		except Exception, e:
+			progress.failed(str(e))
+			raise
+		progress.done(size)
+
+	def verify_checked(verify, path, task):
+		progress = lixian_progress.transfer(path, total=task['size'], phase='hash')
+		try:
+			verified = verify(path, task)
+		except Exception, e:
+			progress.failed(str(e))
+			raise
+		progress.done(task['size'])
+		return verified
 
 	def download2(client, url, path, task):
 		size = task['size']
 		if mini_hash and resuming and verify_mini_hash(path, task):
 			return
-		download1_checked(client, url, path, size)
 		verify = verify_basic_hash if no_hash else verify_hash
-		if not verify(path, task):
+		if library and (overwrite or not os.path.exists(path)):
+			if library.restore(path, task, verify):
+				return
+		download1_checked(client, url, path, size)
+		if not verify_checked(verify, path, task):
 			with colors(options.get('colors')).yellow():
 				print 'hash error, redownloading...'
 			os.rename(path, path + '.error')
 			download1_checked(client, url, path, size)
-			if not verify(path, task):
+			if not verify_checked(verify, path, task):
 				raise Exception('hash check failed')
+		if library:
+			library.add(path, task)
 
 	download2(client, url, path, task)
 
@@ -184,14 +209,18 @@ def download_single_task(client, task, options):
 		if not no_hash:
 			torrent_file = client.get_torrent_file(task)
 			print 'Hashing bt ...'
-			from lixian_progress import SimpleProgressBar
-			bar = SimpleProgressBar()
+			progress = lixian_progress.transfer(output_path, total=task['size'], phase='hash', tool='bt')
 			file_set = [f['name'].encode('utf-8').split('\\') for f in files] if 'files' in task else None
-			verified = lixian_hash_bt.verify_bt(output_path, lixian_hash_bt.bdecode(torrent_file)['info'], file_set=file_set, progress_callback=bar.update)
-			bar.done()
+			try:
+				verified = lixian_hash_bt.verify_bt(output_path, lixian_hash_bt.bdecode(torrent_file)['info'], file_set=file_set, progress_callback=progress.fraction)
+			except Exception, e:
+				progress.failed(str(e))
+				raise
 			if not verified:
+				progress.failed('bt hash check failed')
 				# note that we don't delete bt download folder if hash failed
 				raise Exception('bt hash check failed')
+			progress.done()
 	else:
 		if output_dir and not os.path.exists(output_dir):
 			os.makedirs(output_dir)
@@ -213,6 +242,131 @@ def download_multiple_tasks(client, tasks, options):
 		for task in skipped:
 			print task['id'], task['status_text'], task['name'].encode(default_encoding)
 
+def parse_interval(n):
+	n, u = re.match(r'^(\d+)([smh])?$', str(n).lower()).groups()
+	return int(n) * {None: 1, 's': 1, 'm': 60, 'h': 3600}[u]
+
+def parse_progress(progress):
+	try:
+		return float(str(progress).rstrip('%'))
+	except ValueError:
+		return None
+
+class WatchInterval(object):
+	'''how long watch mode waits before polling again.
+
+	While the tasks waited for make progress, the next poll is planned for when
+	the first of them (or of their bt files) should complete, at the observed
+	rate. When a whole wait passed without progress, the wait doubles. It always
+	stays between a quarter and four times --watch-interval.
+	'''
+	def __init__(self, interval):
+		self.interval = interval
+		self.wait = interval
+		self.progress = {} # task id or (task id, file index) -> (time, progress) when the progress last changed
+		import time
+		self.since = time.time() # when the wait was last adjusted
+
+	def observe(self, tasks):
+		import time
+		now = time.time()
+		items = []
+		for t in tasks:
+			if 'files' in t:
+				items.extend(((t['id'], f['index']), f) for f in t['files'])
+			else:
+				items.append((t['id'], t))
+		previous = self.progress
+		self.progress = {}
+		etas = []
+		for key, x in items:
+			p = parse_progress(x['progress'])
+			if p is None:
+				continue
+			if key in previous:
+				t0, p0 = previous[key]
+				if p <= p0:
+					self.progress[key] = t0, p0
+					continue
+				if now > t0:
+					etas.append((100 - p) * (now - t0) / (p - p0))
+			self.progress[key] = now, p
+		if etas:
+			self.wait = min(etas)
+			self.since = now
+		elif now - self.since >= self.wait:
+			self.wait *= 2
+			self.since = now
+		self.wait = max(self.interval / 4.0, min(self.interval * 4.0, self.wait))
+
+	def sleep(self):
+		import time
+		time.sleep(self.wait)
+
+class DownloadQueue(object):
+	'''downloads the tasks pulled by watch mode in a background thread, so that
+	the status is still polled while a large file is being downloaded, and a
+	file completed meanwhile is queued as soon as it is seen.
+
+	a task (or a bt file, by task id and file index) is only queued once.
+	the client is shared by both threads: page sizes are sent per request, and
+	logging in again when the session times out is serialized (see XunleiClient.urlread).
+	'''
+	def __init__(self, client, options):
+		import Queue
+		import threading
+		self.client = client
+		self.options = options
+		self.queue = Queue.Queue()
+		self.queued = set()
+		self.error = None
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def put(self, tasks):
+		batch = []
+		for t in tasks:
+			if 'files' in t:
+				files = [f for f in t['files'] if (t['id'], f['index']) not in self.queued]
+				if not files:
+					continue
+				self.queued.update((t['id'], f['index']) for f in files)
+				t = dict(t, files=files)
+			elif (t['id'], None) in self.queued:
+				continue
+			else:
+				self.queued.add((t['id'], None))
+			batch.append(t)
+		if batch:
+			self.queue.put(batch)
+
+	def run(self):
+		while True:
+			tasks = self.queue.get()
+			if tasks is None:
+				break
+			if self.error:
+				continue
+			try:
+				download_multiple_tasks(self.client, tasks, self.options)
+			except:
+				import sys
+				self.error = sys.exc_info()
+
+	def check(self):
+		'''raises the error of a failed download, if any'''
+		error = self.error
+		if error:
+			raise error[0], error[1], error[2]
+
+	def close(self):
+		'''waits for the queued downloads'''
+		self.queue.put(None)
+		while self.thread.is_alive():
+			self.thread.join(1) # with a timeout, so that Ctrl-C still works
+		self.check()
+
 @command_line_parser(help=lixian_help.download)
 @with_parser(parse_login)
 @with_parser(parse_colors)
@@ -221,6 +375,7 @@ def download_multiple_tasks(client, tasks, options):
 @command_line_value('input', alias='i')
 @command_line_value('output', alias='o')
 @command_line_value('output-dir', default=get_config('output-dir'))
+@command_line_value('library', default=get_config('library'))
 @command_line_option('torrent', alias='bt')
 @command_line_option('all')
 @command_line_value('category')
@@ -247,50 +402,46 @@ def download_task(args):
 	                 'no_hash': not args.hash,
 	                 'no_bt_dir': not args.bt_dir,
 	                 'save_torrent_file': args.save_torrent_file,
+	                 'library': lixian_library.open_library(args.library, hardlink=get_config('library-hardlink', True)),
 	                 'colors': args.colors}
 	client = create_client(args)
 	query = lixian_query.build_query(client, args)
 	query.query_once()
 
-	def sleep(n):
-		assert isinstance(n, (int, basestring)), repr(n)
-		import time
-		if isinstance(n, basestring):
-			n, u = re.match(r'^(\d+)([smh])?$', n.lower()).groups()
-			n = int(n) * {None: 1, 's': 1, 'm': 60, 'h': 3600}[u]
-		time.sleep(n)
-
-	if args.watch_present:
-		assert not args.output, 'not supported with watch option yet'
-		tasks = query.pull_completed()
-		while True:
-			if tasks:
-				download_multiple_tasks(client, tasks, download_args)
-			if not query.download_jobs:
-				break
-			if not tasks:
-				sleep(args.watch_interval)
-			query.refresh_status()
-			tasks = query.pull_completed()
-
-	elif args.watch:
-		assert not args.output, 'not supported with watch option yet'
-		tasks = query.pull_completed()
-		while True:
-			if tasks:
-				download_multiple_tasks(client, tasks, download_args)
-			if (not query.download_jobs) and (not query.queries):
-				break
-			if not tasks:
-				sleep(args.watch_interval)
-			query.refresh_status()
-			query.query_search()
-			tasks = query.pull_completed()
+	try:
+		if args.watch_present:
+			assert not args.output, 'not supported with watch option yet'
+			interval = WatchInterval(parse_interval(args.watch_interval))
+			downloads = DownloadQueue(client, download_args)
+			downloads.put(query.pull_completed())
+			while query.download_jobs:
+				interval.sleep()
+				downloads.check()
+				query.refresh_status()
+				interval.observe(query.download_jobs)
+				downloads.put(query.pull_completed())
+			downloads.close()
+
+		elif args.watch:
+			assert not args.output, 'not supported with watch option yet'
+			interval = WatchInterval(parse_interval(args.watch_interval))
+			downloads = DownloadQueue(client, download_args)
+			downloads.put(query.pull_completed())
+			while query.download_jobs or query.queries:
+				interval.sleep()
+				downloads.check()
+				query.refresh_status()
+				query.query_search_updates()
+				interval.observe(query.download_jobs)
+				downloads.put(query.pull_completed())
+			downloads.close()
 
-	else:
-		tasks = query.peek_download_jobs()
-		if args.output:
-			assert len(tasks) == 1
-			download_single_task(client, tasks[0], download_args)
 		else:
-			download_multiple_tasks(client, tasks, download_args)
+			tasks = query.peek_download_jobs()
+			if args.output:
+				assert len(tasks) == 1
+				download_single_task(client, tasks[0], download_args)
+			else:
+				download_multiple_tasks(client, tasks, download_args)
+	finally:
+		lixian_progress.finish() # prints the summary
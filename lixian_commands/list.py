@@ -6,6 +6,15 @@ import lixian_help
 import lixian_query
 import re
 
+def find_task_in_pages(client, id):
+	'''find a task by id or #, the same way as TaskBase.find_task_by_id, but stop reading pages once found'''
+	if not re.match(r'^\d+$', id):
+		return
+	for tasks in client.iter_task_pages():
+		for t in tasks:
+			if t['id'] == id or t['#'] == int(id):
+				return t
+
 @command_line_parser(help=lixian_help.list)
 @with_parser(parse_login)
 @with_parser(parse_colors)
@@ -35,12 +44,31 @@ def list_task(args):
 	assert len(parent_ids) <= 1, "sub-tasks listing only supports single task id"
 	ids = [a[:-1] if re.match(r'^#?\d+/$', a) else a for a in args]
 
+	columns = ['n', 'id', 'name', 'status', 'size', 'progress', 'speed', 'date', 'dcid', 'gcid', 'original-url', 'download-url']
+	columns = filter(lambda k: getattr(args, k), columns)
+
 	client = create_client(args)
+	if not args and (args.all or args.completed) and not (args.category or args.deleted or args.expired):
+		# no filters: print each page as soon as it arrives
+		writer = TaskWriter(columns, args)
+		for tasks in client.iter_task_pages():
+			if args.completed:
+				tasks = filter(lambda x: x['status_text'] == 'completed', tasks)
+			writer.write(tasks)
+		return
 	if parent_ids:
 		args[0] = args[0][:-1]
-		tasks = lixian_query.search_tasks(client, args)
+		parent = None
+		if not (args.category or args.deleted or args.expired):
+			# only the task list pages up to the parent task are needed
+			parent = find_task_in_pages(client, args[0])
+		if parent:
+			tasks = [parent]
+		else:
+			tasks = lixian_query.search_tasks(client, args)
 		assert len(tasks) == 1
-		tasks = client.list_bt(tasks[0])
+		# only what the shown columns read is parsed out of the file list
+		tasks = client.list_bt(tasks[0], fields=column_fields([k for k in columns if k != 'n']))
 		#tasks = client.list_bt(client.get_task_by_id(parent_ids[0]))
 		tasks.sort(key=lambda x: int(x['index']))
 	else:
@@ -48,7 +76,4 @@ def list_task(args):
 		if len(args) == 1 and re.match(r'\d+/', args[0]) and len(tasks) == 1 and 'files' in tasks[0]:
 			parent_ids = [tasks[0]['id']]
 			tasks = tasks[0]['files']
-	columns = ['n', 'id', 'name', 'status', 'size', 'progress', 'speed', 'date', 'dcid', 'gcid', 'original-url', 'download-url']
-	columns = filter(lambda k: getattr(args, k), columns)
-
 	output_tasks(tasks, columns, args, not parent_ids)
@@ -1,11 +1,12 @@
 
-__all__ = ['parse_login', 'parse_colors', 'parse_logging', 'parse_size', 'create_client', 'output_tasks', 'usage']
+__all__ = ['parse_login', 'parse_colors', 'parse_logging', 'parse_size', 'create_client', 'output_tasks', 'TaskWriter', 'column_fields', 'usage']
 
 from lixian_cli_parser import *
 from lixian_config import get_config
 from lixian_config import LIXIAN_DEFAULT_COOKIES
 from lixian_encoding import default_encoding, to_native
 from lixian_colors import colors
+import sys
 from getpass import getpass
 import lixian_help
 
@@ -50,53 +51,113 @@ def parse_size(args):
 
 def create_client(args):
 	from lixian import XunleiClient
-	return XunleiClient(args.username, args.password, args.cookies)
+	client = XunleiClient(args.username, args.password, args.cookies, base_url=get_config('api-base-url'))
+	client.page_concurrency = int(get_config('page-concurrency', client.page_concurrency))
+	return client
+
+status_colors = {
+'waiting': 'yellow',
+'downloading': 'magenta',
+'completed':'green',
+'pending':'cyan',
+'failed':'red',
+}
+
+def to_cell(x):
+	if type(x) == unicode:
+		return x.encode(default_encoding)
+	return str(x)
+
+def field_column(field):
+	return lambda args: lambda t: to_cell(t[field])
+
+def size_column(args):
+	if args.format_size:
+		from lixian_util import format_size
+		return lambda t: format_size(t['size'])
+	else:
+		return lambda t: str(t['size'])
+
+# column -> (task fields it reads, renderer factory: args -> (task -> text))
+task_columns = {
+	'n': (['#'], lambda args: lambda t: '#%d' % t['#']),
+	'id': (['id', 'index'], lambda args: lambda t: to_cell(t.get('index', t['id']))),
+	'name': (['name'], lambda args: lambda t: t['name'].encode(default_encoding)),
+	'status': (['status_text'], lambda args: lambda t: t['status_text']),
+	'size': (['size'], size_column),
+	'progress': (['progress'], field_column('progress')),
+	'speed': (['speed'], field_column('speed')),
+	'date': (['date'], field_column('date')),
+	'dcid': (['dcid'], field_column('dcid')),
+	'gcid': (['gcid'], field_column('gcid')),
+	'original-url': (['original_url'], field_column('original_url')),
+	'download-url': (['xunlei_url'], field_column('xunlei_url')),
+}
+
+def column_fields(columns):
+	'''the task fields needed to print these columns (colors also read status_text)'''
+	fields = set(['status_text'])
+	for k in columns:
+		if k not in task_columns:
+			raise NotImplementedError(k)
+		fields.update(task_columns[k][0])
+	return fields
+
+class TaskWriter:
+	'''prints tasks, one line per task. lines are written through a buffer, page by page.
+	renderers and color escapes are prepared once, for the shown columns only.'''
+	def __init__(self, columns, args, top=True, output=None):
+		if not top:
+			columns = [k for k in columns if k != 'n']
+		column_fields(columns) # check columns
+		self.columns = columns
+		self.args = args
+		self.output = output
+		self.renderers = [task_columns[k][1](args) for k in columns]
+		self.bold = columns.index('status') if 'status' in columns else None
+		from lixian_colors import inline_codes
+		codes = inline_codes(args.colors)
+		self.inline = codes is not None
+		if codes:
+			self.status_codes = dict((status, codes(c)) for status, c in status_colors.items())
+			self.bold_codes = codes('bold')
+			self.colored = self.bold_codes != ('', '')
+
+	def row(self, t):
+		return [render(t) for render in self.renderers]
+
+	def format(self, t):
+		cells = self.row(t)
+		if not self.colored:
+			return ' '.join(cells)
+		if self.bold is not None:
+			left, right = self.bold_codes
+			cells[self.bold] = left + cells[self.bold] + right
+		left, right = self.status_codes[t['status_text']]
+		return left + ' '.join(cells) + right
+
+	def write(self, tasks):
+		if self.inline:
+			output = self.output or sys.stdout
+			for i in range(0, len(tasks), 1000):
+				output.write(''.join([self.format(t) + '\n' for t in tasks[i:i+1000]]))
+			output.flush()
+		else:
+			# the console colors text by itself (win32), so write cell by cell
+			for t in tasks:
+				with colors(self.args.colors).ansi(status_colors[t['status_text']])():
+					for i, text in enumerate(self.row(t)):
+						if i:
+							sys.stdout.write(' ')
+						if i == self.bold:
+							with colors(self.args.colors).bold():
+								sys.stdout.write(text)
+						else:
+							sys.stdout.write(text)
+					sys.stdout.write('\n')
 
 def output_tasks(tasks, columns, args, top=True):
-	for i, t in enumerate(tasks):
-		status_colors = {
-		'waiting': 'yellow',
-		'downloading': 'magenta',
-		'completed':'green',
-		'pending':'cyan',
-		'failed':'red',
-		}
-		c = status_colors[t['status_text']]
-		with colors(args.colors).ansi(c)():
-			for k in columns:
-				if k == 'n':
-					if top:
-						print '#%d' % t['#'],
-				elif k == 'id':
-					print t.get('index', t['id']),
-				elif k == 'name':
-					print t['name'].encode(default_encoding),
-				elif k == 'status':
-					with colors(args.colors).bold():
-						print t['status_text'],
-				elif k == 'size':
-					if args.format_size:
-						from lixian_util import format_size
-						print format_size(t['size']),
-					else:
-						print t['size'],
-				elif k == 'progress':
-					print t['progress'],
-				elif k == 'speed':
-					print t['speed'],
-				elif k == 'date':
-					print t['date'],
-				elif k == 'dcid':
-					print t['dcid'],
-				elif k == 'gcid':
-					print t['gcid'],
-				elif k == 'original-url':
-					print t['original_url'],
-				elif k == 'download-url':
-					print t['xunlei_url'],
-				else:
-					raise NotImplementedError(k)
-			print
+	TaskWriter(columns, args, top).write(tasks)
 
 def usage(doc=lixian_help.usage, message=None):
 	if hasattr(doc, '__call__'):
@@ -7,6 +7,7 @@ import re
 from time import time, sleep
 import sys
 import os
+import errno
 
 #asynchat.async_chat.ac_out_buffer_size = 1024*1024
 
@@ -24,20 +25,19 @@ class http_client(asynchat.async_chat):
 		path = path or '/'
 
 		def resolve_host(host):
+			import lixian_endpoints
 			try:
-				return socket.gethostbyname(host)
+				return lixian_endpoints.rank_addresses(host, port, path, headers)
 			except:
-				pass
-		host_ip = resolve_host(host)
-		if not host_ip:
+				return []
+		self.host = host
+		self.addresses = resolve_host(host) # the fastest first (see lixian_endpoints)
+		if not self.addresses:
 			self.log_error("host can't be resolved: " + host)
 			self.size = None
+			self.completed = 0
 			return
-		if host_ip == '180.168.41.175':
-			# fuck shanghai dian DNS
-			self.log_error('gethostbyname failed')
-			self.size = None
-			return
+		self.host_ip = self.addresses[0]
 
 
 		request_headers = {'host': host, 'connection': 'close'}
@@ -52,9 +52,12 @@ class http_client(asynchat.async_chat):
 		self.headers = {} # for response headers
 
 		#self.buffer = StringIO()
-		self.buffer = []
+		self.buffer = [] # for response headers
 		self.buffer_size = 0
 		self.cache_size = 1024*1024
+		self.body = None # the body is received into this buffer (of cache_size), see read_body
+		self.body_view = None
+		self.body_used = 0
 		self.size = None
 		self.completed = 0
 		self.set_terminator("\r\n\r\n")
@@ -62,7 +65,7 @@ class http_client(asynchat.async_chat):
 
 		self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
 		try:
-			self.connect((host, port))
+			self.connect((self.host_ip, port))
 		except:
 			self.close()
 			self.log_error('connect_failed')
@@ -82,6 +85,11 @@ class http_client(asynchat.async_chat):
 		if self.size is not None and self.completed < self.size:
 			self.log_error('incomplete download')
 
+	def abort(self):
+		'''drops the connection, keeping what was received'''
+		self.close()
+		self.flush_data()
+
 	def handle_connection_error(self):
 		self.handle_error()
 
@@ -98,42 +106,64 @@ class http_client(asynchat.async_chat):
 			self.buffer.append(data)
 			self.buffer_size += len(data)
 			return
-		elif self.cache_size:
-			#self.buffer.write(data)
-			self.buffer.append(data)
-			self.buffer_size += len(data)
-			#if self.buffer.tell() > self.cache_size:
-			if self.buffer_size > self.cache_size:
-				#self.handle_data(self.buffer.getvalue())
-				self.handle_data(''.join(self.buffer))
-				#self.buffer.truncate(0)
-				#self.buffer.clear()
-				del self.buffer[:]
-				self.buffer_size = 0
+		# the start of the body, received with the headers
+		while data and self.connected:
+			n = min(len(data), len(self.body) - self.body_used)
+			self.body[self.body_used:self.body_used+n] = data[:n]
+			data = data[n:]
+			self.received(n)
+
+	def handle_read(self):
+		if self.reading_headers:
+			asynchat.async_chat.handle_read(self)
 		else:
-			self.handle_data(data)
+			self.read_body()
+
+	def read_body(self):
+		# no asynchat terminator scanning for the body: it's received straight
+		# into a reusable buffer, which is written out (without a copy) when full
+		try:
+			n = self.socket.recv_into(self.body_view[self.body_used:])
+		except socket.error, why:
+			if why.args[0] in asyncore._DISCONNECTED:
+				self.handle_close()
+				return
+			elif why.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+				return
+			raise
+		if not n:
+			self.handle_close()
+			return
+		self.received(n)
 
-		self.completed += len(data)
-		self.handle_status_update(self.size, self.completed)
-		self.handle_speed_update(self.completed, self.start_time)
-		if self.size == self.completed:
+	def received(self, n):
+		self.body_used += n
+		self.completed += n
+		if self.completed == self.size:
 			self.close()
 			self.flush_data()
 			self.handle_status_update(self.size, self.completed, force_update=True)
 			self.handle_speed_update(self.completed, self.start_time, force_update=True)
+		elif self.body_used == len(self.body):
+			self.flush_data()
+			# status and speed are updated once per buffer, not per packet
+			self.handle_status_update(self.size, self.completed)
+			self.handle_speed_update(self.completed, self.start_time)
+		elif time() - self.flush_time > 1:
+			# slow connection, don't keep the progress bar waiting
+			self.flush_data()
+			self.handle_status_update(self.size, self.completed)
+			self.handle_speed_update(self.completed, self.start_time)
 
 	def handle_data(self, data):
 		print len(data)
 		pass
 
 	def flush_data(self):
-		#if self.buffer.tell():
-		if self.buffer_size:
-			#self.handle_data(self.buffer.getvalue())
-			self.handle_data(''.join(self.buffer))
-			#self.buffer.truncate(0)
-			del self.buffer[:]
-			self.buffer_size = 0
+		if self.body_used:
+			self.handle_data(self.body_view[:self.body_used])
+			self.body_used = 0
+		self.flush_time = time()
 
 	def parse_headers(self, header):
 		lines = header.split('\r\n')
@@ -168,6 +198,9 @@ class http_client(asynchat.async_chat):
 			del self.buffer[:]
 			self.buffer_size = 0
 			self.set_terminator(None)
+			self.body = bytearray(self.cache_size)
+			self.body_view = memoryview(self.body)
+			self.flush_time = time()
 		else:
 			raise NotImplementedError()
 
@@ -198,127 +231,86 @@ class http_client(asynchat.async_chat):
 		print 'log_error', message
 		self.error_message = message
 
-class ProgressBar:
-	def __init__(self, total=0):
-		self.total = total
-		self.completed = 0
-		self.start = time()
-		self.speed = 0
-		self.bar_width = 0
-		self.displayed = False
-	def update(self):
-		self.displayed = True
-		bar_size = 40
-		if self.total:
-			percent = self.completed * 100.0 / self.total
-			if percent > 100:
-				percent = 100.0
-			dots = int(bar_size * percent / 100)
-			plus = percent / 100 * bar_size - dots
-			if plus > 0.8:
-				plus = '='
-			elif plus > 0.4:
-				plus = '-'
-			else:
-				plus = ''
-			bar = '=' * dots + plus
-			percent = int(percent)
-		else:
-			percent = 0
-			bar = '-'
-		speed = self.speed
-		if speed < 1000:
-			speed = '%sB/s' % int(speed)
-		elif speed < 1000*10:
-			speed = '%.1fK/s' % (speed/1000.0)
-		elif speed < 1000*1000:
-			speed = '%dK/s' % int(speed/1000)
-		elif speed < 1000*1000*100:
-			speed = '%.1fM/s' % (speed/1000.0/1000.0)
-		else:
-			speed = '%dM/s' % int(speed/1000/1000)
-		seconds = time() - self.start
-		if seconds < 10:
-			seconds = '%.1fs' % seconds
-		elif seconds < 60:
-			seconds = '%ds' % int(seconds)
-		elif seconds < 60*60:
-			seconds = '%dm%ds' % (int(seconds/60), int(seconds)%60)
-		elif seconds < 60*60*24:
-			seconds = '%dh%dm%ds' % (int(seconds)/60/60, (int(seconds)/60)%60, int(seconds)%60)
-		else:
-			seconds = int(seconds)
-			days = seconds/60/60/24
-			seconds -= days*60*60*24
-			hours = seconds/60/60
-			seconds -= hours*60*60
-			minutes = seconds/60
-			seconds -= minutes*60
-			seconds = '%dd%dh%dm%ds' % (days, hours, minutes, seconds)
-		completed = ','.join((x[::-1] for x in reversed(re.findall('..?.?', str(self.completed)[::-1]))))
-		bar = '{0:>3}%[{1:<40}] {2:<12} {3:>4} in {4:>6s}'.format(percent, bar, completed, speed, seconds)
-		new_bar_width = len(bar)
-		bar = bar.ljust(self.bar_width)
-		self.bar_width = new_bar_width
-		sys.stdout.write('\r'+bar)
-		sys.stdout.flush()
-	def update_status(self, total, completed):
-		self.total = total
-		self.completed = completed
-		self.update()
-	def update_speed(self, start, speed):
-		self.start = start
-		self.speed = speed
-		self.update()
-	def done(self):
-		if self.displayed:
-			print
-			self.displayed = False
-
-def download(url, path, headers=None, resuming=False):
+
+class StallMonitor:
+	'''watches the throughput of a download, to drop a connection which stalls:
+	nothing received for timeout seconds, or less than ratio of the average speed
+	(over the last history seconds) during the last window seconds.
+	'''
+	def __init__(self, timeout=60, ratio=0.1, window=5, history=60):
+		self.timeout = timeout
+		self.ratio = ratio
+		self.window = window
+		self.history = history
+		self.samples = [] # (time, bytes downloaded), about one per second
+		self.connected(0)
+
+	def connected(self, offset):
+		now = time()
+		self.connected_at = now
+		self.last_data = now
+		self.last_offset = offset
+
+	def speed(self, since, now, offset):
+		for t, n in self.samples:
+			if t >= since:
+				break
+		if now - t < 1:
+			return None
+		return (offset - n) / (now - t)
+
+	def check(self, offset):
+		'''returns why the connection stalled, or None'''
+		now = time()
+		if offset != self.last_offset:
+			self.last_offset = offset
+			self.last_data = now
+		elif now - self.last_data >= self.timeout:
+			return 'nothing received for %ds' % (now - self.last_data)
+		if not self.samples or now - self.samples[-1][0] >= 1:
+			self.samples.append((now, offset))
+			while now - self.samples[0][0] > self.history:
+				self.samples.pop(0)
+		if not self.ratio or now - self.connected_at < self.window * 2:
+			return # give a new connection time to speed up
+		average = self.speed(now - self.history, now, offset)
+		recent = self.speed(now - self.window, now, offset)
+		if average and recent is not None and recent < average * self.ratio:
+			return '%dB/s in the last %ds, %dB/s on average' % (recent, self.window, average)
+
+def download(url, path, headers=None, resuming=False, timeout=60, stall_ratio=0.1, buffer_size=None):
 	class download_client(http_client):
 		def __init__(self, url, headers=headers, start_from=0):
 			self.output = None
-			self.bar = ProgressBar()
 			http_client.__init__(self, url, headers=headers, start_from=start_from)
+			self.cache_size = buffer_size
 			self.start_from = start_from
-			self.last_status_time = time()
-			self.last_speed_time = time()
-			self.last_size = 0
 			self.path = path
 		def handle_close(self):
 			http_client.handle_close(self)
 			if self.output:
 				self.output.close()
 				self.output = None
+		def abort(self):
+			http_client.abort(self)
+			if self.output:
+				self.output.close()
+				self.output = None
 		def handle_http_status_error(self):
 			http_client.handle_http_status_error(self)
 			self.log_error('http status error: %s, %s' % (self.status_code, self.status_text))
 		def handle_data(self, data):
 			if not self.output:
-				if self.start_from:
-					self.output = open(path, 'ab')
-				else:
-					self.output = open(path, 'wb')
+				import lixian_output
+				size = self.start_from + self.size if self.size is not None else None
+				self.output = lixian_output.OutputFile(path, self.start_from, size)
 			self.output.write(data)
 		def handle_status_update(self, total, completed, force_update=False):
 			if total is None:
 				return
-			if time() - self.last_status_time > 1 or force_update:
-				#print '%.02f' % (completed*100.0/total)
-				self.bar.update_status(total+start_from, completed+start_from)
-				self.last_status_time = time()
-		def handle_speed_update(self, completed, start_time, force_update=False):
-			now = time()
-			period = now - self.last_speed_time
-			if period > 1 or force_update:
-				#print '%.02f, %.02f' % ((completed-self.last_size)/period, completed/(now-start_time))
-				self.bar.update_speed(start_time, (completed-self.last_size)/period)
-				self.last_speed_time = time()
-				self.last_size = completed
+			progress.update(completed+self.start_from, total+self.start_from, force=force_update)
 		def log_error(self, message):
-			self.bar.done()
-			http_client.log_error(self, message)
+			self.error_message = message # reported as a retry
 		def __del__(self): # XXX: sometimes handle_close() is not called, don't know why...
 			#http_client.__del__(self)
 			if self.output:
@@ -330,24 +322,51 @@ def download(url, path, headers=None, resuming=False):
 	start_from = 0
 	if resuming and os.path.exists(path):
 		start_from = os.path.getsize(path)
-		# TODO: fix status bar for resuming
-	while True:
-		client = download_client(url, start_from=start_from)
-		asyncore.loop()
-		while hasattr(client, 'next_client'):
-			client = client.next_client
-		client.bar.done()
-		if getattr(client, 'error_message', None):
-			retry_times += 1
-			if retry_times >= max_retry_times:
-				raise Exception(client.error_message)
-			if client.size and client.completed:
-				start_from = os.path.getsize(path)
-			print 'retry', retry_times
-			sleep(retry_times)
-		else:
-			break
-
+	if not buffer_size:
+		import lixian_output
+		buffer_size = lixian_output.get_buffer_size()
+	monitor = StallMonitor(timeout=timeout, ratio=stall_ratio)
+	import lixian_progress
+	progress = lixian_progress.transfer(path, completed=start_from, tool='asyn')
+	try:
+		while True:
+			client = download_client(url, start_from=start_from)
+			monitor.connected(start_from)
+			stalled = None
+			while asyncore.socket_map:
+				asyncore.loop(timeout=1, count=1)
+				while hasattr(client, 'next_client'):
+					client = client.next_client
+				stalled = monitor.check(start_from + client.completed)
+				if stalled:
+					client.abort()
+					break
+			if stalled:
+				retry_times += 1
+				if retry_times >= max_retry_times:
+					raise Exception('connection stalled: ' + stalled)
+				if client.completed:
+					start_from = os.path.getsize(path)
+				# reconnect right away: the server is fine, this connection isn't
+				progress.stall('%s, reconnecting at %d' % (stalled, start_from))
+			elif getattr(client, 'error_message', None):
+				retry_times += 1
+				if not getattr(client, 'completed', 0) and len(getattr(client, 'addresses', [])) > 1:
+					# try the next best address next time
+					import lixian_endpoints
+					lixian_endpoints.report_failure(client.host, client.host_ip)
+				if retry_times >= max_retry_times:
+					raise Exception(client.error_message)
+				if client.size and getattr(client, 'completed', 0):
+					start_from = os.path.getsize(path)
+				progress.retry(client.error_message)
+				sleep(retry_times)
+			else:
+				break
+	except Exception, e:
+		progress.failed(str(e))
+		raise
+	progress.done()
 
 def main():
 	url, path = sys.argv[1:]
@@ -0,0 +1,186 @@
+
+'''The auto download tool: picks one of the other tools for each file.
+
+The throughput of every download made by auto is kept per tool and per size
+class of the file (see size_classes) in .xunlei.lixian.tools (next to the
+config file), as a moving average. Measurements older than tool-history-ttl
+seconds (a week by default) are forgotten. For each file, the installed tool
+with the best history in its size class is used.
+
+When an installed tool has no history in that class yet, and the file is big
+enough to be worth it, the first probe_size bytes of the file are downloaded
+with each of these tools in turn, for up to probe_timeout seconds, and their
+speeds recorded (POSIX only: a probe is a forked process, killed when done).
+
+Config:
+  --auto-tools=engine,asyn,aria2,curl,wget   the tools to choose from, the
+                                             preferred first (used when there
+                                             is no history to compare).
+  --tool-history-ttl=604800
+
+lx diagnostics prints the tools found and the history.
+'''
+
+__all__ = ['AutoTool', 'get_candidates', 'get_history', 'size_classes']
+
+import os
+import os.path
+from time import time, sleep
+
+size_classes = [('small', 4*1024*1024), ('medium', 64*1024*1024), ('large', 1024*1024*1024), ('huge', None)]
+
+tool_binaries = {'wget': 'wget', 'curl': 'curl', 'aria2': 'aria2c', 'aria2c': 'aria2c', 'aria2-rpc': 'aria2c', 'axel': 'axel'}
+
+probe_size = 1024*1024
+probe_timeout = 5
+probe_min_file_size = 16*1024*1024 # smaller files are downloaded before a probe would tell anything
+min_sample = 256*1024 # downloads of less than that say more about latency than throughput
+alpha = 0.3 # weight of a new measurement in the moving average
+
+def get_size_class(size):
+	for name, limit in size_classes:
+		if limit is None or size < limit:
+			return name
+
+def installed(name):
+	import lixian_download_tools
+	try:
+		lixian_download_tools.get_tool(name)
+	except KeyError:
+		return False
+	if name in tool_binaries:
+		import distutils.spawn
+		return bool(distutils.spawn.find_executable(tool_binaries[name]))
+	return True
+
+def get_candidates():
+	'''[(tool, installed)...], in the preferred order'''
+	from lixian_config import get_config
+	names = [x.strip() for x in get_config('auto-tools', 'engine,asyn,aria2,curl,wget').split(',') if x.strip()]
+	return [(name, name != 'auto' and installed(name)) for name in names]
+
+history = None
+
+def get_history():
+	'''size class -> tool -> {'speed', 'samples', 'failures', 'chosen', 'time'}'''
+	global history
+	if history is None:
+		from lixian_config import get_config, get_config_path
+		from lixian_endpoints import Scores
+		history = Scores(get_config_path('.xunlei.lixian.tools'), int(get_config('tool-history-ttl', 7*24*3600)))
+	return history
+
+def record(size_class, tool, speed=None, failed=False, chosen=False):
+	'''adds a measurement (or a failure, or a choice) of tool to the history of size_class'''
+	history = get_history()
+	score = dict(history.get(size_class).get(tool) or {'speed': None, 'samples': 0, 'failures': 0, 'chosen': 0})
+	if speed is not None:
+		score['speed'] = speed if score['speed'] is None else (1 - alpha) * score['speed'] + alpha * speed
+		score['samples'] += 1
+	if failed:
+		score['speed'] = (1 - alpha) * (score['speed'] or 0)
+		score['failures'] += 1
+	if chosen:
+		score['chosen'] += 1
+	score['time'] = time()
+	history.update(size_class, {tool: score})
+
+def probe(tool, client, url, size):
+	'''downloads the first probe_size bytes of url with tool, in a child process. returns the speed in bytes/s, or None if nothing was received.'''
+	import tempfile
+	import shutil
+	import signal
+	import lixian_download_tools
+	import lixian_resolver
+	import lixian_progress
+	temp_dir = tempfile.mkdtemp(prefix='lixian-probe-')
+	path = os.path.join(temp_dir, 'probe')
+	try:
+		start = time()
+		pid = os.fork()
+		if pid == 0:
+			code = 1
+			try:
+				os.setsid() # the tool and its own children are killed together
+				lixian_resolver.after_fork()
+				lixian_progress.after_fork()
+				devnull = os.open(os.devnull, os.O_RDWR)
+				for fd in (0, 1, 2):
+					os.dup2(devnull, fd)
+				lixian_download_tools.get_tool(tool)(client=client, url=url, path=path, size=size, resuming=False)()
+				code = 0
+			finally:
+				os._exit(code)
+		exited = False
+		while True:
+			exited = os.waitpid(pid, os.WNOHANG)[0] == pid
+			received = os.path.getsize(path) if os.path.exists(path) else 0
+			if exited or received >= probe_size or time() - start > probe_timeout:
+				break
+			sleep(0.05)
+		seconds = time() - start
+		if not exited:
+			try:
+				os.killpg(pid, signal.SIGKILL)
+			except OSError:
+				pass
+			os.waitpid(pid, 0)
+		if not received:
+			return None
+		return received / max(seconds, 0.001)
+	finally:
+		shutil.rmtree(temp_dir, ignore_errors=True)
+
+def choose(client, url, path, size, resuming):
+	'''returns (tool, why)'''
+	import lixian_logging
+	import lixian_util
+	candidates = [name for name, ok in get_candidates() if ok]
+	assert candidates, 'none of the auto-tools is installed'
+	if resuming and os.path.exists(path + '.aria2'):
+		for name in ('aria2', 'aria2c', 'aria2-rpc'):
+			if name in candidates:
+				return name, 'resuming an aria2 download'
+	size_class = get_size_class(size)
+	scores = get_history().get(size_class)
+	unknown = [name for name in candidates if name not in scores or scores[name]['speed'] is None]
+	if unknown and size >= probe_min_file_size and hasattr(os, 'fork'):
+		for name in unknown:
+			speed = probe(name, client, url, size)
+			lixian_logging.get_logger().debug('auto: probed %s: %s' % (name, lixian_util.format_size(int(speed)) + '/s' if speed else 'failed'))
+			record(size_class, name, speed=speed, failed=speed is None)
+		scores = get_history().get(size_class)
+	measured = [name for name in candidates if name in scores and scores[name]['speed'] is not None]
+	if not measured:
+		return candidates[0], 'no history for %s files' % size_class
+	best = max(measured, key=lambda name: (scores[name]['speed'], -candidates.index(name)))
+	return best, '%s for %s files' % (', '.join('%s %s/s' % (name, lixian_util.format_size(int(scores[name]['speed']))) for name in measured), size_class)
+
+class AutoTool:
+	def __init__(self, **kwargs):
+		import lixian_logging
+		self.kwargs = kwargs
+		self.path = kwargs['path']
+		self.size = kwargs['size']
+		self.resuming = kwargs.get('resuming')
+		self.size_class = get_size_class(self.size)
+		self.name, why = choose(kwargs['client'], kwargs['url'], self.path, self.size, self.resuming)
+		lixian_logging.get_logger().info('auto: using %s (%s)' % (self.name, why))
+		record(self.size_class, self.name, chosen=True)
+		import lixian_download_tools
+		self.tool = lixian_download_tools.get_tool(self.name)(**kwargs)
+
+	def finished(self):
+		return self.tool.finished()
+
+	def __call__(self):
+		before = os.path.getsize(self.path) if self.resuming and os.path.exists(self.path) else 0
+		start = time()
+		try:
+			self.tool()
+		except Exception:
+			record(self.size_class, self.name, failed=True)
+			raise
+		received = (os.path.getsize(self.path) if os.path.exists(self.path) else 0) - before
+		if received >= min_sample:
+			record(self.size_class, self.name, speed=received / max(time() - start, 0.001))
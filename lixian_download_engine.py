@@ -0,0 +1,391 @@
+
+'''A download engine on select(), used by the 'engine' download tool.
+
+Unlike lixian_download_asyn (asyncore), one Engine runs any number of
+transfers in a single loop. Host names are resolved (and the fastest address
+picked, see lixian_endpoints) in the threads of lixian_resolver, so a slow DNS
+server doesn't block the other transfers. Every connection has a
+read timeout, and a failed transfer is retried after a growing delay,
+resuming from what was already received. The socket and the file of a
+transfer are closed as soon as it ends, and all of them when the loop exits,
+even by an exception or Ctrl-C.
+'''
+
+__all__ = ['Engine', 'download']
+
+import os
+import os.path
+import re
+import sys
+import socket
+import select
+import errno
+import threading
+from time import time
+
+connecting_errors = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, 'WSAEWOULDBLOCK', 10035))
+again_errors = (errno.EWOULDBLOCK, errno.EAGAIN)
+
+class Transfer(object):
+	'''one file, downloaded by http GET, resumed with Range on retry'''
+	def __init__(self, engine, url, path, headers=None, resuming=False):
+		self.engine = engine
+		self.path = path
+		self.headers = headers or {}
+		self.start_from = os.path.getsize(path) if resuming and os.path.exists(path) else 0
+		self.ours = resuming # can the file be resumed on retry?
+		self.size = None # of the whole file, once known
+		self.completed = self.start_from
+		self.retries = 0
+		self.redirects = 0
+		self.generation = 0 # to ignore the resolving result of an earlier attempt
+		self.sock = None
+		self.output = None
+		self.buffer = bytearray(engine.buffer_size)
+		self.view = memoryview(self.buffer)
+		self.used = 0
+		self.error = None
+		self.progress = None # lixian_progress.Transfer, while running with progress
+		self.set_url(url)
+		self.state = 'waiting'
+		self.retry_at = 0
+
+	def set_url(self, url):
+		m = re.match(r'http://([^/:]+)(?::(\d+))?(/.*)?$', url)
+		if not m:
+			raise ValueError('Invalid url: %s' % url)
+		self.url = url
+		self.host, port, self.url_path = m.groups()
+		self.port = int(port or 80)
+		self.url_path = self.url_path or '/'
+
+	def active(self):
+		return self.state not in ('done', 'failed')
+
+	def deadline(self):
+		'''when the engine must look at this transfer again, if nothing happens'''
+		if self.state == 'waiting':
+			return self.retry_at
+		elif self.state == 'resolving':
+			return time() + 0.1 # resolved in a thread, polled
+		else:
+			return self.last_activity + self.engine.timeout
+
+	##################################################
+	# states
+	##################################################
+
+	def start(self):
+		self.state = 'resolving'
+		self.generation += 1
+		self.last_activity = time()
+		generation = self.generation
+		host, port, path, headers = self.host, self.port, self.url_path, self.headers
+		def resolve():
+			import lixian_endpoints
+			addresses = lixian_endpoints.rank_addresses(host, port, path, headers) # the fastest first
+			if not addresses:
+				raise socket.error('no address')
+			return addresses
+		def resolved(ok, result):
+			self.engine.post(self, generation, (ok, result))
+		import lixian_resolver
+		lixian_resolver.submit(resolve, resolved)
+
+	def resolved(self, generation, result):
+		if generation != self.generation or self.state != 'resolving':
+			return
+		ok, addresses = result
+		if not ok:
+			return self.fail("host can't be resolved: %s (%s)" % (self.host, addresses))
+		self.addresses = addresses
+		self.received_bytes = 0
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.setblocking(0)
+		e = self.sock.connect_ex((addresses[0], self.port))
+		if e not in connecting_errors:
+			return self.fail('connect failed: %s' % os.strerror(e))
+		self.state = 'connecting'
+		self.last_activity = time()
+
+	def request(self):
+		headers = {'Host': self.host, 'Connection': 'close'}
+		if self.start_from:
+			headers['Range'] = 'bytes=%d-' % self.start_from
+		headers.update(self.headers)
+		return 'GET %s HTTP/1.1\r\n%s\r\n\r\n' % (self.url_path, '\r\n'.join('%s: %s' % (k, headers[k]) for k in headers))
+
+	def handle_write(self):
+		if self.state == 'connecting':
+			e = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+			if e:
+				return self.fail('connect failed: %s' % os.strerror(e))
+			self.state = 'sending'
+			self.outgoing = self.request()
+		n = self.sock.send(self.outgoing)
+		self.outgoing = self.outgoing[n:]
+		self.last_activity = time()
+		if not self.outgoing:
+			self.state = 'headers'
+			self.incoming = ''
+
+	def handle_read(self):
+		if self.state == 'headers':
+			data = self.sock.recv(65536)
+			if not data:
+				return self.fail('incomplete http response')
+			self.last_activity = time()
+			self.incoming += data
+			i = self.incoming.find('\r\n\r\n')
+			if i < 0:
+				return
+			body = self.incoming[i+4:]
+			self.handle_headers(self.incoming[:i])
+			while self.state == 'body' and body:
+				# in pieces, the buffer may be smaller than what came with the headers
+				n = min(len(body), len(self.buffer) - self.used)
+				self.view[self.used:self.used+n] = body[:n]
+				body = body[n:]
+				self.received(n)
+		else:
+			n = self.sock.recv_into(self.view[self.used:])
+			if not n:
+				self.flush()
+				if self.size is not None and self.completed < self.size:
+					return self.fail('incomplete download')
+				return self.finish()
+			self.last_activity = time()
+			self.received(n)
+
+	def handle_headers(self, head):
+		lines = head.split('\r\n')
+		m = re.match(r'^HTTP/[\d.]+ (\d+) ?(.*)$', lines.pop(0))
+		if not m:
+			return self.fail('invalid http response')
+		status = int(m.group(1))
+		headers = {}
+		for line in lines:
+			if ':' in line:
+				k, v = line.split(':', 1)
+				headers[k.strip().lower()] = v.strip()
+		if status in (301, 302, 303, 307) and 'location' in headers:
+			self.close()
+			self.redirects += 1
+			if self.redirects > self.engine.max_redirects:
+				return self.fail('too many redirects', fatal=True)
+			self.set_url(headers['location'])
+			return self.start()
+		if status not in (200, 206):
+			return self.fail('http status error: %s, %s' % (status, m.group(2)))
+		length = headers.get('content-length')
+		length = int(length) if length is not None else None
+		if status == 206:
+			m = re.match(r'bytes (\d+)-\d+/(\d+)$', headers.get('content-range', ''))
+			if not m or int(m.group(1)) != self.start_from:
+				return self.fail('unexpected content range: %s' % headers.get('content-range'), fatal=True)
+			self.size = int(m.group(2))
+		else:
+			# a full response, even if a range was asked
+			self.start_from = 0
+			self.size = length
+		self.completed = self.start_from
+		import lixian_output
+		self.output = lixian_output.OutputFile(self.path, self.start_from, self.size)
+		self.ours = True
+		self.state = 'body'
+		if self.size == self.completed:
+			self.finish()
+
+	def received(self, n):
+		self.received_bytes += n
+		self.used += n
+		self.completed += n
+		if self.completed == self.size:
+			self.finish()
+		elif self.used == len(self.buffer):
+			self.flush()
+
+	def flush(self):
+		if self.used:
+			self.output.write(self.view[:self.used])
+			self.used = 0
+
+	def finish(self):
+		self.close()
+		self.state = 'done'
+
+	def fail(self, message, fatal=False):
+		if self.sock and not self.received_bytes and len(self.addresses) > 1:
+			# try the next best address next time
+			import lixian_endpoints
+			lixian_endpoints.report_failure(self.host, self.addresses[0])
+		self.close()
+		self.retries += 1
+		if fatal or self.retries >= self.engine.max_retries:
+			self.state = 'failed'
+			self.error = message
+			return
+		if self.progress:
+			self.progress.retry(message)
+		else:
+			self.engine.log('%s, retry %d' % (message, self.retries))
+		self.state = 'waiting'
+		self.retry_at = time() + self.retries
+		self.start_from = os.path.getsize(self.path) if self.ours and os.path.exists(self.path) else 0
+		self.completed = self.start_from
+
+	def close(self):
+		'''releases the socket and the file (after writing what is buffered)'''
+		sock, self.sock = self.sock, None
+		output, self.output = self.output, None
+		try:
+			if output:
+				try:
+					if self.used:
+						output.write(self.view[:self.used])
+				finally:
+					self.used = 0
+					output.close()
+		finally:
+			if sock:
+				sock.close()
+
+class Engine(object):
+	'''runs transfers in one select() loop. see add and run.'''
+	def __init__(self, timeout=60, max_retries=25, max_redirects=2, buffer_size=None, progress=True):
+		self.timeout = timeout
+		self.max_retries = max_retries
+		self.max_redirects = max_redirects
+		if not buffer_size:
+			import lixian_output
+			buffer_size = lixian_output.get_buffer_size()
+		self.buffer_size = buffer_size
+		self.progress = progress
+		self.transfers = []
+		self.lock = threading.Lock()
+		self.posted = []
+		self.wakeup = threading.Event() # set when something is posted
+
+	def add(self, url, path, headers=None, resuming=False):
+		transfer = Transfer(self, url, path, headers=headers, resuming=resuming)
+		self.transfers.append(transfer)
+		return transfer
+
+	def post(self, transfer, generation, result):
+		'''called by resolver threads'''
+		with self.lock:
+			self.posted.append((transfer, generation, result))
+			self.wakeup.set()
+
+	def log(self, message):
+		print message
+
+	def run(self):
+		'''downloads everything added. raises an exception if any transfer failed.'''
+		if self.progress:
+			import lixian_progress
+			for t in self.transfers:
+				t.progress = lixian_progress.transfer(t.path, completed=t.completed, tool='engine')
+		self.last_update = 0
+		try:
+			while any(t.active() for t in self.transfers):
+				self.step()
+				self.update_progress()
+		finally:
+			for t in self.transfers:
+				t.close()
+			self.update_progress(force=True)
+			for t in self.transfers:
+				if t.progress:
+					if t.state == 'done':
+						t.progress.done()
+					else:
+						t.progress.failed(t.error or 'interrupted')
+					t.progress = None
+		errors = [t.error for t in self.transfers if t.state == 'failed']
+		if errors:
+			raise Exception(errors[0] if len(errors) == 1 else '%d downloads failed: %s' % (len(errors), '; '.join(errors)))
+
+	def step(self):
+		now = time()
+		for t in self.transfers:
+			if t.state == 'waiting' and t.retry_at <= now:
+				t.start()
+		with self.lock:
+			posted, self.posted = self.posted, []
+			self.wakeup.clear()
+		for t, generation, result in posted:
+			t.resolved(generation, result)
+
+		readers = {}
+		writers = {}
+		for t in self.transfers:
+			if t.state in ('connecting', 'sending'):
+				writers[t.sock.fileno()] = t
+			elif t.state in ('headers', 'body'):
+				readers[t.sock.fileno()] = t
+		deadlines = [t.deadline() for t in self.transfers if t.active()]
+		if not deadlines:
+			return
+		timeout = max(0, min(min(deadlines) - time(), 1))
+		if readers or writers:
+			try:
+				r, w, _ = select.select(readers.keys(), writers.keys(), [], timeout)
+			except select.error, e:
+				if e.args[0] == errno.EINTR:
+					return
+				raise
+		else:
+			self.wakeup.wait(timeout) # nothing to select() (which on Windows doesn't take empty lists), wait for the resolver
+			r, w = [], []
+		for fd in w:
+			self.handle(writers[fd], 'handle_write')
+		for fd in r:
+			self.handle(readers[fd], 'handle_read')
+
+		now = time()
+		for t in self.transfers:
+			if t.state in ('connecting', 'sending', 'headers', 'body') and now - t.last_activity > self.timeout:
+				t.fail('timed out after %ds without data' % self.timeout)
+
+	def handle(self, transfer, event):
+		try:
+			getattr(transfer, event)()
+		except socket.error, e:
+			if e.args[0] in again_errors:
+				return
+			transfer.fail('%s' % e)
+		except (IOError, OSError), e:
+			transfer.fail('%s' % e, fatal=True) # can't write the file
+
+	def completed(self):
+		return sum(t.completed for t in self.transfers)
+
+	def update_progress(self, force=False):
+		if not self.progress:
+			return
+		now = time()
+		if now - self.last_update < 0.5 and not force:
+			return
+		for t in self.transfers:
+			if t.progress:
+				t.progress.update(t.completed, t.size, force=force)
+		self.last_update = now
+
+def download(url, path, headers=None, resuming=False, timeout=60):
+	engine = Engine(timeout=timeout)
+	engine.add(url, path, headers=headers, resuming=resuming)
+	engine.run()
+
+def main():
+	'''usage: python lixian_download_engine.py url path [url path...]'''
+	args = sys.argv[1:]
+	assert args and len(args) % 2 == 0, main.__doc__
+	engine = Engine()
+	for i in range(0, len(args), 2):
+		engine.add(args[i], args[i+1])
+	engine.run()
+
+if __name__ == '__main__':
+	main()
+
@@ -48,7 +48,8 @@ def urllib2_download(client, download_url, filename, resuming=False):
 	assert not resuming
 	print 'Downloading', download_url, 'to', filename, '...'
 	request = urllib2.Request(download_url, headers={'Cookie': 'gdriveid='+client.get_gdriveid()})
-	response = urllib2.urlopen(request)
+	import lixian_resolver
+	response = lixian_resolver.urlopen(request)
 	import shutil
 	with open(filename, 'wb') as output:
 		shutil.copyfileobj(response, output)
@@ -56,7 +57,14 @@ def urllib2_download(client, download_url, filename, resuming=False):
 @download_tool('asyn')
 def asyn_download(client, download_url, filename, resuming=False):
 	import lixian_download_asyn
-	lixian_download_asyn.download(download_url, filename, headers={'Cookie': 'gdriveid='+str(client.get_gdriveid())}, resuming=resuming)
+	lixian_download_asyn.download(download_url, filename, headers={'Cookie': 'gdriveid='+str(client.get_gdriveid())}, resuming=resuming,
+	                              timeout=int(get_config('download-timeout', 60)), stall_ratio=float(get_config('stall-ratio', 0.1)))
+
+@download_tool('engine')
+def engine_download(client, download_url, filename, resuming=False):
+	import lixian_download_engine
+	lixian_download_engine.download(download_url, filename, headers={'Cookie': 'gdriveid='+str(client.get_gdriveid())}, resuming=resuming,
+	                                timeout=int(get_config('download-timeout', 60)))
 
 @download_tool('wget')
 def wget_download(client, download_url, filename, resuming=False):
@@ -112,6 +120,13 @@ class Aria2DownloadTool:
 		if exit_code != 0:
 			raise Exception('aria2c exited abnormally')
 
+@download_tool('aria2-rpc')
+class Aria2RpcDownloadTool(Aria2DownloadTool):
+	'''like aria2, but all files go to one aria2c, see lixian_aria2_rpc'''
+	def __call__(self):
+		import lixian_aria2_rpc
+		lixian_aria2_rpc.download(self.url, self.path, headers={'Cookie': 'gdriveid='+self.gdriveid}, resuming=self.resuming)
+
 @download_tool('axel')
 def axel_download(client, download_url, path, resuming=False):
 	gdriveid = str(client.get_gdriveid())
@@ -122,7 +137,27 @@ def axel_download(client, download_url, path, resuming=False):
 	if exit_code != 0:
 		raise Exception('axel exited abnormally')
 
+@download_tool('auto')
+class AutoDownloadTool:
+	'''one of the other tools, picked for each file, see lixian_download_auto'''
+	def __init__(self, **kwargs):
+		import lixian_download_auto
+		self.tool = lixian_download_auto.AutoTool(**kwargs)
+	def finished(self):
+		return self.tool.finished()
+	def __call__(self):
+		self.tool()
+
+lazy_tools = {}
+
+def register_lazy_tool(module, name):
+	'''a download tool declared by a plugin, imported on first use'''
+	lazy_tools[name] = module
+
 def get_tool(name):
+	if name not in download_tools and name in lazy_tools:
+		import lixian_plugins
+		lixian_plugins.load_module(lazy_tools.pop(name))
 	return download_tools[name]
 
 
@@ -0,0 +1,172 @@
+
+'''Picks the fastest address of a download host.
+
+Xunlei download hosts resolve to several addresses, with very different
+throughput from a given network. When a host has more than one address, the
+first probe_size bytes of the file are downloaded from each of them at the
+same time, and the addresses are ranked by the speed of that (connecting
+included). The scores are kept in .xunlei.lixian.endpoints (next to the
+config file) for endpoint-ttl seconds (3600 by default), so a host is only
+probed once in a while. An address which failed is ranked last until its
+score expires. --no-endpoint-probe in the config file turns probing off: the
+addresses are then tried in DNS order.
+'''
+
+__all__ = ['rank_addresses', 'report_failure']
+
+import os
+import os.path
+import socket
+import threading
+from time import time
+
+poisoned = ['180.168.41.175'] # fuck shanghai dian DNS
+
+probe_size = 128*1024
+probe_timeout = 5
+
+def resolve_all(host, port):
+	'''all IPv4 addresses of host, in DNS order'''
+	import lixian_resolver
+	return [ip for ip in lixian_resolver.resolve(host) if ip not in poisoned]
+
+def probe(ip, port, host, path, headers=None):
+	'''downloads the first probe_size bytes of path from ip. returns (latency, speed) in seconds and bytes/s.'''
+	start = time()
+	sock = socket.create_connection((ip, port), probe_timeout)
+	try:
+		latency = time() - start
+		request_headers = {'Host': host, 'Connection': 'close', 'Range': 'bytes=0-%d' % (probe_size - 1)}
+		request_headers.update(headers or {})
+		sock.sendall('GET %s HTTP/1.1\r\n%s\r\n\r\n' % (path, '\r\n'.join('%s: %s' % (k, request_headers[k]) for k in request_headers)))
+		received = 0
+		head = ''
+		while received < probe_size and time() - start < probe_timeout:
+			data = sock.recv(65536)
+			if not data:
+				break
+			if head is not None:
+				head += data
+				i = head.find('\r\n\r\n')
+				if i < 0:
+					continue
+				status = head.split(' ', 2)[1] if head.startswith('HTTP/') else ''
+				if not status.startswith('2'):
+					raise IOError('http status error: ' + status)
+				data = head[i+4:]
+				head = None
+			received += len(data)
+		if head is not None:
+			raise IOError('incomplete http response')
+		if not received:
+			raise IOError('empty http response')
+		return latency, received / max(time() - start, 0.001)
+	finally:
+		sock.close()
+
+class Scores:
+	'''host -> ip -> {'speed', 'latency', 'failed', 'time'}, saved as json'''
+	def __init__(self, path, ttl):
+		self.path = path
+		self.ttl = ttl
+		self.lock = threading.Lock()
+
+	def load(self):
+		import json
+		try:
+			with open(self.path) as x:
+				scores = json.load(x)
+		except (IOError, ValueError):
+			return {}
+		now = time()
+		for host in scores.keys():
+			for ip in scores[host].keys():
+				if now - scores[host][ip]['time'] > self.ttl:
+					del scores[host][ip]
+			if not scores[host]:
+				del scores[host]
+		return scores
+
+	def get(self, host):
+		with self.lock:
+			return self.load().get(host, {})
+
+	def update(self, host, host_scores):
+		import json
+		with self.lock:
+			scores = self.load()
+			scores.setdefault(host, {}).update(host_scores)
+			try:
+				with open(self.path + '.tmp', 'w') as x:
+					json.dump(scores, x)
+				if os.name == 'nt' and os.path.exists(self.path):
+					os.remove(self.path)
+				os.rename(self.path + '.tmp', self.path)
+			except (IOError, OSError):
+				pass # read only home? probe again next time
+
+scores = None
+scores_lock = threading.Lock()
+host_locks = {}
+
+def get_scores():
+	global scores
+	with scores_lock:
+		if scores is None:
+			from lixian_config import get_config, get_config_path
+			if get_config('endpoint-probe', True):
+				scores = Scores(get_config_path('.xunlei.lixian.endpoints'), int(get_config('endpoint-ttl', 3600)))
+			else:
+				scores = False
+		return scores
+
+def get_host_lock(host):
+	with scores_lock:
+		if host not in host_locks:
+			host_locks[host] = threading.Lock()
+		return host_locks[host]
+
+def race(ips, port, host, path, headers):
+	'''probes all ips at the same time, returns their scores'''
+	results = {}
+	def run(ip):
+		try:
+			latency, speed = probe(ip, port, host, path, headers)
+			results[ip] = {'latency': latency, 'speed': speed, 'failed': False, 'time': time()}
+		except (socket.error, IOError, ValueError):
+			results[ip] = {'latency': None, 'speed': 0, 'failed': True, 'time': time()}
+	threads = [threading.Thread(target=run, args=(ip,)) for ip in ips]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	for thread in threads:
+		thread.join(probe_timeout + 1)
+	return dict(results)
+
+def rank_addresses(host, port, path, headers=None):
+	'''the addresses of host, the best first. raises socket.error if host can't be resolved.'''
+	ips = resolve_all(host, port)
+	if len(ips) < 2:
+		return ips
+	scores = get_scores()
+	if not scores:
+		return ips
+	with get_host_lock(host): # probe a host once, even if several downloads start together
+		host_scores = scores.get(host)
+		unknown = [ip for ip in ips if ip not in host_scores]
+		if unknown:
+			probed = race(unknown, port, host, path, headers)
+			scores.update(host, probed)
+			host_scores.update(probed)
+	def rank(ip):
+		score = host_scores.get(ip)
+		if score is None or score['failed']:
+			return 1, 0
+		return 0, -score['speed']
+	return sorted(ips, key=rank) # stable: DNS order among equals
+
+def report_failure(host, ip):
+	'''ranks ip last for host, until the score expires'''
+	scores = get_scores()
+	if scores:
+		scores.update(host, {ip: {'latency': None, 'speed': 0, 'failed': True, 'time': time()}})
@@ -0,0 +1,60 @@
+
+'''Fetching of remote resources needed to build queries: torrent files given
+by url and the pages read by page parsers.
+
+An input file may list hundreds of them. They are fetched concurrently (by up
+to fetch-concurrency threads), each with its own timeout (fetch-timeout
+seconds), and a failure doesn't stop the other fetches: each outcome is kept,
+and an error is raised where the failed resource is used.
+'''
+
+__all__ = ['fetch', 'fetch_page', 'fetch_all', 'outcome_result', 'raise_first_error']
+
+from lixian_config import get_config
+
+def get_timeout():
+	return float(get_config('fetch-timeout', 60))
+
+def get_concurrency():
+	return int(get_config('fetch-concurrency', 4))
+
+def fetch(url, timeout=None):
+	'''reads url, giving up after timeout seconds without data'''
+	import lixian_resolver
+	return lixian_resolver.urlopen(url, timeout=timeout or get_timeout()).read()
+
+def fetch_page(url, timeout=None):
+	'''like fetch, but through the http cache (see lixian_http_cache), for pages which are read again and again'''
+	import lixian_http_cache
+	return lixian_http_cache.fetch_cached(url, timeout or get_timeout())
+
+def capture(f):
+	import sys
+	def captured(x):
+		try:
+			return True, f(x)
+		except KeyboardInterrupt:
+			raise
+		except:
+			return False, sys.exc_info()
+	return captured
+
+def fetch_all(f, items, concurrency=None):
+	'''calls f on every item, in up to concurrency threads.
+
+	returns the outcome of each item, in order: (True, result) or (False, exc_info).
+	'''
+	from lixian import imap_ordered
+	return list(imap_ordered(capture(f), items, concurrency or get_concurrency()))
+
+def outcome_result(outcome):
+	'''the result of an outcome, or its error raised again'''
+	ok, result = outcome
+	if not ok:
+		raise result[0], result[1], result[2]
+	return result
+
+def raise_first_error(outcomes):
+	for outcome in outcomes:
+		outcome_result(outcome)
+
@@ -2,68 +2,135 @@
 __all__ = ['filter_expr']
 
 import re
+from lixian_records import is_record
 
 def get_name(x):
-	assert isinstance(x, (basestring, dict))
-	if type(x) == dict:
+	assert isinstance(x, basestring) or is_record(x)
+	if is_record(x):
 		return x['name']
 	else:
 		return x
 
-def filter_expr1(links, p):
-	if not links:
-		return links
-	if re.match(r'^\[[^][]+\]$', p):
-		matched = []
-		for p in re.split(r'\s*,\s*', p[1:-1]):
-			assert re.match(r'^\d+(-\d+)?|\.\w+$', p), p
-			if re.match(r'^\d+$', p):
-				i = int(p)
-				matched.append((i, links[i]))
-			elif '-' in p:
-				start, end = p.split('-')
-				if not start:
-					start = 0
-				if not end:
-					end = len(links) - 1
-				start = int(start)
-				end = int(end)
-				assert 0 <= start < len(links)
-				assert 0 <= end < len(links)
-				if start <= end:
-					matched += list(enumerate(links))[start:end+1]
-				else:
-					matched += reversed(list(enumerate(links))[end:start+1])
-			elif p.startswith('.'):
-				matched += filter(lambda (i, x): get_name(x).lower().endswith(p.lower()), enumerate(links))
+##################################################
+# compile
+##################################################
+
+# an expression like 0/[1-500,.mkv]/size:1g+/sort: is compiled once into a list of steps,
+# each step being a function from links to links.
+
+def compile_range_item(p):
+	'''compiles one item of [...] into a function returning the matched indexes'''
+	assert re.match(r'^\d+(-\d+)?|\.\w+$', p), p
+	if re.match(r'^\d+$', p):
+		i = int(p)
+		def select(links):
+			links[i] # IndexError if out of range
+			return [i]
+		return select
+	elif '-' in p:
+		start, end = p.split('-')
+		def select(links):
+			s = int(start) if start else 0
+			e = int(end) if end else len(links) - 1
+			assert 0 <= s < len(links)
+			assert 0 <= e < len(links)
+			if s <= e:
+				return range(s, e+1)
 			else:
-				raise NotImplementedError(p)
+				return range(s, e-1, -1)
+		return select
+	elif p.startswith('.'):
+		ext = p.lower()
+		return lambda links: [i for i, x in enumerate(links) if get_name(x).lower().endswith(ext)]
+	else:
+		raise NotImplementedError(p)
+
+def compile_range(p):
+	selectors = map(compile_range_item, re.split(r'\s*,\s*', p[1:-1]))
+	def step(links):
 		indexes = []
-		for i, _ in matched:
-			if i not in indexes:
-				indexes.append(i)
-		return [links[x] for x in indexes]
-	elif re.match(r'^\d+$', p):
-		n = int(p)
+		seen = set()
+		for select in selectors:
+			for i in select(links):
+				if i not in seen:
+					seen.add(i)
+					indexes.append(i)
+		return [links[i] for i in indexes]
+	return step
+
+def compile_search(p):
+	pattern = re.compile(p, re.I)
+	return lambda links: [x for x in links if pattern.search(get_name(x))]
+
+def compile_index(p):
+	n = int(p)
+	def step(links):
 		if 0 <= n < len(links):
-			return [links[int(p)]]
+			return [links[n]]
 		else:
-			return filter(lambda x: re.search(p, get_name(x), re.I), links)
-	elif p == '*':
-		return links
-	elif re.match(r'\.\w+$', p):
-		return filter(lambda x: get_name(x).lower().endswith(p.lower()), links)
-	else:
+			# digits match the same with re.search(p, name, re.I) and a plain substring search
+			import lixian_name_index
+			return lixian_name_index.search_names(links, p)
+	return step
+
+def compile_plugin_filter(p):
+	search = []
+	def step(links):
 		import lixian_plugins.filters
 		filter_results = lixian_plugins.filters.filter_things(links, p)
 		if filter_results is None:
-			return filter(lambda x: re.search(p, get_name(x), re.I), links)
+			if not search:
+				search.append(compile_search(p))
+			return search[0](links)
 		else:
 			return filter_results
+	return step
 
-def filter_expr(links, expr):
-	for p in expr.split('/'):
-		links = filter_expr1(links, p)
-	return links
+def compile_expr1(p):
+	if re.match(r'^\[[^][]+\]$', p):
+		return compile_range(p)
+	elif re.match(r'^\d+$', p):
+		return compile_index(p)
+	elif p == '*':
+		return lambda links: links
+	elif re.match(r'\.\w+$', p):
+		ext = p.lower()
+		return lambda links: [x for x in links if get_name(x).lower().endswith(ext)]
+	else:
+		return compile_plugin_filter(p)
+
+def compile_step(p):
+	try:
+		return compile_expr1(p)
+	except (AssertionError, NotImplementedError, re.error):
+		# an invalid part only fails when there is something to filter, as it used to
+		import sys
+		error = sys.exc_info()
+		def step(links):
+			raise error[0], error[1], error[2]
+		return step
 
+compiled_exprs = {}
 
+def compile_expr(expr):
+	'''returns the (cached) list of steps of an expression'''
+	steps = compiled_exprs.get(expr)
+	if steps is None:
+		steps = compiled_exprs[expr] = map(compile_step, expr.split('/'))
+	return steps
+
+##################################################
+# filter
+##################################################
+
+def filter_expr1(links, p):
+	if not links:
+		return links
+	return compile_expr(p)[0](links)
+
+def filter_expr(links, expr):
+	for step in compile_expr(expr):
+		if not links:
+			return links
+		links = step(links)
+	return links
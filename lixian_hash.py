@@ -49,19 +49,44 @@ def dcid_hash_file(path):
 def verify_dcid(path, dcid):
 	return dcid_hash_file(path).lower() == dcid.lower()
 
+def gcid_hash_file(path):
+	h = hashlib.sha1()
+	size = os.path.getsize(path)
+	psize = 0x40000
+	while size / psize > 0x200 and psize < 0x200000:
+		psize = psize << 1
+	with open(path, 'rb') as stream:
+		while True:
+			bytes = stream.read(psize)
+			if not bytes:
+				break
+			h.update(hashlib.sha1(bytes).digest())
+	return h.hexdigest().upper()
+
+def verify_gcid(path, gcid):
+	return gcid_hash_file(path).lower() == gcid.lower()
+
 def main(args):
 	option = args.pop(0)
 	def verify_bt(f, t):
-		from lixian_progress import SimpleProgressBar
-		bar = SimpleProgressBar()
-		result = lixian_hash_bt.verify_bt_file(t, f, progress_callback=bar.update)
-		bar.done()
+		import lixian_progress
+		with open(f, 'rb') as x:
+			info = lixian_hash_bt.bdecode(x.read())['info']
+		size = info['length'] if 'length' in info else sum(x['length'] for x in info['files'])
+		progress = lixian_progress.transfer(t, total=size, phase='hash', tool='bt')
+		try:
+			result = lixian_hash_bt.verify_bt(t, info, progress_callback=progress.fraction)
+		except Exception, e:
+			progress.failed(str(e))
+			raise
+		progress.done(size)
 		return result
 	if option.startswith('--verify'):
 		hash_fun = {'--verify-sha1':verify_sha1,
 					'--verify-md5':verify_md5,
 					'--verify-md4':verify_md4,
 					'--verify-dcid':verify_dcid,
+					'--verify-gcid':verify_gcid,
 					'--verify-ed2k':lixian_hash_ed2k.verify_ed2k_link,
 					'--verify-bt': verify_bt,
 				   }[option]
@@ -76,6 +101,7 @@ def main(args):
 					'--md5':md5_hash_file,
 					'--md4':md4_hash_file,
 					'--dcid':dcid_hash_file,
+					'--gcid':gcid_hash_file,
 					'--ed2k':lixian_hash_ed2k.generate_ed2k_link,
 					'--info-hash':lixian_hash_bt.info_hash,
 				   }[option]
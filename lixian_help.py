@@ -138,7 +138,12 @@ Options:
  --input=[file]    -i            Download URLs found in file.
  --output=[file]   -o            Download task to file.
  --output-dir=[dir]              Download task to dir.
- --tool=[wget|asyn|aria2|curl]   Choose download tool.
+ --library=[dir1:dir2]           Look for files with the same size and hash (dcid/gcid/ed2k) in these local dirs,
+                                 and hardlink (or copy) them instead of downloading. Files shared by several tasks
+                                 in one run are always downloaded only once.
+                                 Use lx config no-library-hardlink to always copy.
+ --tool=[wget|asyn|engine|aria2|aria2-rpc|curl|auto]
+                                 Choose download tool.
                                  Default: wget
  --continue        -c            Continue downloading a partially downloaded file.
                                  Default: false.
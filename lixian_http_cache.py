@@ -0,0 +1,163 @@
+
+'''An on-disk cache of http responses, for the pages read by page parsers.
+
+Running lx again on the same topic pages used to download them again. A
+cached page is revalidated with If-None-Match/If-Modified-Since, and reused
+when the server answers 304 Not Modified. Only responses with an ETag or a
+Last-Modified header are cached, since nothing else can be revalidated.
+
+The cache lives in .xunlei.lixian.http-cache (next to the config file), and is
+kept under http-cache-size megabytes (20 by default) by evicting the least
+recently used pages. --no-http-cache in the config file turns it off.
+'''
+
+__all__ = ['HttpCache', 'fetch_cached']
+
+import os
+import os.path
+import time
+import threading
+
+class HttpCache(object):
+	def __init__(self, path, max_size):
+		self.path = path
+		self.max_size = max_size
+		self.lock = threading.Lock()
+		self.index = None
+
+	def index_path(self):
+		return os.path.join(self.path, 'index.json')
+
+	def body_path(self, key):
+		return os.path.join(self.path, key)
+
+	def load_index(self):
+		if self.index is None:
+			import json
+			try:
+				with open(self.index_path()) as x:
+					self.index = json.load(x)
+			except (IOError, ValueError):
+				self.index = {}
+		return self.index
+
+	def save_index(self):
+		import json
+		path = self.index_path()
+		with open(path + '.tmp', 'w') as x:
+			json.dump(self.index, x)
+		if os.name == 'nt' and os.path.exists(path):
+			os.remove(path)
+		os.rename(path + '.tmp', path)
+
+	def lookup(self, url):
+		'''returns (entry, body) of a cached page, or None'''
+		key = url_key(url)
+		with self.lock:
+			entry = self.load_index().get(key)
+			if not entry or entry['url'] != url:
+				return
+			try:
+				with open(self.body_path(key), 'rb') as x:
+					body = x.read()
+			except IOError:
+				return
+			if len(body) != entry['size']:
+				return
+			return entry, body
+
+	def touch(self, url):
+		with self.lock:
+			entry = self.load_index().get(url_key(url))
+			if entry:
+				entry['used'] = time.time()
+				self.save_index()
+
+	def store(self, url, etag, last_modified, body):
+		if len(body) > self.max_size:
+			return
+		key = url_key(url)
+		with self.lock:
+			index = self.load_index()
+			if not os.path.exists(self.path):
+				os.makedirs(self.path)
+			path = self.body_path(key)
+			with open(path + '.tmp', 'wb') as x:
+				x.write(body)
+			if os.name == 'nt' and os.path.exists(path):
+				os.remove(path)
+			os.rename(path + '.tmp', path)
+			index[key] = {'url': url, 'etag': etag, 'last_modified': last_modified,
+			              'size': len(body), 'used': time.time()}
+			self.evict()
+			self.save_index()
+
+	def evict(self):
+		index = self.index
+		total = sum(entry['size'] for entry in index.values())
+		for key in sorted(index, key=lambda k: index[k]['used']):
+			if total <= self.max_size:
+				break
+			total -= index.pop(key)['size']
+			try:
+				os.remove(self.body_path(key))
+			except OSError:
+				pass
+
+	def fetch(self, url, timeout):
+		import urllib2
+		import lixian_resolver
+		cached = self.lookup(url)
+		request = urllib2.Request(url)
+		if cached:
+			entry, body = cached
+			if entry['etag']:
+				request.add_header('If-None-Match', entry['etag'])
+			if entry['last_modified']:
+				request.add_header('If-Modified-Since', entry['last_modified'])
+		try:
+			response = lixian_resolver.urlopen(request, timeout=timeout)
+		except urllib2.HTTPError, e:
+			if e.code == 304 and cached:
+				self.touch(url)
+				return body
+			raise
+		body = response.read()
+		headers = response.info()
+		etag = headers.getheader('ETag')
+		last_modified = headers.getheader('Last-Modified')
+		if (etag or last_modified) and 'no-store' not in (headers.getheader('Cache-Control') or ''):
+			try:
+				self.store(url, etag, last_modified, body)
+			except (IOError, OSError):
+				pass # read only home? just don't cache it
+		return body
+
+def url_key(url):
+	import hashlib
+	if isinstance(url, unicode):
+		url = url.encode('utf-8')
+	return hashlib.sha1(url).hexdigest()
+
+cache = None
+cache_lock = threading.Lock()
+
+def get_cache():
+	global cache
+	with cache_lock:
+		if cache is None:
+			from lixian_config import get_config, get_config_path
+			if get_config('http-cache', True):
+				cache = HttpCache(get_config_path('.xunlei.lixian.http-cache'),
+				                  int(get_config('http-cache-size', 20)) * 1024 * 1024)
+			else:
+				cache = False
+	return cache
+
+def fetch_cached(url, timeout):
+	cache = get_cache()
+	if cache:
+		return cache.fetch(url, timeout)
+	import lixian_resolver
+	return lixian_resolver.urlopen(url, timeout=timeout).read()
+
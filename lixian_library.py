@@ -0,0 +1,199 @@
+
+__all__ = ['Library', 'open_library']
+
+import os
+import os.path
+import json
+import shutil
+
+import lixian_hash
+import lixian_hash_ed2k
+from lixian_config import get_config_path
+
+LIXIAN_DEFAULT_LIBRARY_INDEX = get_config_path('.xunlei.lixian.library')
+
+def ed2k_hash_of(task):
+	if task['type'] != 'ed2k':
+		return
+	try:
+		return lixian_hash_ed2k.parse_ed2k_id(task['original_url'])[0]
+	except Exception:
+		return
+
+def link_or_copy(source, target, hardlink=True):
+	if os.path.exists(target):
+		os.remove(target)
+	if hardlink and hasattr(os, 'link'):
+		try:
+			os.link(source, target)
+			return 'linked'
+		except OSError:
+			pass # e.g. cross-device link, fall back to copy
+	shutil.copyfile(source, target)
+	return 'copied'
+
+# paths are kept as they come from os.walk: bytes, in whatever encoding the file
+# system uses. in the index file they are mapped byte for byte to latin-1 strings.
+
+def path_to_json(path):
+	return path.decode('latin-1')
+
+def path_from_json(path):
+	return path.encode('latin-1')
+
+class Library:
+	'''Index of local files, keyed by size, dcid, gcid and ed2k hash.
+
+	Only file sizes are collected when scanning library directories; hashes are
+	computed lazily for files whose size matches a task, and are persisted in
+	the index file (invalidated by size or mtime changes).
+
+	Files downloaded in the current run are registered too, so that sub-tasks
+	sharing the same content are downloaded only once.
+	'''
+	def __init__(self, dirs=(), index_path=LIXIAN_DEFAULT_LIBRARY_INDEX, hardlink=True):
+		self.dirs = [os.path.abspath(os.path.expanduser(d)) for d in dirs]
+		self.index_path = index_path
+		self.hardlink = hardlink
+		self.entries = None
+		self.by_size = None
+		self.dirty = False
+		self.downloaded = {}
+
+	def load(self):
+		self.entries = {}
+		if self.dirs and os.path.exists(self.index_path):
+			try:
+				with open(self.index_path) as x:
+					entries = json.load(x)
+			except ValueError:
+				entries = {}
+			for path in entries:
+				try:
+					self.entries[path_from_json(path)] = entries[path]
+				except UnicodeError:
+					pass # not written by path_to_json, hash it again
+
+	def save(self):
+		if not self.dirty:
+			return
+		entries = {}
+		for path in self.entries:
+			try:
+				entries[path_to_json(path)] = self.entries[path]
+			except UnicodeError:
+				pass # not kept, hash it again next time
+		try:
+			with open(self.index_path + '.tmp', 'w') as x:
+				json.dump(entries, x)
+			if os.name == 'nt' and os.path.exists(self.index_path):
+				os.remove(self.index_path)
+			os.rename(self.index_path + '.tmp', self.index_path)
+		except (IOError, OSError):
+			pass # read only home? hash again next time
+		self.dirty = False
+
+	def scan(self):
+		self.load()
+		entries = {}
+		by_size = {}
+		for root in self.dirs:
+			for dirpath, dirnames, filenames in os.walk(root):
+				for name in filenames:
+					path = os.path.join(dirpath, name)
+					try:
+						stat = os.stat(path)
+					except OSError:
+						continue
+					entry = self.entries.get(path)
+					if not entry or entry['size'] != stat.st_size or entry['mtime'] != int(stat.st_mtime):
+						entry = {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+						self.dirty = True
+					entries[path] = entry
+					by_size.setdefault(stat.st_size, []).append(path)
+		if len(entries) != len(self.entries):
+			self.dirty = True
+		self.entries = entries
+		self.by_size = by_size
+
+	def get_hash(self, path, key):
+		entry = self.entries[path]
+		if key not in entry:
+			entry[key] = {'dcid': lixian_hash.dcid_hash_file,
+			              'gcid': lixian_hash.gcid_hash_file,
+			              'ed2k': lixian_hash_ed2k.hash_file}[key](path).lower()
+			self.dirty = True
+		return entry[key]
+
+	def matches(self, path, task):
+		if not os.path.exists(path) or os.path.getsize(path) != task['size']:
+			return False
+		if self.get_hash(path, 'dcid') != task['dcid'].lower():
+			return False
+		if task.get('gcid'):
+			return self.get_hash(path, 'gcid') == task['gcid'].lower()
+		ed2k = ed2k_hash_of(task)
+		if ed2k:
+			return self.get_hash(path, 'ed2k') == ed2k.lower()
+		return True
+
+	def find_downloaded(self, task):
+		if task.get('gcid'):
+			path = self.downloaded.get(('gcid', task['gcid'].lower()))
+		else:
+			path = self.downloaded.get(('dcid', task['size'], task['dcid'].lower()))
+		if path and os.path.exists(path) and os.path.getsize(path) == task['size']:
+			return path
+
+	def find(self, task):
+		if not task.get('dcid'):
+			return
+		path = self.find_downloaded(task)
+		if path:
+			return path
+		if not self.dirs:
+			return
+		if self.by_size is None:
+			self.scan()
+		try:
+			for path in self.by_size.get(task['size'], []):
+				if self.matches(path, task):
+					return path
+		finally:
+			self.save()
+
+	def add(self, path, task):
+		path = os.path.abspath(path)
+		if task.get('gcid'):
+			self.downloaded[('gcid', task['gcid'].lower())] = path
+		if task.get('dcid'):
+			self.downloaded[('dcid', task['size'], task['dcid'].lower())] = path
+
+	def discard(self, path):
+		if self.entries and path in self.entries:
+			size = self.entries.pop(path)['size']
+			self.by_size[size] = [p for p in self.by_size.get(size, []) if p != path]
+			self.dirty = True
+		for k, v in self.downloaded.items():
+			if v == path:
+				del self.downloaded[k]
+
+	def restore(self, path, task, verify):
+		source = self.find(task)
+		if not source or os.path.abspath(source) == os.path.abspath(path):
+			return False
+		print 'Found', source, 'in local library'
+		link_or_copy(source, path, self.hardlink)
+		if verify(path, task):
+			self.add(path, task)
+			return True
+		print 'hash error in local library file %s, downloading...' % source
+		os.remove(path)
+		self.discard(source)
+		self.save()
+		return False
+
+def open_library(dirs=None, hardlink=True):
+	if dirs:
+		dirs = [d for d in dirs.split(os.pathsep) if d]
+	return Library(dirs or [], hardlink=hardlink)
@@ -0,0 +1,90 @@
+
+'''Substring search over task and file names.
+
+search_names(links, text) returns the links whose name contains text, ignoring
+case, in their original order -- exactly what name.lower().find(text.lower())
+over every link returns, but cheaper when a task list is searched again and
+again (one DefaultQuery per argument, numeric filters on sub-files, raw:...).
+
+The lowercased names of a list are computed once and kept as long as the same
+list is searched. Once a list has been searched often enough, a trigram index
+is built, and a search then only checks the names which contain the rarest
+trigram of the text.
+'''
+
+__all__ = ['search_names', 'name_index']
+
+from lixian_records import is_record
+
+# a scan of the lowercased names is ~50x cheaper than building the trigram
+# index, so only build it for lists which are searched a lot
+trigram_threshold = 32
+
+# id(links) -> (links, index), for the most recently searched lists
+indexes = {}
+max_indexes = 16
+
+def get_name(x):
+	return x['name'] if is_record(x) else x
+
+def trigrams(s):
+	return set([s[i:i+3] for i in xrange(len(s)-2)])
+
+class NameIndex(object):
+	def __init__(self, links):
+		self.links = links
+		self.names = [get_name(x).lower() for x in links]
+		self.searches = 0
+		self.postings = None
+
+	def build_trigrams(self):
+		postings = {}
+		for i, name in enumerate(self.names):
+			for g in trigrams(name):
+				p = postings.get(g)
+				if p is None:
+					postings[g] = [i]
+				else:
+					p.append(i)
+		self.postings = postings
+
+	def candidates(self, text):
+		'''indexes of the names which may contain text'''
+		if len(text) < 3:
+			return xrange(len(self.names))
+		self.searches += 1
+		if self.postings is None:
+			if self.searches < trigram_threshold:
+				return xrange(len(self.names))
+			self.build_trigrams()
+		postings = self.postings
+		best = None
+		for g in trigrams(text):
+			p = postings.get(g)
+			if p is None:
+				return ()
+			if best is None or len(p) < len(best):
+				best = p
+		return best
+
+	def search(self, text):
+		text = text.lower()
+		names = self.names
+		links = self.links
+		return [links[i] for i in self.candidates(text) if text in names[i]]
+
+def name_index(links):
+	'''the (cached) index of a list of tasks, files or names'''
+	key = id(links)
+	entry = indexes.get(key)
+	if entry is not None and entry[0] is links and len(entry[1].names) == len(links):
+		return entry[1]
+	if len(indexes) >= max_indexes:
+		indexes.clear()
+	index = NameIndex(links)
+	indexes[key] = (links, index)
+	return index
+
+def search_names(links, text):
+	return name_index(links).search(text)
+
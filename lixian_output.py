@@ -0,0 +1,138 @@
+
+'''Output files of the built-in download tools (asyn and engine).
+
+The whole file is preallocated when it's opened (on Linux, with fallocate),
+so that several concurrent downloads don't interleave their blocks on disk,
+and reading them back later (hash checks) stays sequential. The allocation
+keeps the apparent file size (FALLOC_FL_KEEP_SIZE): the size on disk is
+still what was downloaded, which is what resuming relies on.
+
+Config:
+  --no-preallocate           don't preallocate.
+  --download-buffer-size=1m  how much a tool receives before writing it out.
+  --download-fsync=never     never, close (before closing the file), or a size
+                             like 64m (after every 64m written).
+'''
+
+__all__ = ['OutputFile', 'get_buffer_size']
+
+import os
+import re
+import sys
+
+FALLOC_FL_KEEP_SIZE = 1
+
+def parse_size(s):
+	m = re.match(r'^(\d+)([kmg])?b?$', str(s).strip().lower())
+	assert m, 'invalid size: %s' % s
+	n, u = m.groups()
+	return int(n) * {None: 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}[u]
+
+def get_buffer_size():
+	from lixian_config import get_config
+	return parse_size(get_config('download-buffer-size', '1m'))
+
+def get_fsync_policy():
+	'''None (never), 0 (on close), or every how many bytes'''
+	from lixian_config import get_config
+	policy = str(get_config('download-fsync', 'never')).lower()
+	if policy == 'never':
+		return None
+	elif policy == 'close':
+		return 0
+	else:
+		return parse_size(policy)
+
+fallocate_function = None
+
+def get_fallocate():
+	global fallocate_function
+	if fallocate_function is None:
+		fallocate_function = False
+		if sys.platform.startswith('linux'):
+			try:
+				import ctypes
+				import ctypes.util
+				libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+				f = getattr(libc, 'fallocate64', None) or libc.fallocate
+				f.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+				fallocate_function = f
+			except (OSError, AttributeError):
+				pass
+	return fallocate_function
+
+def allocate(fd, offset, length):
+	'''allocates disk blocks for [offset, offset+length), without changing the file size. returns False if not supported.'''
+	f = get_fallocate()
+	if not f or length <= 0:
+		return False
+	return f(fd, FALLOC_FL_KEEP_SIZE, offset, length) == 0
+
+class OutputFile(object):
+	'''a file written at explicit offsets, starting at offset (what's already
+	downloaded; anything after it is cut), preallocated up to size if known
+	(and preallocate, by default the preallocate config)'''
+	def __init__(self, path, offset=0, size=None, preallocate=None):
+		from lixian_config import get_config
+		flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+		if not offset:
+			flags |= os.O_TRUNC
+		self.fd = os.open(path, flags, 0666)
+		self.path = path
+		self.size = size
+		self.offset = offset # where the next write goes
+		self.position = None # of the fd, as far as we know
+		self.end = offset # of what was written
+		self.fsync = get_fsync_policy()
+		self.unsynced = 0
+		try:
+			if offset:
+				os.ftruncate(self.fd, offset)
+			if preallocate is None:
+				preallocate = get_config('preallocate', True)
+			self.preallocated = size is not None and preallocate and allocate(self.fd, offset, size - offset)
+		except:
+			os.close(self.fd)
+			raise
+
+	def write_at(self, offset, data):
+		if self.position != offset:
+			os.lseek(self.fd, offset, os.SEEK_SET)
+		view = memoryview(data)
+		while view:
+			n = os.write(self.fd, view)
+			view = view[n:]
+			offset += n
+			self.unsynced += n
+		self.position = offset
+		self.end = max(self.end, offset)
+		if self.fsync and self.unsynced >= self.fsync:
+			self.sync()
+
+	def write(self, data):
+		'''writes data at the current offset'''
+		self.write_at(self.offset, data)
+		self.offset = self.position
+
+	def sync(self):
+		getattr(os, 'fdatasync', os.fsync)(self.fd)
+		self.unsynced = 0
+
+	def close(self):
+		if self.fd is None:
+			return
+		fd = self.fd
+		self.fd = None
+		try:
+			if self.preallocated and self.end < self.size:
+				os.ftruncate(fd, self.end) # incomplete, release the blocks allocated past the end
+			if self.fsync is not None and self.unsynced:
+				getattr(os, 'fdatasync', os.fsync)(fd)
+		finally:
+			os.close(fd)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
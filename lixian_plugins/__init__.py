@@ -1,4 +1,26 @@
 
+'''Plugins are loaded lazily.
+
+Instead of importing every plugin module at startup, the plugin directories are
+scanned (without importing anything) for what each module declares: commands,
+task/name filters, page parsers, download tools and aliases. The result is a
+small manifest, cached on disk and regenerated when plugin files change.
+Declarations are registered as placeholders, and the module is imported the
+first time one of them is actually used.
+
+Modules under queries/ (and modules registering query processors) are imported
+when queries are built. Modules which declare nothing recognizable are imported
+at startup, as before.
+'''
+
+plugin_dirs = ['lixian_plugins.commands',
+               'lixian_plugins.queries',
+               'lixian_plugins.filters',
+               'lixian_plugins.parsers',
+               'lixian_plugins']
+
+manifest_version = 1
+
 def load_plugins_at(dir):
 	import os
 	import os.path
@@ -11,10 +33,216 @@ def load_plugins_at(dir):
 		__import__(dir + '.' + p)
 
 def load_plugins():
-	load_plugins_at('lixian_plugins.commands')
-	load_plugins_at('lixian_plugins.queries')
-	load_plugins_at('lixian_plugins.filters')
-	load_plugins_at('lixian_plugins.parsers')
-	load_plugins_at('lixian_plugins')
+	'''import all plugins, eagerly'''
+	for dir in plugin_dirs:
+		load_plugins_at(dir)
+
+##################################################
+# manifest
+##################################################
+
+def list_plugin_files():
+	import os
+	import os.path
+	import re
+	home = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	files = {}
+	for dir in plugin_dirs:
+		plugin_dir = os.path.join(home, dir.replace('.', os.path.sep))
+		for p in os.listdir(plugin_dir):
+			if re.match(r'^[a-zA-Z]\w*\.py$', p):
+				path = os.path.join(plugin_dir, p)
+				files[dir + '.' + p[:-3]] = (path, os.path.getmtime(path))
+	return files
+
+def literal(node):
+	import ast
+	return ast.literal_eval(node)
+
+def call_name(node):
+	import ast
+	if isinstance(node, ast.Call):
+		node = node.func
+	if isinstance(node, ast.Name):
+		return node.id
+	if isinstance(node, ast.Attribute):
+		return node.attr
+
+def call_args(node, names):
+	'''positional and keyword literal arguments of a decorator call, as a dict'''
+	import ast
+	if not isinstance(node, ast.Call):
+		return {}
+	if node.starargs or node.kwargs:
+		raise ValueError('dynamic arguments')
+	args = dict(zip(names, map(literal, node.args)))
+	for k in node.keywords:
+		args[k.arg] = literal(k.value)
+	return args
+
+query_declarations = ['query', 'bt_query', 'user_query', 'extract_info_hash_from_url', 'download_torrent_from_url']
+
+def scan_declaration(decorator, node):
+	'''returns a manifest entry for a registering decorator, 'query' for query processors, or None'''
+	import ast
+	import re
+	import textwrap
+	name = call_name(decorator)
+	if name == 'command':
+		args = call_args(decorator, ['name', 'usage', 'help'])
+		help = args.get('help') or ast.get_docstring(node, clean=False)
+		if help:
+			help = textwrap.dedent(help)
+		return {'kind': 'command', 'name': args.get('name') or node.name.replace('_', '-'),
+		        'usage': args.get('usage', ''), 'help': help}
+	elif name in ('task_filter', 'name_filter'):
+		args = call_args(decorator, ['pattern', 'protocol', 'batch'])
+		pattern = args.get('pattern') or (r'^%s:' % args['protocol'])
+		return {'kind': name, 'pattern': pattern}
+	elif name == 'page_parser':
+		pattern = call_args(decorator, ['pattern'])['pattern']
+		return {'kind': 'parser', 'patterns': pattern if type(pattern) is list else [pattern]}
+	elif name == 'download_tool':
+		return {'kind': 'download_tool', 'name': call_args(decorator, ['name'])['name']}
+	elif name in query_declarations:
+		return 'query'
+
+def scan_module(path):
+	'''statically collect what a plugin module registers.
+	returns (entries, mode) where mode is 'lazy', 'query' or 'eager'.'''
+	import ast
+	with open(path) as x:
+		tree = ast.parse(x.read(), path)
+	entries = []
+	mode = 'lazy'
+	try:
+		for node in tree.body:
+			if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+				for decorator in node.decorator_list:
+					entry = scan_declaration(decorator, node)
+					if entry == 'query':
+						mode = 'query'
+					elif entry:
+						entries.append(entry)
+			elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
+				name = call_name(node.value)
+				if name == 'register_alias':
+					args = call_args(node.value, ['alias', 'command'])
+					entries.append({'kind': 'alias', 'alias': args['alias'], 'command': args['command']})
+				elif name in query_declarations:
+					mode = 'query'
+				else:
+					return [], 'eager'
+	except (ValueError, KeyError):
+		# arguments can't be evaluated statically
+		return [], 'eager'
+	if mode == 'lazy' and not entries:
+		mode = 'eager'
+	return entries, mode
+
+def build_manifest(files):
+	modules = {}
+	for module in sorted(files):
+		path, mtime = files[module]
+		entries, mode = scan_module(path)
+		if module.startswith('lixian_plugins.queries.'):
+			mode = 'query'
+		modules[module] = {'mtime': mtime, 'mode': mode, 'entries': entries}
+	return {'version': manifest_version, 'modules': modules}
+
+def manifest_path():
+	from lixian_config import get_config_path
+	return get_config_path('.xunlei.lixian.plugins')
+
+def is_manifest_fresh(manifest, files):
+	if not manifest or manifest.get('version') != manifest_version:
+		return False
+	modules = manifest['modules']
+	if sorted(modules) != sorted(files):
+		return False
+	for module in files:
+		if modules[module]['mtime'] != files[module][1]:
+			return False
+	return True
+
+def load_manifest():
+	import os.path
+	import json
+	files = list_plugin_files()
+	path = manifest_path()
+	manifest = None
+	if os.path.exists(path):
+		try:
+			with open(path) as x:
+				manifest = json.load(x)
+		except ValueError:
+			manifest = None
+	if not is_manifest_fresh(manifest, files):
+		manifest = build_manifest(files)
+		try:
+			with open(path, 'w') as x:
+				json.dump(manifest, x)
+		except IOError:
+			pass # read only home? just don't cache it
+	return manifest
+
+##################################################
+# lazy registration
+##################################################
+
+query_modules = []
+
+def native(s):
+	'''the manifest is read back from json as unicode; everything else here is str'''
+	return s.encode('utf-8') if isinstance(s, unicode) else s
+
+loaded_modules = set()
+
+def load_module(module):
+	if module not in loaded_modules:
+		loaded_modules.add(module)
+		__import__(module)
+
+def load_query_plugins():
+	for module in query_modules:
+		load_module(module)
+
+def register_manifest(manifest):
+	import lixian_plugins.commands
+	import lixian_plugins.filters
+	import lixian_plugins.parsers
+	import lixian_alias
+	import lixian_download_tools
+	eager = []
+	for module in sorted(manifest['modules']):
+		info = manifest['modules'][module]
+		module = native(module)
+		if info['mode'] == 'eager':
+			eager.append(module)
+			continue
+		if info['mode'] == 'query':
+			query_modules.append(module)
+		for entry in info['entries']:
+			kind = entry['kind']
+			if kind == 'command':
+				lixian_plugins.commands.register_lazy_command(module, native(entry['name']), native(entry['usage']), native(entry['help']))
+			elif kind in ('task_filter', 'name_filter'):
+				lixian_plugins.filters.register_lazy_filter(module, native(entry['pattern']))
+			elif kind == 'parser':
+				for p in entry['patterns']:
+					lixian_plugins.parsers.register_lazy_parser(module, native(p))
+			elif kind == 'download_tool':
+				lixian_download_tools.register_lazy_tool(module, native(entry['name']))
+			elif kind == 'alias':
+				lixian_alias.register_alias(native(entry['alias']), native(entry['command']))
+	for module in eager:
+		load_module(module)
+
+def init_plugins():
+	import os
+	if os.getenv('LIXIAN_EAGER_PLUGINS'):
+		load_plugins()
+	else:
+		register_manifest(load_manifest())
 
-load_plugins()
+init_plugins()
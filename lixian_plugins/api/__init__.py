@@ -2,7 +2,7 @@
 __all__ = ['command', 'register_alias',
            'user_query', 'extract_info_hash_from_url', 'download_torrent_from_url',
            'task_filter', 'name_filter',
-           'page_parser']
+           'page_parser', 'fetch_page']
 
 ##################################################
 # commands
@@ -58,6 +58,9 @@ def page_parser(pattern):
 			lixian_plugins.parsers.register_parser(p, extend_links)
 	return f
 
+# fetches a page through the http cache shared by all page parsers
+from lixian_fetch import fetch_page
+
 
 ##################################################
 # download tools
@@ -15,11 +15,24 @@ def update_helps(commands):
 		setattr(lixian_help, name, doc)
 
 def register_command(command):
+	# a real command replaces the lazy placeholder of the same name
+	extended_commands[:] = [x for x in extended_commands if x.command_name != command.command_name]
 	extended_commands.append(command)
-	global commands
-	commands = dict((x.command_name, x) for x in extended_commands)
+	commands[command.command_name] = command
 	update_helps(sorted((x.command_name, x.command_usage, x.command_help) for x in extended_commands))
 
+def register_lazy_command(module, name, usage, help):
+	'''register a command whose module is only imported when the command runs'''
+	def lazy_command(args):
+		import lixian_plugins
+		lixian_plugins.load_module(module)
+		assert commands[name] is not lazy_command, 'command %s not found in %s' % (name, module)
+		return commands[name](args)
+	lazy_command.command_name = name
+	lazy_command.command_usage = usage
+	lazy_command.command_help = help
+	register_command(lazy_command)
+
 
 def command(name='', usage='', help=''):
 	def as_command(f):
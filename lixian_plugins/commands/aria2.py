@@ -8,33 +8,27 @@ from lixian_cli_parser import with_parser
 from lixian_cli_parser import command_line_option, command_line_value
 from lixian_commands.util import parse_login, create_client
 
-def export_aria2_conf(args):
-	client = create_client(args)
+def export_aria2_files(client, args):
+	'''yields (url, name, dir, task or bt file) of the tasks to download'''
 	import lixian_query
 	tasks = lixian_query.search_tasks(client, args)
-	files = []
-	for task in tasks:
-		if task['type'] == 'bt':
-			subs, skipped, single_file = lixian_query.expand_bt_sub_tasks(task)
-			if not subs:
-				continue
-			if single_file:
-				files.append((subs[0]['xunlei_url'], subs[0]['name'], None))
-			else:
-				for f in subs:
-					files.append((f['xunlei_url'], f['name'], task['name']))
-		else:
-			files.append((task['xunlei_url'], task['name'], None))
-	output = ''
-	for url, name, dir in files:
-		if type(url) == unicode:
-			url = url.encode(default_encoding)
-		output += url + '\n'
-		output += '  out=' + name.encode(default_encoding) + '\n'
-		if dir:
-			output += '  dir=' + dir.encode(default_encoding) + '\n'
-		output += '  header=Cookie: gdriveid=' + client.get_gdriveid() + '\n'
-	return output
+	return lixian_query.iter_download_files(client, tasks)
+
+def aria2_conf_entry(client, url, name, dir):
+	if type(url) == unicode:
+		url = url.encode(default_encoding)
+	entry = url + '\n'
+	entry += '  out=' + name.encode(default_encoding) + '\n'
+	if dir:
+		entry += '  dir=' + dir.encode(default_encoding) + '\n'
+	entry += '  header=Cookie: gdriveid=' + client.get_gdriveid() + '\n'
+	return entry
+
+def export_aria2_conf(args):
+	'''yields the aria2 input file, one entry at a time'''
+	client = create_client(args)
+	for url, name, dir, task in export_aria2_files(client, args):
+		yield aria2_conf_entry(client, url, name, dir)
 
 @command(usage='export task download urls as aria2 format')
 @command_line_parser()
@@ -44,15 +38,27 @@ def export_aria2(args):
 	'''
 	usage: lx export-aria2 [id|name]...
 	'''
-	print export_aria2_conf(args)
+	import sys
+	for entry in export_aria2_conf(args):
+		sys.stdout.write(entry)
+		sys.stdout.flush() # for lx export-aria2 | aria2c -i -
 
 def download_aria2_stdin(aria2_conf, j):
+	'''feeds aria2c the entries as they come, so that it starts with the first ones'''
 	aria2_opts = ['aria2c', '-i', '-', '-j', j]
 	aria2_opts.extend(get_config('aria2-opts', '').split())
 	from subprocess import Popen, PIPE
-	sub = Popen(aria2_opts, stdin=PIPE, bufsize=1, shell=True)
-	sub.communicate(aria2_conf)
-	sub.stdin.close()
+	sub = Popen(aria2_opts, stdin=PIPE)
+	try:
+		for entry in aria2_conf:
+			sub.stdin.write(entry)
+			sub.stdin.flush()
+		sub.stdin.close()
+	except IOError:
+		pass # aria2c exited, see its exit code
+	except:
+		sub.terminate()
+		raise
 	exit_code = sub.wait()
 	if exit_code != 0:
 		raise Exception('aria2c exited abnormaly')
@@ -60,28 +66,68 @@ def download_aria2_stdin(aria2_conf, j):
 def download_aria2_temp(aria2_conf, j):
 	import tempfile
 	temp = tempfile.NamedTemporaryFile('w', delete=False)
-	temp.file.write(aria2_conf)
-	temp.file.close()
 	try:
+		for entry in aria2_conf:
+			temp.file.write(entry)
+		temp.file.close()
 		aria2_opts = ['aria2c', '-i', temp.name, '-j', j]
 		aria2_opts.extend(get_config('aria2-opts', '').split())
 		import subprocess
 		exit_code = subprocess.call(aria2_opts)
 	finally:
+		temp.file.close()
 		import os
 		os.unlink(temp.name)
 	if exit_code != 0:
 		raise Exception('aria2c exited abnormaly')
 
+def download_aria2_rpc(client, files, j, hash):
+	import os.path
+	import lixian_aria2_rpc
+	from lixian_commands.download import escape_filename
+	rpc = lixian_aria2_rpc.get_rpc()
+	if lixian_aria2_rpc.started:
+		# not on an aria2c of the user's, which may be downloading other things
+		rpc.call('aria2.changeGlobalOption', {'max-concurrent-downloads': str(j)})
+	headers = {'Cookie': 'gdriveid=' + str(client.get_gdriveid())}
+	added = []
+	gids = []
+	for url, name, dir, task in files:
+		path = os.path.join(*map(escape_filename, ([dir] if dir else []) + name.split('\\'))).encode(default_encoding)
+		added.append((path, task))
+		gids.append(lixian_aria2_rpc.add_file(url, path, headers=headers))
+	lixian_aria2_rpc.wait(gids)
+	if hash:
+		from lixian_commands.download import verify_basic_hash
+		failed = [path for path, task in added if not verify_basic_hash(path, task)]
+		for path in failed:
+			print 'hash error:', path
+		if failed:
+			raise Exception('hash check failed')
+
 @command(usage='concurrently download tasks in aria2')
 @command_line_parser()
 @with_parser(parse_login)
 @command_line_option('all')
 @command_line_value('max-concurrent-downloads', alias='j', default=get_config('aria2-j', '5'))
+@command_line_option('rpc', default=get_config('aria2-rpc-download'))
+@command_line_option('hash', default=get_config('hash', True))
 def download_aria2(args):
 	'''
-	usage: lx download-aria2 -j 5 [id|name]...
+	usage: lx download-aria2 -j 5 [--rpc] [id|name]...
+
+	with --rpc, the files are added to the aria2c listening at aria2-rpc (see lixian_aria2_rpc),
+	and their hashes are checked once downloaded (unless --no-hash). -j is then only applied
+	to an aria2c started by lx: one already running keeps its own max-concurrent-downloads.
 	'''
+	if args.rpc:
+		client = create_client(args)
+		import lixian_progress
+		try:
+			download_aria2_rpc(client, export_aria2_files(client, args), args.max_concurrent_downloads, args.hash)
+		finally:
+			lixian_progress.finish() # prints the summary
+		return
 	aria2_conf = export_aria2_conf(args)
 	import platform
 	if platform.system() == 'Windows':
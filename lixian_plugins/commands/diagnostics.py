@@ -13,4 +13,17 @@ def lx_diagnostics(args):
 	print 'sys.getfilesystemencoding() ->', sys.getfilesystemencoding()
 	print r"print u'\u4e2d\u6587'.encode('utf-8') ->", u'\u4e2d\u6587'.encode('utf-8')
 	print r"print u'\u4e2d\u6587'.encode('gbk') ->", u'\u4e2d\u6587'.encode('gbk')
-
+	print
+	import lixian_download_auto
+	import lixian_util
+	print 'download tools (auto-tools) ->', ', '.join('%s%s' % (name, '' if ok else ' (not installed)') for name, ok in lixian_download_auto.get_candidates())
+	history = lixian_download_auto.get_history()
+	for size_class, limit in lixian_download_auto.size_classes:
+		scores = history.get(size_class)
+		if not scores:
+			continue
+		print '%s files%s:' % (size_class, ' (< %s)' % lixian_util.format_size(limit) if limit else '')
+		for name in sorted(scores, key=lambda name: -(scores[name]['speed'] or 0)):
+			score = scores[name]
+			speed = lixian_util.format_size(int(score['speed'])) + '/s' if score['speed'] is not None else '-'
+			print '  %-10s %10s  %d measured, %d failed, %d chosen' % (name, speed, score['samples'], score['failures'], score['chosen'])
@@ -8,12 +8,14 @@ def print_hash(args):
 	lx hash --md5 file...
 	lx hash --md4 file...
 	lx hash --dcid file...
+	lx hash --gcid file...
 	lx hash --ed2k file...
 	lx hash --info-hash xxx.torrent...
 	lx hash --verify-sha1 file hash
 	lx hash --verify-md5 file hash
 	lx hash --verify-md4 file hash
 	lx hash --verify-dcid file hash
+	lx hash --verify-gcid file hash
 	lx hash --verify-ed2k file ed2k://...
 	lx hash --verify-bt file xxx.torrent
 	'''
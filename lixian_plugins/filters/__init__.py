@@ -1,13 +1,45 @@
 
 import re
+from lixian_records import is_record
 
 name_filters = {}
 task_filters = {}
 
+lazy_filters = {}
+
+# (keyword, id(filters)) -> matcher or None, cleared when filters are defined
+matcher_cache = {}
+
+compiled_patterns = {}
+
+def compile_pattern(p):
+	if p not in compiled_patterns:
+		compiled_patterns[p] = re.compile(p)
+	return compiled_patterns[p]
+
+def register_lazy_filter(module, pattern):
+	'''the filter module is imported the first time a keyword matches pattern'''
+	lazy_filters[pattern] = module
+
+def load_lazy_filters(keyword):
+	for p in lazy_filters.keys():
+		if compile_pattern(p).search(keyword):
+			import lixian_plugins
+			lixian_plugins.load_module(lazy_filters.pop(p))
+
 def find_matcher(keyword, filters):
+	key = keyword, id(filters)
+	if key in matcher_cache:
+		return matcher_cache[key]
+	if lazy_filters:
+		load_lazy_filters(keyword)
+	matcher = None
 	for p in filters:
-		if re.search(p, keyword):
-			return filters[p]
+		if compile_pattern(p).search(keyword):
+			matcher = filters[p]
+			break
+	matcher_cache[key] = matcher
+	return matcher
 
 def has_task_filter(keyword):
 	return bool(find_matcher(keyword, task_filters))
@@ -29,18 +61,25 @@ def filter_things(things, keyword):
 	if not things:
 		# XXX: neither None or things should be OK
 		return things
-	assert len(set(map(type, things))) == 1
-	filters = task_filters if type(things[0]) == dict else name_filters
+	assert len(set(map(is_record, things))) == 1
+	filters = task_filters if is_record(things[0]) else name_filters
 	m = find_matcher(keyword, filters)
 	if m:
 		return filter_tasks_with_matcher(things, keyword, m)
 
 def define_task_filter(pattern, matcher, batch=False):
 	task_filters[pattern] = ('batch' if batch else 'single', matcher)
+	matcher_cache.clear()
 
-def define_name_filter(pattern, matcher):
-	name_filters[pattern] = ('single', matcher)
-	task_filters[pattern] = ('single', lambda k, x: matcher(k, x['name']))
+def define_name_filter(pattern, matcher, batch=False):
+	if batch:
+		# a batch name matcher takes the whole list, of tasks, files or names
+		name_filters[pattern] = ('batch', matcher)
+		task_filters[pattern] = ('batch', matcher)
+	else:
+		name_filters[pattern] = ('single', matcher)
+		task_filters[pattern] = ('single', lambda k, x: matcher(k, x['name']))
+	matcher_cache.clear()
 
 def task_filter(pattern=None, protocol=None, batch=False):
 	assert bool(pattern) ^ bool(protocol)
@@ -53,15 +92,15 @@ def task_filter(pattern=None, protocol=None, batch=False):
 		return matcher
 	return define_filter
 
-def name_filter(pattern=None, protocol=None):
+def name_filter(pattern=None, protocol=None, batch=False):
 	# FIXME: duplicate code
 	assert bool(pattern) ^ bool(protocol)
 	def define_filter(matcher):
 		if pattern:
-			define_name_filter(pattern, matcher)
+			define_name_filter(pattern, matcher, batch)
 		else:
 			assert re.match(r'^\w+$', protocol), protocol
-			define_name_filter(r'^%s:' % protocol, lambda k, x: matcher(re.sub(r'^\w+:', '', k), x))
+			define_name_filter(r'^%s:' % protocol, lambda k, x: matcher(re.sub(r'^\w+:', '', k), x), batch)
 		return matcher
 	return define_filter
 
@@ -1,9 +1,7 @@
 
 from lixian_plugins.api import name_filter
 
-import re
-
-@name_filter(protocol='raw')
-def filter_by_raw_text(keyword, name):
-	return keyword.lower() in name.lower()
-
+@name_filter(protocol='raw', batch=True)
+def filter_by_raw_text(keyword, things):
+	import lixian_name_index
+	return lixian_name_index.search_names(things, keyword)
@@ -1,19 +1,40 @@
 
 import re
+from lixian_records import is_record
 
 page_parsers = {}
 
 def register_parser(site, extend_link):
 	page_parsers[site] = extend_link
 
+def register_lazy_parser(module, site):
+	'''register a parser whose module is only imported when a link of site is parsed'''
+	def load():
+		import lixian_plugins
+		lixian_plugins.load_module(module)
+		assert page_parsers[site] is not lazy_parser, 'parser for %s not found in %s' % (site, module)
+		return page_parsers[site]
+	def lazy_parser(link):
+		return load()(link)
+	lazy_parser.load = load
+	register_parser(site, lazy_parser)
+
+
+# site -> (the literal prefix of site, its compiled pattern)
+site_patterns = {}
+
+def compile_site(site):
+	if site not in site_patterns:
+		import fnmatch
+		site_patterns[site] = site[:site.index('*')], re.compile(fnmatch.translate(site))
+	return site_patterns[site]
 
 def in_site(url, site):
 	if url.startswith(site):
 		return True
 	if '*' in site:
-		import fnmatch
-		p = fnmatch.translate(site)
-		return re.match(p, url)
+		prefix, p = compile_site(site)
+		return url.startswith(prefix) and p.match(url)
 
 def find_parser(link):
 	for p in page_parsers:
@@ -22,13 +43,13 @@ def find_parser(link):
 
 
 def to_name(x):
-	if type(x) == dict:
+	if is_record(x):
 		return x['name']
 	else:
 		return x
 
 def to_url(x):
-	if type(x) == dict:
+	if is_record(x):
 		return x['url']
 	else:
 		return x
@@ -44,7 +65,32 @@ def parse_pattern(link):
 			p = p[:-1]
 		return u, p
 
+# link -> outcome of extending it, for the links extended ahead by prefetch_links
+prefetched_links = {}
+
+def prefetch_links(links):
+	'''extends all the links which have a parser at once, fetching their pages concurrently'''
+	pending = []
+	for link in links:
+		if link in prefetched_links or link in pending:
+			continue
+		parser = find_parser(link)
+		if parser:
+			if hasattr(parser, 'load'):
+				# import lazy parsers here, not in the fetching threads
+				parser.load()
+			pending.append(link)
+	if pending:
+		import lixian_fetch
+		prefetched_links.update(zip(pending, lixian_fetch.fetch_all(parse_link, pending)))
+
 def try_to_extend_link(link):
+	if link in prefetched_links:
+		import lixian_fetch
+		return lixian_fetch.outcome_result(prefetched_links[link])
+	return parse_link(link)
+
+def parse_link(link):
 	parser = find_parser(link)
 	if parser:
 		x = parse_pattern(link)
@@ -59,6 +105,7 @@ def extend_link(link):
 	return try_to_extend_link(link) or [link]
 
 def extend_links_rich(links):
+	prefetch_links(links)
 	return sum(map(extend_link, links), [])
 
 def extend_links(links):
@@ -1,12 +1,12 @@
 
 from lixian_plugins.api import page_parser
+from lixian_plugins.api import fetch_page
 
-import urllib2
 import re
 
 def icili_links(url):
 	assert url.startswith('http://www.icili.com/emule/download/'), url
-	html = urllib2.urlopen(url).read()
+	html = fetch_page(url)
 	table = re.search(r'<table id="emuleFile">.*?</table>', html, flags=re.S).group()
 	links = re.findall(r'value="(ed2k://[^"]+)"', table)
 	return links
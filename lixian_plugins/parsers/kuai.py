@@ -1,5 +1,6 @@
 
 from lixian_plugins.api import page_parser
+from lixian_plugins.api import fetch_page
 
 import urllib
 import re
@@ -28,7 +29,12 @@ def parse_link(html):
 @page_parser('http://kuai.xunlei.com/d/')
 def kuai_links(url):
 	assert url.startswith('http://kuai.xunlei.com/d/'), url
-	html = urllib.urlopen(url).read().decode('utf-8')
+	import urllib2
+	try:
+		html = fetch_page(url)
+	except urllib2.HTTPError, e:
+		html = e.read() # the error page, which lists no files, as urllib.urlopen returned it
+	html = html.decode('utf-8')
 	#return re.findall(r'file_url="([^"]+)"', html)
 	#return map(parse_link, re.findall(r'<span class="f_w".*?</li>', html, flags=re.S))
 	return filter(bool, map(parse_link, re.findall(r'<span class="c_1">.*?</span>', html, flags=re.S)))
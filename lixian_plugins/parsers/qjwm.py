@@ -1,13 +1,13 @@
 
 from lixian_plugins.api import page_parser
+from lixian_plugins.api import fetch_page
 
-import urllib2
 import re
 
 def qjwm_link(url):
 	assert re.match(r'http://.*\.qjwm\.com/down(load)?_\d+.html', url)
 	url = url.replace('/down_', '/download_')
-	html = urllib2.urlopen(url).read()
+	html = fetch_page(url)
 	m = re.search(r'var thunder_url = "([^"]+)";', html)
 	if m:
 		url = m.group(1)
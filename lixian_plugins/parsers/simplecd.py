@@ -1,7 +1,7 @@
 
 from lixian_plugins.api import page_parser
+from lixian_plugins.api import fetch_page
 
-import urllib2
 import re
 
 
@@ -9,11 +9,11 @@ def simplecd_links(url):
 	m = re.match(r'(http://(?:www\.)?s[ia]mplecd\.\w+/)(id|entry)/', url)
 	assert m, url
 	site = m.group(1)
-	html = urllib2.urlopen(url).read()
+	html = fetch_page(url)
 	ids = re.findall(r'value="(\w+)"\s+name="selectemule"', html)
 	form = '&'.join('rid=' + id for id in ids)
 	q = 'mode=copy&' + form
-	html = urllib2.urlopen(site + 'download/?' + q).read()
+	html = fetch_page(site + 'download/?' + q)
 	table = re.search(r'<table id="showall" .*?</table>', html, flags=re.S).group()
 	links = re.findall(r'ed2k://[^\s<>]+', table)
 	import lixian_url
@@ -1,7 +1,7 @@
 
 from lixian_plugins.api import page_parser
+from lixian_plugins.api import fetch_page
 
-import urllib2
 import re
 
 def parse_links(html):
@@ -11,7 +11,7 @@ def parse_links(html):
 
 def verycd_links(url):
 	assert url.startswith('http://www.verycd.com/topics/'), url
-	return parse_links(urllib2.urlopen(url).read())
+	return parse_links(fetch_page(url))
 
 @page_parser('http://www.verycd.com/topics/')
 def extend_link(url):
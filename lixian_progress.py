@@ -1,5 +1,27 @@
 
+'''Progress bars, and progress events.
+
+Download tools and hash checks publish their progress as events, and the
+sinks subscribed render them:
+
+  TerminalSink  one progress bar for all the transfers going on
+  LogSink       every event as a line of JSON, in progress-log (if configured)
+  SummarySink   what the run did, printed by finish() (unless --no-progress-summary)
+
+An event is a dict: event (start, progress, phase, retry, stall, done or
+failed), time, id, name (the path), phase (download or hash), started (when
+the phase started), tool, total,
+completed, rate (bytes/s over the last rate_window seconds), eta (seconds),
+retries, stalls and message (of retry, stall and failed). progress events of a
+transfer are published at most every progress_interval seconds.
+'''
+
+import os
+import re
 import sys
+import threading
+import itertools
+from time import time
 
 class SimpleProgressBar:
 	def __init__(self):
@@ -28,3 +50,372 @@ class SimpleProgressBar:
 			print
 			self.displayed = False
 
+class ProgressBar:
+	def __init__(self, total=0):
+		self.total = total
+		self.completed = 0
+		self.start = time()
+		self.speed = 0
+		self.bar_width = 0
+		self.displayed = False
+		self.label = '' # after the bar
+	def update(self):
+		self.displayed = True
+		bar_size = 40
+		if self.total:
+			percent = self.completed * 100.0 / self.total
+			if percent > 100:
+				percent = 100.0
+			dots = int(bar_size * percent / 100)
+			plus = percent / 100 * bar_size - dots
+			if plus > 0.8:
+				plus = '='
+			elif plus > 0.4:
+				plus = '-'
+			else:
+				plus = ''
+			bar = '=' * dots + plus
+			percent = int(percent)
+		else:
+			percent = 0
+			bar = '-'
+		speed = self.speed
+		if speed < 1000:
+			speed = '%sB/s' % int(speed)
+		elif speed < 1000*10:
+			speed = '%.1fK/s' % (speed/1000.0)
+		elif speed < 1000*1000:
+			speed = '%dK/s' % int(speed/1000)
+		elif speed < 1000*1000*100:
+			speed = '%.1fM/s' % (speed/1000.0/1000.0)
+		else:
+			speed = '%dM/s' % int(speed/1000/1000)
+		seconds = time() - self.start
+		if seconds < 10:
+			seconds = '%.1fs' % seconds
+		elif seconds < 60:
+			seconds = '%ds' % int(seconds)
+		elif seconds < 60*60:
+			seconds = '%dm%ds' % (int(seconds/60), int(seconds)%60)
+		elif seconds < 60*60*24:
+			seconds = '%dh%dm%ds' % (int(seconds)/60/60, (int(seconds)/60)%60, int(seconds)%60)
+		else:
+			seconds = int(seconds)
+			days = seconds/60/60/24
+			seconds -= days*60*60*24
+			hours = seconds/60/60
+			seconds -= hours*60*60
+			minutes = seconds/60
+			seconds -= minutes*60
+			seconds = '%dd%dh%dm%ds' % (days, hours, minutes, seconds)
+		completed = ','.join((x[::-1] for x in reversed(re.findall('..?.?', str(self.completed)[::-1]))))
+		bar = '{0:>3}%[{1:<40}] {2:<12} {3:>4} in {4:>6s}'.format(percent, bar, completed, speed, seconds)
+		bar += self.label
+		new_bar_width = len(bar)
+		bar = bar.ljust(self.bar_width)
+		self.bar_width = new_bar_width
+		sys.stdout.write('\r'+bar)
+		sys.stdout.flush()
+	def update_status(self, total, completed):
+		self.total = total
+		self.completed = completed
+		self.update()
+	def update_speed(self, start, speed):
+		self.start = start
+		self.speed = speed
+		self.update()
+	def done(self):
+		if self.displayed:
+			print
+			self.displayed = False
+
+##################################################
+# progress events
+##################################################
+
+progress_interval = 0.5
+rate_window = 5
+
+lock = threading.RLock()
+sinks = None
+transfers = {} # name -> Transfer, while going on
+transfer_ids = itertools.count(1)
+
+def get_sinks():
+	global sinks
+	with lock:
+		if sinks is None:
+			from lixian_config import get_config
+			sinks = [TerminalSink()]
+			if get_config('progress-log'):
+				sinks.append(LogSink(os.path.expanduser(get_config('progress-log'))))
+			if get_config('progress-summary', True):
+				sinks.append(SummarySink())
+		return sinks
+
+def subscribe(sink):
+	with lock:
+		get_sinks().append(sink)
+
+def unsubscribe(sink):
+	with lock:
+		get_sinks().remove(sink)
+
+def after_fork():
+	'''to be called in a forked child: its events go nowhere, not to the sinks of the parent'''
+	global lock, sinks, transfers
+	lock = threading.RLock()
+	sinks = []
+	transfers = {}
+
+def publish(event):
+	with lock:
+		for sink in get_sinks():
+			sink.handle(event)
+
+def finish():
+	'''closes the sinks (SummarySink prints the summary then); the next event starts new ones'''
+	global sinks
+	with lock:
+		if sinks is not None:
+			for sink in sinks:
+				sink.close()
+			sinks = None
+
+def transfer(name, total=None, completed=None, phase=None, tool=None):
+	'''the transfer of name (a path), started if it's not going on already, as when a tool
+	reports the progress of a download which download_file reports too. each call is
+	matched by a done() or failed().'''
+	with lock:
+		t = transfers.get(name)
+		if t is None:
+			t = transfers[name] = Transfer(name, total, completed or 0, phase or 'download', tool)
+			t.publish('start')
+			return t
+		t.refs += 1
+	if tool and not t.tool:
+		t.tool = tool
+	if phase and phase != t.phase:
+		t.set_phase(phase, total, completed or 0)
+	elif total is not None or completed is not None:
+		t.update(t.completed if completed is None else completed, total, force=True)
+	return t
+
+class Transfer:
+	def __init__(self, name, total, completed, phase, tool):
+		self.id = transfer_ids.next()
+		self.name = name
+		self.total = total
+		self.completed = completed
+		self.phase = phase
+		self.tool = tool
+		self.retries = 0
+		self.stalls = 0
+		self.refs = 1
+		self.started = time()
+		self.samples = [(self.started, completed)]
+		self.published = 0
+
+	def rate(self):
+		now, completed = self.samples[-1]
+		then, before = self.samples[0]
+		if now - then < 0.1:
+			return 0
+		return (completed - before) / (now - then)
+
+	def publish(self, event, message=None):
+		rate = self.rate()
+		eta = (self.total - self.completed) / rate if rate and self.total else None
+		self.published = time()
+		publish({'event': event, 'time': self.published, 'id': self.id, 'name': self.name, 'phase': self.phase, 'started': self.started, 'tool': self.tool,
+		         'total': self.total, 'completed': self.completed, 'rate': rate, 'eta': eta,
+		         'retries': self.retries, 'stalls': self.stalls, 'message': message})
+
+	def update(self, completed, total=None, force=False):
+		now = time()
+		with lock:
+			if completed < self.completed:
+				self.samples = [] # started over
+			self.completed = completed
+			if total is not None:
+				self.total = total
+			self.samples.append((now, completed))
+			while len(self.samples) > 2 and self.samples[1][0] < now - rate_window:
+				self.samples.pop(0)
+			if force or now - self.published >= progress_interval:
+				self.publish('progress')
+
+	def fraction(self, fraction):
+		'''for progress callbacks in fractions of total'''
+		self.update(int(fraction * (self.total or 0)))
+
+	def set_phase(self, phase, total=None, completed=0):
+		with lock:
+			self.phase = phase
+			self.total = total
+			self.completed = completed
+			self.started = time()
+			self.samples = [(self.started, completed)]
+			self.publish('phase')
+
+	def retry(self, message):
+		with lock:
+			self.retries += 1
+			self.publish('retry', message)
+
+	def stall(self, message):
+		with lock:
+			self.stalls += 1
+			self.publish('stall', message)
+
+	def end(self, event, message=None):
+		with lock:
+			self.refs -= 1
+			if self.refs > 0:
+				if event == 'failed':
+					self.retry(message) # whoever started it may try again
+				return
+			del transfers[self.name]
+			self.publish(event, message)
+
+	def done(self, completed=None):
+		if completed is not None:
+			with lock:
+				self.completed = completed
+				self.samples.append((time(), completed))
+		self.end('done')
+
+	def failed(self, message):
+		self.end('failed', message)
+
+class TerminalSink:
+	'''one progress bar for all transfers, retries and stalls printed above it'''
+	def __init__(self):
+		self.bar = ProgressBar()
+		self.transfers = {} # id -> last event
+		self.finished = [] # done events, while the bar is displayed
+		self.rendered = 0
+
+	def handle(self, event):
+		if event['event'] in ('done', 'failed'):
+			self.transfers.pop(event['id'], None)
+		else:
+			self.transfers[event['id']] = event
+		if event['event'] == 'done' and self.bar.displayed:
+			self.finished.append(event)
+		if event['event'] in ('retry', 'stall', 'failed'):
+			self.end()
+			if event['event'] == 'retry':
+				print 'retry %d: %s' % (event['retries'], event['message'])
+			else:
+				print '%s: %s' % (event['event'], event['message'])
+		elif event['event'] == 'done' and not self.transfers:
+			if self.bar.displayed: # otherwise, the tool printed its own progress
+				self.render()
+			self.end()
+		elif event['event'] != 'start' and time() - self.rendered >= progress_interval:
+			self.render()
+
+	def render(self):
+		'''the bar of the transfers going on, and the ones done since the bar is displayed'''
+		events = self.transfers.values() + self.finished
+		totals = [e['total'] for e in events]
+		total = sum(totals) if None not in totals else 0
+		completed = sum(e['completed'] for e in events)
+		if self.bar.displayed and (self.bar.total, self.bar.completed) == (total, completed) and not self.transfers:
+			return # already displayed as is
+		self.bar.total = total
+		self.bar.completed = completed
+		self.bar.speed = sum(e['rate'] for e in (self.transfers.values() or self.finished))
+		self.bar.start = min(e['started'] for e in events)
+		phases = set(e['phase'] for e in events)
+		label = []
+		if len(events) > 1:
+			label.append('%d files' % len(events))
+		if phases != set(['download']):
+			label.append('/'.join(sorted(phases)))
+		self.bar.label = ' (%s)' % ', '.join(label) if label else ''
+		self.bar.update()
+		self.rendered = time()
+
+	def end(self):
+		self.bar.done()
+		self.finished = []
+
+	def close(self):
+		self.end()
+
+class LogSink:
+	'''every event as a line of JSON'''
+	def __init__(self, path):
+		self.file = open(path, 'a')
+
+	def handle(self, event):
+		import json
+		from lixian_encoding import default_encoding
+		# paths are bytes in the file system encoding, which may not be utf-8
+		event = dict((k, v.decode(default_encoding, 'replace') if type(v) == str else v) for k, v in event.items())
+		self.file.write(json.dumps(event) + '\n')
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
+
+class SummarySink:
+	'''counts what the run did, printed on close'''
+	def __init__(self):
+		self.current = {} # id -> [phase, start time, completed at start, completed]
+		self.phases = {} # phase -> [files, bytes, [(start, end)...]]
+		self.retries = 0
+		self.stalls = 0
+		self.failed = 0
+
+	def handle(self, event):
+		e = event['event']
+		current = self.current.get(event['id'])
+		if e == 'retry':
+			self.retries += 1
+		elif e == 'stall':
+			self.stalls += 1
+		elif e == 'failed':
+			self.failed += 1
+		if e == 'phase' and current:
+			self.count(current, event['time'])
+		if e in ('start', 'phase'):
+			self.current[event['id']] = [event['phase'], event['started'], event['completed'], event['completed']]
+		elif current:
+			current[3] = event['completed']
+		if e in ('done', 'failed'):
+			del self.current[event['id']]
+			if e == 'done':
+				self.count(current, event['time'])
+
+	def count(self, current, end):
+		phase, start, first, last = current
+		files, bytes, spans = self.phases.get(phase, [0, 0, []])
+		self.phases[phase] = [files + 1, bytes + max(last - first, 0), spans + [(start, end)]]
+
+	def seconds(self, spans):
+		'''the time spent, concurrent transfers counted once'''
+		seconds = 0
+		until = None
+		for start, end in sorted(spans):
+			if until is not None and start < until:
+				start = until
+			if end > start:
+				seconds += end - start
+			until = max(until, end)
+		return seconds
+
+	def close(self):
+		if not self.phases and not self.failed:
+			return
+		import lixian_util
+		parts = []
+		for phase in sorted(self.phases):
+			files, bytes, spans = self.phases[phase]
+			seconds = self.seconds(spans)
+			parts.append('%s %d file%s, %s in %.1fs (%s/s)' % ({'download': 'downloaded', 'hash': 'hashed'}.get(phase, phase), files, 's' if files != 1 else '',
+			             lixian_util.format_size(bytes), seconds, lixian_util.format_size(int(bytes / max(seconds, 0.001)))))
+		parts.append('%d retries, %d stalls, %d failed' % (self.retries, self.stalls, self.failed))
+		print '; '.join(parts)
@@ -75,7 +75,7 @@ class SubTaskQuery(ExactQuery):
 		self.subs = subs
 
 	def query_once(self):
-		task = dict(self.base.get_task_by_id(self.task['id']))
+		task = self.base.get_task_by_id(self.task['id']).copy()
 		files = self.base.get_files(task)
 		task['files'] = self.subs
 		return [task]
@@ -84,7 +84,7 @@ class SubTaskQuery(ExactQuery):
 		task = self.base.find_task_by_id(self.task['id'])
 		if not task:
 			return []
-		task = dict(task)
+		task = task.copy()
 		files = self.base.get_files(task)
 		task['files'] = self.subs
 		return [task]
@@ -251,15 +251,30 @@ def url_processor(base, url):
 ##################################################
 
 class BtUrlQuery(ExactQuery):
-	def __init__(self, base, url, torrent):
+	def __init__(self, base, url, torrent=None):
 		super(BtUrlQuery, self).__init__(base)
 		self.url = url
+		self.torrent = None
+		if torrent is not None:
+			self.set_torrent(torrent)
+
+	def set_torrent(self, torrent):
 		self.torrent = torrent
 		self.hash = lixian_hash_bt.info_hash_from_content(self.torrent)
-		self.task = self.base.find_task_by_hash(self.hash)
+
+	def needs_fetch(self):
+		return self.torrent is None
+
+	def fetch(self):
+		# the torrent is downloaded when the queries are prepared, along with the others
+		if self.torrent is None:
+			import sys
+			sys.stdout.write('Downloading torrent file from %s\n' % self.url)
+			import lixian_fetch
+			self.set_torrent(lixian_fetch.fetch(self.url))
 
 	def prepare(self):
-		if not self.task:
+		if not self.base.find_task_by_hash(self.hash):
 			self.base.add_bt_task_by_content(self.torrent, self.url)
 
 	def query_once(self):
@@ -268,6 +283,7 @@ class BtUrlQuery(ExactQuery):
 		return [t]
 
 	def query_search(self):
+		self.fetch()
 		t = self.base.find_task_by_hash(self.hash)
 		return [t] if t else []
 
@@ -275,10 +291,7 @@ class BtUrlQuery(ExactQuery):
 def bt_url_processor(base, url):
 	if not re.match(r'http://', url):
 		return
-	print 'Downloading torrent file from', url
-	import urllib2
-	torrent = urllib2.urlopen(url, timeout=60).read()
-	return BtUrlQuery(base, url, torrent)
+	return BtUrlQuery(base, url)
 
 ##################################################
 
@@ -308,7 +321,7 @@ class DefaultQuery(SearchQuery):
 		self.text = lixian_encoding.from_native(x)
 
 	def query_search(self):
-		return filter(lambda t: t['name'].lower().find(self.text.lower()) != -1, self.base.get_tasks())
+		return self.base.find_tasks_by_name(self.text)
 
 @query(priority=9)
 @bt_query(priority=9)
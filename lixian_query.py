@@ -1,10 +1,11 @@
 
 __all__ = ['query', 'bt_query', 'user_query', 'Query', 'ExactQuery', 'SearchQuery',
-           'build_query', 'find_tasks_to_download', 'search_tasks', 'expand_bt_sub_tasks']
+           'build_query', 'find_tasks_to_download', 'search_tasks', 'expand_bt_sub_tasks', 'iter_download_files']
 
 import lixian_hash_bt
 import lixian_hash_ed2k
 import lixian_encoding
+from lixian_records import is_record
 
 
 def link_normalize(url):
@@ -24,15 +25,94 @@ def link_equals(x1, x2):
 	return link_normalize(x1) == link_normalize(x2)
 
 
+not_bt = object()
+
+class TaskIndex(object):
+	'''lookups by id, hash and url over a task list, each built on first use.
+
+	Every lookup returns the first matching task, as a scan of the list would.
+	If a key can't be computed for some task (the scan would raise there), that
+	lookup falls back to scanning the list, errors included.
+	'''
+	def __init__(self, tasks):
+		self.tasks = tasks
+		self.indexes = {}
+
+	def index(self, name, keys):
+		if name not in self.indexes:
+			positions = {}
+			try:
+				for i, k in enumerate(keys()):
+					positions.setdefault(k, i)
+			except Exception:
+				positions = None
+			self.indexes[name] = positions
+		return self.indexes[name]
+
+	def find_by_id(self, id):
+		tasks = self.tasks
+		ids = self.index('id', lambda: (t['id'] for t in tasks))
+		numbers = self.index('#', lambda: (t['#'] for t in tasks))
+		if ids is None or numbers is None:
+			return self.scan_by_id(id)
+		if not tasks:
+			return
+		i = ids.get(str(id))
+		if i == 0:
+			return tasks[0]
+		# int(id) is only evaluated when the first task doesn't match, like in the scan
+		j = numbers.get(int(id))
+		if i is None or (j is not None and j < i):
+			i = j
+		if i is not None:
+			return tasks[i]
+
+	def scan_by_id(self, id):
+		for t in self.tasks:
+			if t['id'] == str(id) or t['#'] == int(id):
+				return t
+
+	def find_by_hash(self, hash):
+		tasks = self.tasks
+		hashes = self.index('hash', lambda: (t['bt_hash'].lower() if t['type'] == 'bt' else not_bt for t in tasks))
+		if hashes is None:
+			return self.scan_by_hash(hash)
+		i = hashes.get(hash)
+		if i is not None:
+			return tasks[i]
+
+	def scan_by_hash(self, hash):
+		for t in self.tasks:
+			if t['type'] == 'bt' and t['bt_hash'].lower() == hash:
+				return t
+
+	def find_by_url(self, url):
+		tasks = self.tasks
+		urls = self.index('url', lambda: (link_normalize(t['original_url']) for t in tasks))
+		if urls is None or not tasks:
+			return self.scan_by_url(url)
+		i = urls.get(link_normalize(url))
+		if i is not None:
+			return tasks[i]
+
+	def scan_by_url(self, url):
+		for t in self.tasks:
+			if link_equals(t['original_url'], url):
+				return t
+
 class TaskBase(object):
-	def __init__(self, client, list_tasks):
+	def __init__(self, client, list_tasks, iter_task_pages=None):
 		self.client = client
 		self.fetch_tasks = list_tasks
+		self.iter_task_pages = iter_task_pages
 
 		self.queries = []
 
 		self.tasks = None
+		self.task_index = None
 		self.files = {}
+		# ids of the tasks which are new or changed since the previous refresh_status
+		self.updated_ids = None
 
 		self.commit_jobs = [[], []]
 
@@ -54,18 +134,22 @@ class TaskBase(object):
 		return self.tasks
 
 	def get_files(self, task):
-		assert isinstance(task, dict), task
+		assert is_record(task), task
 		id = task['id']
 		if id in self.files:
 			return self.files[id]
 		self.files[id] = self.client.list_bt(task)
 		return self.files[id]
 
+	def get_task_index(self):
+		tasks = self.get_tasks()
+		if self.task_index is None or self.task_index.tasks is not tasks:
+			self.task_index = TaskIndex(tasks)
+		return self.task_index
+
 	def find_task_by_id(self, id):
 		assert isinstance(id, basestring), repr(id)
-		for t in self.get_tasks():
-			if t['id'] == str(id) or t['#'] == int(id):
-				return t
+		return self.get_task_index().find_by_id(id)
 
 	def get_task_by_id(self, id):
 		t = self.find_task_by_id(id)
@@ -73,15 +157,16 @@ class TaskBase(object):
 			raise Exception('No task found for id '+id)
 		return t
 
+	def find_tasks_by_name(self, text):
+		'''tasks whose name contains text, ignoring case'''
+		import lixian_name_index
+		return lixian_name_index.search_names(self.get_tasks(), text)
+
 	def find_task_by_hash(self, hash):
-		for t in self.get_tasks():
-			if t['type'] == 'bt' and t['bt_hash'].lower() == hash:
-				return t
+		return self.get_task_index().find_by_hash(hash)
 
 	def find_task_by_url(self, url):
-		for t in self.get_tasks():
-			if link_equals(t['original_url'], url):
-				return t
+		return self.get_task_index().find_by_url(url)
 
 	def get_task_by_url(self, url):
 		t = self.find_task_by_url(url)
@@ -103,6 +188,9 @@ class TaskBase(object):
 
 	def commit(self):
 		urls, bts = self.commit_jobs
+		if not urls and not bts:
+			# nothing added, the task list is still fresh
+			return
 		if urls:
 			self.client.add_batch_tasks(map(lixian_encoding.try_native_to_utf_8, urls))
 		for bt_type, value in bts:
@@ -121,7 +209,14 @@ class TaskBase(object):
 		self.commit_jobs = [[], []]
 		self.refresh_tasks()
 
+	def fetch(self):
+		import lixian_fetch
+		queries = [q for q in self.queries if q.needs_fetch()]
+		lixian_fetch.raise_first_error(lixian_fetch.fetch_all(lambda query: query.fetch(), queries))
+
 	def prepare(self):
+		# fetch remote resources (e.g. torrent files) of all queries at once
+		self.fetch()
 		# prepare actions (e.g. add tasks)
 		for query in self.queries:
 			query.prepare()
@@ -175,27 +270,71 @@ class TaskBase(object):
 					else:
 						i_waiting.append(f)
 				if i_completed:
-					tt = dict(t)
+					tt = t.copy()
 					tt['files'] = i_completed
 					completed.append(tt)
 				if i_waiting:
-					tt = dict(t)
+					tt = t.copy()
 					tt['files'] = i_waiting
 					waiting.append(tt)
 		self.download_jobs = waiting
 		return completed
 
+	def fetch_pending_tasks(self):
+		'''reads task pages only until all tasks of download_jobs are found'''
+		pending = set(t['id'] for t in self.download_jobs)
+		tasks = []
+		# one page after another, as the tasks are usually on the first pages
+		for page in self.iter_task_pages(concurrency=1):
+			tasks.extend(page)
+			pending.difference_update(t['id'] for t in page)
+			if not pending:
+				break
+		return tasks
+
 	def refresh_status(self):
-		self.refresh_tasks()
+		'''refreshes the tasks of download_jobs, for watch mode.
+
+		when no search query is left (they would look for new tasks), only the
+		pages up to the last task still waited for are read. bt files are listed
+		again only for tasks whose status or progress changed.
+		'''
+		old_tasks = self.tasks or []
+		if self.queries or not self.iter_task_pages:
+			self.refresh_tasks()
+		else:
+			self.tasks = self.fetch_pending_tasks()
+		old_status = dict((t['id'], task_status(t)) for t in old_tasks)
+		self.updated_ids = set(t['id'] for t in self.tasks if old_status.get(t['id']) != task_status(t))
+		old_files = self.files
 		self.files = {}
 		tasks = []
 		for old_task in self.download_jobs:
-			new_task = dict(self.get_task_by_id(old_task['id']))
+			new_task = self.get_task_by_id(old_task['id']).copy()
 			if 'files' in old_task:
-				files = self.get_files(new_task)
+				id = new_task['id']
+				if id in old_files and task_status(new_task) == task_status(old_task):
+					self.files[id] = old_files[id]
+				files = dict((f['index'], f) for f in self.get_files(new_task))
 				new_task['files'] = [files[f['index']] for f in old_task['files']]
 			tasks.append(new_task)
 		self.download_jobs = tasks
+		self.merge_results()
+
+	def query_search_updates(self):
+		'''like query_search, after refresh_status, but only takes the tasks which are new or changed since
+		the previous refresh, so that tasks already pulled (and downloaded) are not queued again'''
+		results = []
+		for query in self.queries:
+			results += query.query_search()
+		updated_ids = self.updated_ids
+		if updated_ids is not None:
+			results = [t for t in results if t['id'] in updated_ids]
+		self.download_jobs += results
+		self.merge_results()
+
+def task_status(task):
+	return task['status'], task['progress']
 
 class Query(object):
 	def __init__(self, base):
@@ -209,6 +348,13 @@ class Query(object):
 	def unregister(self):
 		self.base.unregister_query(self)
 
+	def needs_fetch(self):
+		return False
+
+	def fetch(self):
+		# network work needed by prepare, run concurrently for all queries before they are prepared
+		pass
+
 	def prepare(self):
 		pass
 
@@ -284,6 +430,8 @@ def user_query(processor):
 
 def load_default_queries():
 	import lixian_queries
+	import lixian_plugins
+	lixian_plugins.load_query_plugins()
 
 
 ##################################################
@@ -304,8 +452,24 @@ def to_list_tasks(client, args):
 	else:
 		return client.read_all_tasks
 
+def to_iter_task_pages(client, args):
+	'''a page by page version of to_list_tasks, when there is one'''
+	if args.category or args.deleted or args.expired:
+		return
+	return client.iter_task_pages
+
+# id(processors) -> (len(processors), processors sorted by priority)
+dispatch_tables = {}
+
+def dispatch_table(processors):
+	'''processors sorted by priority, sorted again only when new ones are registered'''
+	table = dispatch_tables.get(id(processors))
+	if table is None or table[0] != len(processors):
+		table = dispatch_tables[id(processors)] = len(processors), [p for _, p in sorted(processors)]
+	return table[1]
+
 def to_query(base, arg, processors):
-	for _, process in sorted(processors):
+	for process in dispatch_table(processors):
 		q = process(base, arg)
 		if q:
 			return q
@@ -324,7 +488,7 @@ def merge_tasks(tasks):
 	result_tasks = []
 	task_mapping = {}
 	for task in tasks:
-		assert type(task) == dict, repr(type)
+		assert is_record(task), repr(type(task))
 		id = task['id']
 		assert 'index' not in task
 		if id in task_mapping:
@@ -332,7 +496,7 @@ def merge_tasks(tasks):
 				task_mapping[id]['files'] = merge_files(task_mapping[id]['files'], task['files'])
 		else:
 			if 'files' in task:
-				t = dict(task)
+				t = task.copy()
 				result_tasks.append(t)
 				task_mapping[id] = t
 			else:
@@ -380,7 +544,9 @@ def build_query(client, args):
 		import fileinput
 		args._left.extend(line.strip() for line in fileinput.input(args.input) if line.strip())
 	load_default_queries() # IMPORTANT: init default queries
-	base = TaskBase(client, to_list_tasks(client, args))
+	import lixian_plugins.parsers
+	lixian_plugins.parsers.prefetch_links(args)
+	base = TaskBase(client, to_list_tasks(client, args), to_iter_task_pages(client, args))
 	base.register_queries(parse_queries(base, args))
 	return base
 
@@ -407,7 +573,7 @@ def expand_bt_sub_tasks(task):
 	if 'files' in task:
 		ordered_files = []
 		for t in task['files']:
-			assert isinstance(t, dict)
+			assert is_record(t)
 			if t['status_text'] != 'completed':
 				not_ready.append(t)
 			else:
@@ -415,6 +581,27 @@ def expand_bt_sub_tasks(task):
 		files = ordered_files
 	return files, not_ready, single_file
 
+def iter_download_files(client, tasks, concurrency=None):
+	'''yields (url, name, dir, task or bt file) for each file of tasks, in order, as soon as it's known.
+	the bt file lists are fetched ahead, in up to concurrency (default: client.page_concurrency) threads.'''
+	from lixian import imap_ordered
+	def expand(task):
+		if task['type'] == 'bt':
+			return task, expand_bt_sub_tasks(task)
+		return task, None
+	for task, expanded in imap_ordered(expand, tasks, concurrency or client.page_concurrency):
+		if expanded is None:
+			yield task['xunlei_url'], task['name'], None, task
+			continue
+		subs, skipped, single_file = expanded
+		if not subs:
+			continue
+		if single_file:
+			yield subs[0]['xunlei_url'], subs[0]['name'], None, subs[0]
+		else:
+			for f in subs:
+				yield f['xunlei_url'], f['name'], task['name'], f
+
 
 ##################################################
 # simple helpers
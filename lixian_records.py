@@ -0,0 +1,220 @@
+
+'''Compact records for tasks and BT sub-files.
+
+A big account (or a BT pack with thousands of files) used to mean one dict of
+~16 keys per task, copied again by the query engine. Records keep the known
+fields in __slots__, derive status_text and gcid on demand, and still behave
+like dicts (task['name'], 'files' in task, task.get(...), dict(task)), so
+plugins written against dicts keep working. Unknown keys go to a small
+per-record dict, created only when needed.
+'''
+
+__all__ = ['TaskRecord', 'FileRecord', 'is_record', 'parse_gcid']
+
+import re
+
+status_texts = {0: 'waiting', 1: 'downloading', 2: 'completed', 3: 'failed', 5: 'pending'}
+status_codes = dict((v, k) for k, v in status_texts.items())
+
+def parse_gcid(url):
+	if not url:
+		return
+	m = re.search(r'&g=([A-F0-9]{40})&', url)
+	if not m:
+		return
+	return m.group(1)
+
+missing = object()
+
+class Record(object):
+	__slots__ = ['_extra']
+
+	# key -> attribute, for keys stored in slots
+	slot_keys = {}
+	# key -> attribute, for all keys which can be read as attributes (including derived ones)
+	key_attrs = {}
+
+	def __init__(self, **fields):
+		self._extra = None
+		slot_keys = self.slot_keys
+		for k, v in fields.iteritems():
+			attr = slot_keys.get(k)
+			if attr is not None:
+				setattr(self, attr, v)
+			else:
+				self[k] = v
+
+	def __getitem__(self, key):
+		try:
+			attr = self.key_attrs[key]
+		except KeyError:
+			extra = self._extra
+			if extra is not None and key in extra:
+				return extra[key]
+			raise
+		try:
+			return getattr(self, attr)
+		except AttributeError:
+			raise KeyError(key)
+
+	def __setitem__(self, key, value):
+		attr = self.slot_keys.get(key)
+		if attr is not None:
+			setattr(self, attr, value)
+		elif key in self.key_attrs:
+			# a derived key
+			setattr(self, self.key_attrs[key], value)
+		else:
+			if self._extra is None:
+				self._extra = {}
+			self._extra[key] = value
+
+	def __delitem__(self, key):
+		extra = self._extra
+		if extra is not None and key in extra:
+			del extra[key]
+			return
+		try:
+			delattr(self, self.slot_keys[key])
+		except (KeyError, AttributeError):
+			raise KeyError(key)
+
+	def __contains__(self, key):
+		try:
+			self[key]
+			return True
+		except KeyError:
+			return False
+
+	has_key = __contains__
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def keys(self):
+		keys = [k for k in self.key_attrs if k not in self.derived_keys and hasattr(self, self.key_attrs[k])]
+		keys.extend(k for k in self.derived_keys if k not in keys and k in self)
+		if self._extra:
+			keys.extend(k for k in self._extra if k not in keys)
+		return keys
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	iterkeys = __iter__
+
+	def __len__(self):
+		return len(self.keys())
+
+	def values(self):
+		return [self[k] for k in self.keys()]
+
+	def items(self):
+		return [(k, self[k]) for k in self.keys()]
+
+	def iteritems(self):
+		return iter(self.items())
+
+	def update(self, other=(), **kwargs):
+		if hasattr(other, 'keys'):
+			for k in other.keys():
+				self[k] = other[k]
+		else:
+			for k, v in other:
+				self[k] = v
+		for k in kwargs:
+			self[k] = kwargs[k]
+
+	def setdefault(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			self[key] = default
+			return default
+
+	def pop(self, key, *default):
+		try:
+			value = self[key]
+		except KeyError:
+			if default:
+				return default[0]
+			raise
+		del self[key]
+		return value
+
+	def copy(self):
+		'''a shallow copy, like dict.copy'''
+		cls = self.__class__
+		r = cls.__new__(cls)
+		for attr in cls.all_slots:
+			value = getattr(self, attr, missing)
+			if value is not missing:
+				setattr(r, attr, value)
+		r._extra = dict(self._extra) if self._extra else None
+		return r
+
+	def __eq__(self, other):
+		if not is_record(other):
+			return NotImplemented
+		return dict(self.items()) == dict(other.items())
+
+	def __ne__(self, other):
+		eq = self.__eq__(other)
+		return eq if eq is NotImplemented else not eq
+
+	__hash__ = None
+
+	def __repr__(self):
+		return '%s(%r)' % (self.__class__.__name__, dict(self.items()))
+
+	# derived fields
+
+	def get_status_text(self):
+		return status_texts[self.status]
+
+	def set_status_text(self, text):
+		self.status = status_codes[text]
+
+	status_text = property(get_status_text, set_status_text)
+
+	def get_gcid(self):
+		try:
+			return self._gcid
+		except AttributeError:
+			self._gcid = parse_gcid(self.xunlei_url)
+			return self._gcid
+
+	def set_gcid(self, gcid):
+		self._gcid = gcid
+
+	gcid = property(get_gcid, set_gcid)
+
+def define_record(cls):
+	'''fill in the key tables of a record class from its __slots__'''
+	renamed = {'#': 'number', 'gcid': '_gcid'}
+	attrs = dict((v, k) for k, v in renamed.items())
+	cls.slot_keys = dict((attrs.get(attr, attr), attr) for attr in cls.__slots__)
+	cls.key_attrs = dict((key, key if key in cls.derived_keys else attr) for key, attr in cls.slot_keys.items())
+	for key in cls.derived_keys:
+		cls.key_attrs[key] = key
+	cls.all_slots = ['_extra'] + list(cls.__slots__)
+	return cls
+
+@define_record
+class TaskRecord(Record):
+	__slots__ = ['id', 'type', 'name', 'status', 'expired', 'size', 'original_url', 'xunlei_url',
+	             'bt_hash', 'dcid', '_gcid', 'date', 'progress', 'speed', 'client', 'number', 'files', 'base']
+	derived_keys = ['status_text', 'gcid']
+
+@define_record
+class FileRecord(Record):
+	__slots__ = ['id', 'index', 'type', 'name', 'status', 'size', 'original_url', 'xunlei_url',
+	             'dcid', '_gcid', 'date', 'progress', 'speed']
+	derived_keys = ['status_text', 'gcid']
+
+def is_record(x):
+	'''True for tasks and files, as records or plain dicts'''
+	return isinstance(x, (dict, Record))
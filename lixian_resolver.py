@@ -0,0 +1,142 @@
+
+'''Host name resolution shared by the download tools and XunleiClient.
+
+Resolved addresses are kept in memory for ttl seconds, and failures for
+negative_ttl seconds, so retries and the many requests to the same Xunlei
+hosts don't go to the DNS server every time. Concurrent lookups of the same
+host wait for a single query.
+
+submit runs a (resolving) function in a small pool of threads, for event loops
+which must not block on DNS (see lixian_download_engine). CachedHTTPHandler and
+urlopen make urllib2 use the cache.
+'''
+
+__all__ = ['resolve', 'submit', 'create_connection', 'CachedHTTPHandler', 'urlopen']
+
+import socket
+import threading
+import httplib
+import urllib2
+from time import time
+
+ttl = 300
+negative_ttl = 30
+pool_size = 4
+
+cache = {} # host -> (expires, True, addresses) or (expires, False, error)
+pending = {} # host -> threading.Event, while it's being resolved
+lock = threading.Lock()
+
+def lookup(host):
+	addresses = []
+	for family, socktype, proto, canonname, address in socket.getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM):
+		if address[0] not in addresses:
+			addresses.append(address[0])
+	return addresses
+
+def resolve(host):
+	'''the IPv4 addresses of host, in DNS order. raises socket.gaierror if it can't be resolved.'''
+	while True:
+		with lock:
+			entry = cache.get(host)
+			if entry and entry[0] > time():
+				resolving = False
+				break
+			event = pending.get(host)
+			if event is None:
+				pending[host] = threading.Event()
+				resolving = True
+				break
+		event.wait(1) # with a timeout, so that Ctrl-C still works
+	if resolving:
+		entry = None
+		try:
+			try:
+				entry = time() + ttl, True, lookup(host)
+			except socket.gaierror, e:
+				entry = time() + negative_ttl, False, e
+		finally:
+			with lock:
+				if entry:
+					cache[host] = entry
+				pending.pop(host).set()
+	expires, ok, result = entry
+	if not ok:
+		raise result
+	return list(result)
+
+class Pool:
+	def __init__(self, size):
+		import Queue
+		self.size = size
+		self.queue = Queue.Queue()
+		self.threads = []
+		self.lock = threading.Lock()
+
+	def submit(self, f, callback):
+		with self.lock:
+			self.threads = [thread for thread in self.threads if thread.is_alive()]
+			if len(self.threads) < self.size:
+				thread = threading.Thread(target=self.work)
+				thread.daemon = True
+				thread.start()
+				self.threads.append(thread)
+		self.queue.put((f, callback))
+
+	def work(self):
+		while True:
+			f, callback = self.queue.get()
+			try:
+				result = True, f()
+			except Exception, e:
+				result = False, e
+			try:
+				callback(*result)
+			except Exception:
+				# a broken callback must not take the worker down with it
+				import traceback
+				import lixian_logging
+				lixian_logging.get_logger().debug(traceback.format_exc())
+
+pool = Pool(pool_size)
+
+def submit(f, callback):
+	'''calls f() in a pool thread, then callback(True, result) or callback(False, exception) in that thread'''
+	pool.submit(f, callback)
+
+def after_fork():
+	'''to be called in a forked child: the pool threads and the lookups going on stayed in the parent'''
+	global lock, pending, pool
+	lock = threading.Lock()
+	pending = {}
+	pool = Pool(pool_size)
+
+def create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+	'''like socket.create_connection, with cached addresses'''
+	host, port = address
+	error = None
+	for ip in resolve(host):
+		try:
+			return socket.create_connection((ip, port), timeout, source_address)
+		except socket.error, e:
+			error = e
+	raise error
+
+class HTTPConnection(httplib.HTTPConnection):
+	def connect(self):
+		self.sock = create_connection((self.host, self.port), self.timeout, self.source_address)
+		if self._tunnel_host:
+			self._tunnel()
+
+class CachedHTTPHandler(urllib2.HTTPHandler):
+	def http_open(self, req):
+		return self.do_open(HTTPConnection, req)
+
+opener = None
+
+def urlopen(url, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+	'''urllib2.urlopen, through the cache'''
+	global opener
+	if opener is None:
+		opener = urllib2.build_opener(CachedHTTPHandler())
+	return opener.open(url, timeout=timeout)
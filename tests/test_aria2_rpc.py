@@ -0,0 +1,68 @@
+
+'''usage: python -m unittest discover tests'''
+
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import SimpleHTTPServer
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+import fake_aria2
+import lixian_aria2_rpc
+
+class FileHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+	def log_message(self, format, *args):
+		pass
+
+class Aria2RpcTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp(prefix='lixian-test-')
+		with open(os.path.join(self.dir, 'a.bin'), 'wb') as x:
+			x.write(os.urandom(300*1024))
+		self.cwd = os.getcwd()
+		os.chdir(self.dir) # served by FileHandler
+		self.http = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FileHandler)
+		thread = threading.Thread(target=self.http.serve_forever)
+		thread.daemon = True
+		thread.start()
+		self.base_url = 'http://127.0.0.1:%d/' % self.http.server_address[1]
+		self.aria2 = fake_aria2.start_server(secret='test')
+		lixian_aria2_rpc.rpc = lixian_aria2_rpc.Aria2Rpc(self.aria2.url, 'test')
+
+	def tearDown(self):
+		lixian_aria2_rpc.rpc = None
+		self.aria2.shutdown()
+		self.http.shutdown()
+		os.chdir(self.cwd)
+		shutil.rmtree(self.dir, ignore_errors=True)
+
+	def test_add_file_and_wait(self):
+		path = os.path.join(self.dir, 'out', 'a.bin')
+		gid = lixian_aria2_rpc.add_file(self.base_url + 'a.bin', path, headers={'Cookie': 'gdriveid=x'})
+		lixian_aria2_rpc.wait([gid], progress=False)
+		with open(os.path.join(self.dir, 'a.bin'), 'rb') as expected, open(path, 'rb') as downloaded:
+			self.assertEqual(expected.read(), downloaded.read())
+		self.assertEqual(self.aria2.counts.get('aria2.removeDownloadResult'), 1)
+		self.assertEqual(lixian_aria2_rpc.paths, {})
+		self.assertEqual(self.aria2.aria2.downloads, {})
+
+	def test_wait_raises_on_failure(self):
+		gids = [lixian_aria2_rpc.add_file(self.base_url + name, os.path.join(self.dir, 'out', name)) for name in ('a.bin', 'missing.bin')]
+		self.assertRaises(lixian_aria2_rpc.Aria2Error, lixian_aria2_rpc.wait, gids, progress=False)
+		self.assertTrue(os.path.exists(os.path.join(self.dir, 'out', 'a.bin')))
+		self.assertEqual(lixian_aria2_rpc.paths, {})
+
+	def test_wrong_secret(self):
+		lixian_aria2_rpc.rpc = lixian_aria2_rpc.Aria2Rpc(self.aria2.url, 'wrong')
+		self.assertRaises(lixian_aria2_rpc.Aria2Error, lixian_aria2_rpc.add_file, self.base_url + 'a.bin', os.path.join(self.dir, 'a2.bin'))
+
+if __name__ == '__main__':
+	unittest.main()
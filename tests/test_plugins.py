@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+'''usage: python -m unittest discover tests'''
+
+import os
+import os.path
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+find_parsers = '''
+from lixian_plugins.parsers import find_parser
+find_parser('\\xe4\\xb8\\xad\\xe6\\x96\\x87')
+find_parser('http://\\xe4\\xb8\\xad\\xe6\\x96\\x87/')
+'''
+
+class LazyPluginsTest(unittest.TestCase):
+	def setUp(self):
+		self.home = tempfile.mkdtemp(prefix='lixian-test-')
+
+	def tearDown(self):
+		shutil.rmtree(self.home, ignore_errors=True)
+
+	def run_python(self, code, **env):
+		env = dict(os.environ, HOME=self.home, LIXIAN_HOME=self.home, PYTHONPATH=root, **env)
+		env.pop('LIXIAN_EAGER_PLUGINS', None)
+		process = subprocess.Popen([sys.executable, '-c', code], cwd=self.home, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+		output = process.communicate()[0]
+		self.assertEqual(process.returncode, 0, output)
+
+	def test_non_ascii_link_with_cached_manifest(self):
+		self.run_python(find_parsers) # builds and saves the manifest
+		self.assertTrue(os.path.exists(os.path.join(self.home, '.xunlei.lixian.plugins')))
+		self.run_python(find_parsers) # registers what was read back from the manifest
+
+if __name__ == '__main__':
+	unittest.main()